@@ -1,37 +1,263 @@
 import os
-from flask import Flask, jsonify, request, abort, send_from_directory
-from werkzeug.utils import secure_filename
+import json
+import shutil
+import zipfile
+import tempfile
+from flask import Flask, Response, jsonify, request, abort, send_from_directory, stream_with_context
+from werkzeug.datastructures import ImmutableMultiDict
+
+from storage import open_store
+from icons import IconStore, InvalidIcon
 
 app = Flask(__name__)
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}  # допустимые форматы
+PRODUCT_FIELDS = ('id', 'name', 'description', 'icon_url')  # что можно запросить в ?fields=
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH = 500  # столько продуктов склеивается в один кусок потокового ответа
+# Иконка по адресу с ?v=<версия продукта> никогда не меняется — её можно кэшировать сколько угодно,
+# без версии — недолго, а потом перепроверять по ETag
+ICON_MAX_AGE = 3600
+ICON_VERSIONED_MAX_AGE = 365 * 24 * 3600
+ICON_PENDING_MAX_AGE = 10  # пока иконка обрабатывается
+BULK_OPS = ('create', 'update', 'delete')
+BULK_SPOOL_SIZE = 8 * 1024 * 1024  # тело массового запроса больше этого копится во временном файле
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Путь к базе SQLite; PRODUCTS_DB=memory — хранить продукты только в памяти процесса
+app.config['PRODUCTS_DB'] = os.environ.get(
+    'PRODUCTS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'products.db'))
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-products = {}
-next_id = 1
+products = open_store(app.config['PRODUCTS_DB'])
+# Загрузки сохраняются по содержимому и обрабатываются в фоне (уменьшенные копии, WebP)
+icons = IconStore(UPLOAD_FOLDER, products)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# 1. GET /products — получить список всех продуктов (без файлов, только метаданные)
+def product_info(prod, fields=PRODUCT_FIELDS):
+    # Поля продукта для ответа: вместо имени файла иконки — её URL
+    info = {
+        "id": prod["id"],
+        "name": prod["name"],
+        "description": prod["description"],
+        "icon_url": f"/products/{prod['id']}/icon?v={prod['version']}" if prod.get("icon_filename") else None
+    }
+    if fields is not PRODUCT_FIELDS:
+        info = {k: info[k] for k in fields}
+    return info
+
+# ETag продукта меняется вместе с его версией, ETag списка — при любом изменении коллекции
+def product_etag(prod):
+    return f"{prod['id']}-{prod['version']}"
+
+def not_modified(etag):
+    # 304 без тела, если у клиента уже есть этот вариант (сравнение по If-None-Match — слабое)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # хранить можно, но перед использованием — перепроверить ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def save_icon(icon_file):
+    # Иконка из формы -> icon_filename; сама обработка картинки идёт в фоне.
+    # Иконка удерживается (hold), пока продукт со ссылкой на неё не записан: иначе release()
+    # из другого запроса с той же картинкой удалил бы её. Вызывающий обязан сделать unhold()
+    if icon_file.filename == '':
+        abort(400, description="Empty filename")
+    if not allowed_file(icon_file.filename):
+        abort(400, description="File type not allowed")
+    try:
+        return icons.save_upload(icon_file.stream, hold=True)
+    except InvalidIcon as e:
+        abort(400, description=f"Invalid image: {e}")
+
+def int_arg(name, default, minimum, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, description=f"'{name}' must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        abort(400, description=f"'{name}' must be between {minimum} and {maximum}" if maximum is not None
+              else f"'{name}' must be at least {minimum}")
+    return value
+
+def stream_products(rows, fields, fmt):
+    # Выгрузка без сборки всего списка в памяти: строки из хранилища сразу уходят клиенту
+    # пачками по STREAM_BATCH (NDJSON — объект на строку, json — один массив)
+    def generate():
+        batch = []
+        first = True
+        if fmt == 'json':
+            yield '['
+        for prod in rows:
+            batch.append(app.json.dumps(product_info(prod, fields)))
+            if len(batch) >= STREAM_BATCH:
+                yield chunk(batch, first)
+                batch = []
+                first = False
+        if batch:
+            yield chunk(batch, first)
+        if fmt == 'json':
+            yield ']'
+
+    def chunk(batch, first):
+        if fmt == 'ndjson':
+            return '\n'.join(batch) + '\n'
+        return ('' if first else ',') + ','.join(batch)
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+class BulkItemError(Exception):
+    # Ошибка одной строки массового запроса: попадает в её результат, а не в ответ целиком
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class BulkRollback(Exception):
+    pass
+
+def bulk_input():
+    # Строки NDJSON с операциями, функция «имя иконки -> поток с файлом» (None — иконок нет)
+    # и файлы запроса, которые надо закрыть по окончании.
+    # Flask закрывает request.files, как только view вернул ответ, а потоковый ответ
+    # читает их позже — поэтому файлы забираются у запроса и закрываются в конце ответа
+    if request.mimetype == 'multipart/form-data':
+        files = request.files.to_dict()
+        request.files = ImmutableMultiDict()
+        if 'items' in files:
+            lines = files['items'].stream
+        elif 'items' in request.form:
+            lines = request.form['items'].splitlines()
+        else:
+            close_all(files.values())
+            abort(400, description="Missing 'items' part")
+        archive = None
+        if 'archive' in files:
+            try:
+                archive = zipfile.ZipFile(files['archive'].stream)
+            except zipfile.BadZipFile:
+                close_all(files.values())
+                abort(400, description="'archive' is not a zip file")
+
+        def open_icon(name):
+            if name in files:
+                return files[name].stream
+            if archive is not None:
+                try:
+                    return archive.open(name)
+                except KeyError:
+                    pass
+            raise BulkItemError(400, f"Icon '{name}' not found in the request")
+        return lines, open_icon, list(files.values())
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # Тело читается целиком до начала ответа: клиент, который сначала отправляет
+        # всё тело и только потом читает ответ, иначе упрётся в заполненные буферы сокета
+        body = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_SIZE)
+        shutil.copyfileobj(request.stream, body)
+        body.seek(0)
+        return body, None, [body]
+    abort(415, description="Expected application/x-ndjson or multipart/form-data")
+
+def close_all(files):
+    for f in files:
+        f.close()
+
+def apply_bulk_item(item, open_icon, saved, released):
+    # Выполняет одну операцию; результат для ответа или BulkItemError.
+    # saved — сохранённые иконки (удерживаются до конца транзакции, см. IconStore.save_upload),
+    # released — иконки, на которые продукты больше не ссылаются
+    if not isinstance(item, dict):
+        raise BulkItemError(400, "Expected a JSON object")
+    op = item.get('op', 'create')
+    if op not in BULK_OPS:
+        raise BulkItemError(400, f"'op' must be one of {', '.join(BULK_OPS)}")
+    fields = {}
+    for key in ('name', 'description'):
+        if key in item:
+            if not isinstance(item[key], str):
+                raise BulkItemError(400, f"'{key}' must be a string")
+            fields[key] = item[key]
+    if op != 'create' and not isinstance(item.get('id'), int):
+        raise BulkItemError(400, "'id' must be an integer")
+    if op == 'delete':
+        prod = products.delete(item['id'])
+        if not prod:
+            raise BulkItemError(404, "Product not found")
+        released.append(prod.get('icon_filename'))
+        return {'status': 204, 'id': prod['id']}
+    if op == 'create' and len(fields) < 2:
+        raise BulkItemError(400, "Missing 'name' or 'description'")
+    if item.get('icon') is not None:
+        name = item['icon']
+        if not isinstance(name, str) or not allowed_file(name):
+            raise BulkItemError(400, "File type not allowed")
+        if open_icon is None:
+            raise BulkItemError(400, "Icons need a multipart/form-data request")
+        try:
+            fields['icon_filename'] = icons.save_upload(open_icon(name), hold=True)
+        except InvalidIcon as e:
+            raise BulkItemError(400, f"Invalid image: {e}")
+        saved.append(fields['icon_filename'])
+    if op == 'create':
+        prod = products.create(fields['name'], fields['description'], fields.get('icon_filename'))
+        return {'status': 201, 'id': prod['id'], 'product': product_info(prod)}
+    old = products.get(item['id'])
+    if not old:
+        raise BulkItemError(404, "Product not found")
+    prod = products.update(item['id'], **fields)
+    if 'icon_filename' in fields and old.get('icon_filename') != prod['icon_filename']:
+        released.append(old.get('icon_filename'))
+    return {'status': 200, 'id': prod['id'], 'product': product_info(prod)}
+
+# 1. GET /products — список продуктов (без файлов, только метаданные)
+#    ?limit=N&after=ID — страница из N продуктов с id > ID, в ответе next_after для следующей
+#    ?name_prefix=... / ?name_contains=... — фильтры по имени (с учётом регистра)
+#    ?fields=id,name — только перечисленные поля
+#    ?format=ndjson — потоковая выгрузка по объекту на строку; без limit в формате json
+#    отдаётся потоковый массив всех подходящих продуктов
 @app.route('/products', methods=['GET'])
 def get_all_products():
-    # Возвращаем все поля, кроме закодированной иконки; вместо иконки отдаём URL, если есть
-    result = []
-    for prod in products.values():
-        info = {
-            "id": prod["id"],
-            "name": prod["name"],
-            "description": prod["description"],
-            "icon_url": f"/products/{prod['id']}/icon" if prod.get("icon_filename") else None
-        }
-        result.append(info)
-    return jsonify(result), 200
+    # Версию читаем до выборки: если коллекция поменяется во время запроса,
+    # клиент получит более старый ETag и в следующий раз просто скачает список заново
+    etag = f"c{products.collection_version()}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    limit = int_arg('limit', None, 1, MAX_PAGE_SIZE)
+    after = int_arg('after', 0, 0)
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'ndjson'):
+        abort(400, description="'format' must be 'json' or 'ndjson'")
+    fields = PRODUCT_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(','))
+        unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+        if unknown:
+            abort(400, description=f"Unknown fields: {', '.join(unknown)}")
+    rows = products.list(after=after, limit=limit,
+                         name_prefix=request.args.get('name_prefix') or None,
+                         name_contains=request.args.get('name_contains') or None)
+    if limit is None or fmt == 'ndjson':
+        return with_etag(stream_products(rows, fields, fmt), etag)
+    page = list(rows)
+    items = [product_info(prod, fields) for prod in page]
+    next_after = page[-1]['id'] if len(page) == limit else None
+    return with_etag(jsonify({"items": items, "next_after": next_after}), etag), 200
 
 # 2. GET /products/<id> — получить продукт по id (с URL иконки)
 @app.route('/products/<int:product_id>', methods=['GET'])
@@ -39,15 +265,15 @@ def get_product(product_id):
     prod = products.get(product_id)
     if not prod:
         abort(404, description="Product not found")
-    info = {
-        "id": prod["id"],
-        "name": prod["name"],
-        "description": prod["description"],
-        "icon_url": f"/products/{prod['id']}/icon" if prod.get("icon_filename") else None
-    }
-    return jsonify(info), 200
+    etag = product_etag(prod)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return with_etag(jsonify(product_info(prod)), etag), 200
 
 # 2.1 GET /products/<id>/icon — вернуть файл иконки (если есть)
+#     Отдаётся самый лёгкий готовый вариант в формате из Accept (WebP, если клиент его понимает);
+#     ?size=N — не меньше N пикселей по большей стороне (уменьшенная копия вместо оригинала)
 @app.route('/products/<int:product_id>/icon', methods=['GET'])
 def get_product_icon(product_id):
     prod = products.get(product_id)
@@ -56,93 +282,163 @@ def get_product_icon(product_id):
     filename = prod.get("icon_filename")
     if not filename:
         abort(404, description="Icon not found")
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    size = int_arg('size', None, 1)
+    path, mimetype, final = icons.choose(filename, request.accept_mimetypes, size)
+    if path is None:
+        products.clear_icon(filename)
+        abort(404, description="Icon not found")
+    if not final:
+        # оригинал вместо ещё не готовых вариантов — надолго его кэшировать нельзя
+        max_age = ICON_PENDING_MAX_AGE
+    elif request.args.get('v') == str(prod['version']):
+        max_age = ICON_VERSIONED_MAX_AGE
+    else:
+        max_age = ICON_MAX_AGE
+    # send_from_directory сам отвечает 304 на совпавший If-None-Match;
+    # у каждого варианта свой ETag, а ответ зависит от Accept
+    etag = f"{product_etag(prod)}-{os.path.basename(path).replace('.', '-')}"
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], path, mimetype=mimetype,
+                                   etag=etag, max_age=max_age)
+    response.vary.add('Accept')
+    if max_age == ICON_VERSIONED_MAX_AGE:
+        response.cache_control.immutable = True
+    return response
 
 # 3. POST /products — создать новый продукт (multipart/form-data)
 @app.route('/products', methods=['POST'])
 def create_product():
-    global next_id
     if 'name' not in request.form or 'description' not in request.form:
         abort(400, description="Missing 'name' or 'description' in form data")
     name = request.form['name']
     description = request.form['description']
     icon_file = request.files.get('icon')
-    icon_filename = None
-    if icon_file:
-        if icon_file.filename == '':
-            abort(400, description="Empty filename")
-        if not allowed_file(icon_file.filename):
-            abort(400, description="File type not allowed")
-        filename = secure_filename(icon_file.filename)
-        filename = f"{next_id}_{filename}"
-        icon_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        icon_filename = filename
-    prod = {
-        "id": next_id,
-        "name": name,
-        "description": description,
-        "icon_filename": icon_filename
-    }
-    products[next_id] = prod
-    next_id += 1
-    response = {
-        "id": prod["id"],
-        "name": prod["name"],
-        "description": prod["description"],
-        "icon_url": f"/products/{prod['id']}/icon" if icon_filename else None
-    }
-    return jsonify(response), 201
+    filename = save_icon(icon_file) if icon_file else None
+    try:
+        prod = products.create(name, description, filename)
+    finally:
+        if filename:
+            icons.unhold(filename)
+    response = jsonify(product_info(prod))
+    response.set_etag(product_etag(prod))
+    return response, 201
 
 # 4. PUT /products/<id> — обновить продукт (multipart/form-data)
 @app.route('/products/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
-    if product_id not in products:
+    prod = products.get(product_id)
+    if not prod:
         abort(404, description="Product not found")
     if 'name' not in request.form or 'description' not in request.form:
         abort(400, description="Missing 'name' or 'description' in form data")
-    prod = products[product_id]
-    prod['name'] = request.form['name']
-    prod['description'] = request.form['description']
+    fields = {'name': request.form['name'], 'description': request.form['description']}
     icon_file = request.files.get('icon')
     if icon_file:
-        if icon_file.filename == '':
-            abort(400, description="Empty filename")
-        if not allowed_file(icon_file.filename):
-            abort(400, description="File type not allowed")
-        filename = secure_filename(icon_file.filename)
-        filename = f"{product_id}_{filename}"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        icon_file.save(save_path)
-        old_fn = prod.get("icon_filename")
-        if old_fn:
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], old_fn))
-            except OSError:
-                pass
-        prod["icon_filename"] = filename
-    response = {
-        "id": prod["id"],
-        "name": prod["name"],
-        "description": prod["description"],
-        "icon_url": f"/products/{prod['id']}/icon" if prod.get("icon_filename") else None
-    }
-    return jsonify(response), 200
+        fields["icon_filename"] = save_icon(icon_file)
+    try:
+        updated = products.update(product_id, **fields)
+    finally:
+        if icon_file:
+            icons.unhold(fields["icon_filename"])
+    if not updated:
+        icons.release(fields.get("icon_filename"))
+        abort(404, description="Product not found")
+    # старая иконка удаляется, только если на неё больше никто не ссылается
+    if icon_file and prod.get("icon_filename") != updated["icon_filename"]:
+        icons.release(prod.get("icon_filename"))
+    prod = updated
+    response = jsonify(product_info(prod))
+    response.set_etag(product_etag(prod))
+    return response, 200
 
 # 5. DELETE /products/<id> — удалить продукт и файл-иконку, если есть
 @app.route('/products/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
-    prod = products.get(product_id)
+    prod = products.delete(product_id)
     if not prod:
         abort(404, description="Product not found")
-    # Удаляем файл-иконку, если он есть
-    fn = prod.get("icon_filename")
-    if fn:
-        try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], fn))
-        except OSError:
-            pass
-    del products[product_id]
+    # Удаляем иконку, если других продуктов с такой же картинкой нет
+    icons.release(prod.get("icon_filename"))
     return '', 204
 
+# 6. POST /products/bulk — создать, изменить и удалить много продуктов одной транзакцией
+#    Тело — NDJSON (application/x-ndjson), по операции на строку:
+#      {"op": "create", "name": "...", "description": "...", "icon": "a.png"}
+#      {"op": "update", "id": 5, "name": "..."}   — меняются только переданные поля
+#      {"op": "delete", "id": 7}
+#    Или multipart/form-data: часть items с тем же NDJSON, а иконки — файлами формы
+#    или zip-архивом в части archive ("icon" — имя части формы или файла в архиве).
+#    Ответ — поток NDJSON, и начинается он только после того, как транзакция сохранена
+#    или откачена: клиент, который медленно читает ответ, не держит блокировку базы.
+#    В нём результат каждой строки ({"line", "applied": true, "status", "id", "product"},
+#    {"line", "applied": false, "status", "error"}, а при откате для успешных строк
+#    {"line", "applied": false, "error": "Rolled back"}) и итог
+#    {"done": true, "committed", "created", "updated", "deleted", "failed"}.
+#    Строки с ошибками пропускаются, остальные сохраняются вместе в конце;
+#    ?atomic=1 — при первой ошибке откатить всё.
+@app.route('/products/bulk', methods=['POST'])
+def bulk_products():
+    atomic = request.args.get('atomic', '').lower() in ('1', 'true', 'yes')
+    lines, open_icon, files = bulk_input()
+
+    def generate():
+        counts = {'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+        counters = {201: 'created', 200: 'updated', 204: 'deleted'}
+        saved, released = [], []
+        committed = False
+        # Результаты строк копятся во временном файле: внутри транзакции клиенту не уходит
+        # ничего (в SQLite она держит блокировку записи, пока не закончится), да и отдавать их
+        # можно, только когда известно, сохранена ли она (при откате id созданных продуктов не заняты)
+        with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_SIZE, mode='w+') as results:
+            try:
+                with products.transaction():
+                    for number, line in enumerate(lines, 1):
+                        if not line.strip():
+                            continue
+                        result = {'line': number}
+                        try:
+                            try:
+                                item = json.loads(line)
+                            except ValueError:
+                                raise BulkItemError(400, "Invalid JSON")
+                            result.update(apply_bulk_item(item, open_icon, saved, released))
+                            counts[counters[result['status']]] += 1
+                        except BulkItemError as e:
+                            result.update(status=e.status, error=str(e))
+                            counts['failed'] += 1
+                        results.write(app.json.dumps(result) + '\n')
+                        if atomic and 'error' in result:
+                            raise BulkRollback()
+                committed = True
+            except BulkRollback:
+                pass
+            finally:
+                close_all(files)
+                for filename in saved:
+                    icons.unhold(filename)
+                # Иконки удаляются, только если на них никто не ссылается: после отката это
+                # сохранённые в запросе, после сохранения — ещё и замещённые и удалённые
+                for filename in (saved + released if committed else saved):
+                    icons.release(filename)
+            if not committed:
+                counts.update(created=0, updated=0, deleted=0)
+            results.seek(0)
+            batch = []
+            for line in results:
+                result = json.loads(line)
+                if 'error' in result:
+                    result['applied'] = False
+                elif committed:
+                    result['applied'] = True
+                else:
+                    result = {'line': result['line'], 'applied': False, 'error': "Rolled back"}
+                batch.append(app.json.dumps(result))
+                if len(batch) >= STREAM_BATCH:
+                    yield '\n'.join(batch) + '\n'
+                    batch = []
+        batch.append(app.json.dumps(dict(done=True, committed=committed, **counts)))
+        yield '\n'.join(batch) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,94 @@
+import io
+import os
+import struct
+import tempfile
+import zlib
+
+os.environ.setdefault('PRODUCTS_DB', 'memory')
+
+import app as shop
+from icons import IconStore
+
+# Одинаковые картинки хранятся один раз (по sha256), поэтому удаление одного продукта
+# может освободить иконку, которую прямо сейчас загружает другой запрос.
+# Запуск: python3 icon_race_tests.py
+
+
+def make_png(width=2, height=2):
+    def chunk(kind, data):
+        return struct.pack('!I', len(data)) + kind + data + struct.pack('!I', zlib.crc32(kind + data))
+    raw = b''.join(b'\x00' + b'\xff\x00\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('!IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def setup():
+    folder = tempfile.mkdtemp(prefix='uploads-')
+    shop.app.config['UPLOAD_FOLDER'] = folder
+    shop.icons = IconStore(folder, shop.products)
+    return shop.app.test_client()
+
+
+def release_during(method_name, icon_owner_id):
+    # Пока запрос между save_upload и записью продукта, другой запрос удаляет
+    # продукт с той же картинкой и освобождает её
+    original = getattr(shop.products, method_name)
+
+    def racing(*args, **kwargs):
+        gone = shop.products.delete(icon_owner_id)
+        shop.icons.release(gone['icon_filename'])
+        return original(*args, **kwargs)
+
+    setattr(shop.products, method_name, racing)
+    return lambda: setattr(shop.products, method_name, original)
+
+
+def upload(client, method, url, png):
+    return client.open(url, method=method, content_type='multipart/form-data',
+                       data={'name': 'p', 'description': 'd', 'icon': (io.BytesIO(png), 'icon.png')})
+
+
+def check_icon(client, product_id):
+    shop.icons.wait()
+    response = client.get(f'/products/{product_id}/icon')
+    assert response.status_code == 200, response.status_code
+    assert shop.products.get(product_id)['icon_filename'], 'icon reference was cleared'
+
+
+def test_create_keeps_icon_released_concurrently(client):
+    png = make_png(3, 3)
+    owner = upload(client, 'POST', '/products', png).get_json()['id']
+    shop.icons.wait()
+    restore = release_during('create', owner)
+    try:
+        created = upload(client, 'POST', '/products', png).get_json()['id']
+    finally:
+        restore()
+    check_icon(client, created)
+    print('create: icon survives a concurrent release of the same picture')
+
+
+def test_update_keeps_icon_released_concurrently(client):
+    png = make_png(4, 4)
+    owner = upload(client, 'POST', '/products', png).get_json()['id']
+    target = client.post('/products', data={'name': 'p', 'description': 'd'}).get_json()['id']
+    shop.icons.wait()
+    restore = release_during('update', owner)
+    try:
+        upload(client, 'PUT', f'/products/{target}', png)
+    finally:
+        restore()
+    check_icon(client, target)
+    print('update: icon survives a concurrent release of the same picture')
+
+
+def main():
+    print('=== Icon race tests ===\n')
+    client = setup()
+    test_create_keeps_icon_released_concurrently(client)
+    test_update_keeps_icon_released_concurrently(client)
+    print('\n=== All icon race tests completed ===')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import os
+import io
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow иконки только проверяются по сигнатуре и отдаются как загружены
+    Image = None
+
+# Обработка загруженных иконок.
+# Загрузка целиком пишется во временный файл (с подсчётом sha256 по ходу записи) и сразу
+# переносится в <uploads>/icons/<2 символа хэша>/<хэш>/orig.<ext> — одинаковые картинки
+# хранятся один раз, сколько бы продуктов на них ни ссылалось. Запрос на этом заканчивается,
+# а пул фоновых потоков проверяет картинку и делает уменьшенные копии и варианты WebP.
+# Когда всё готово, рядом появляется variants.json — по нему GET иконки выбирает вариант.
+
+ICON_DIR = 'icons'
+TMP_DIR = 'tmp'
+MANIFEST = 'variants.json'
+THUMBNAIL_SIZES = (64, 256)        # по большей стороне, в пикселях
+MAX_ICON_PIXELS = 4096 * 4096      # больше — отказываемся разбирать (защита от «бомб» распаковки)
+ICON_WORKERS = 2
+COPY_CHUNK = 64 * 1024
+WEBP_QUALITY = 80
+# Первые байты файлов допустимых форматов: без Pillow проверяется только это
+SIGNATURES = {b'\x89PNG\r\n\x1a\n': 'image/png', b'\xff\xd8\xff': 'image/jpeg',
+              b'GIF87a': 'image/gif', b'GIF89a': 'image/gif'}
+PIL_FORMATS = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'GIF': 'image/gif'}
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+
+class InvalidIcon(ValueError):
+    pass
+
+
+def _sniff(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    for signature, mime in SIGNATURES.items():
+        if head.startswith(signature):
+            return mime
+    raise InvalidIcon('not a PNG, JPEG or GIF image')
+
+
+class IconStore:
+    def __init__(self, upload_folder, products, workers=ICON_WORKERS):
+        self.upload_folder = upload_folder
+        self.products = products
+        self.lock = threading.Lock()   # решения «файл уже есть» и «файл больше не нужен» не пересекаются
+        self.pending = {}              # каталог иконки -> Future её обработки
+        self.released = set()          # каталоги, которые освободили, пока шла обработка
+        # каталоги, на которые ссылаются ещё не закоммиченные продукты (массовый импорт):
+        # release() из других запросов их не видит в базе, но удалять их нельзя
+        self.held = Counter()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='icons')
+        os.makedirs(os.path.join(upload_folder, TMP_DIR), exist_ok=True)
+
+    def save_upload(self, stream, hold=False):
+        # Сохраняет загрузку и ставит её в очередь на обработку, возвращает icon_filename для продукта.
+        # Здесь проверяется только сигнатура файла (InvalidIcon), картинку целиком разбирает обработчик.
+        # hold=True — не удалять иконку, пока не вызван unhold() (ссылка на неё ещё в транзакции)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=os.path.join(self.upload_folder, TMP_DIR))
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            mime = _sniff(tmp_path)
+            digest = digest.hexdigest()
+            rel_dir = os.path.join(ICON_DIR, digest[:2], digest)
+            icon_filename = os.path.join(rel_dir, f'orig.{EXTENSIONS[mime]}')
+            with self.lock:
+                path = os.path.join(self.upload_folder, icon_filename)
+                if os.path.exists(path):
+                    # такая картинка уже есть — второй копии не нужно
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                self.released.discard(rel_dir)
+                if hold:
+                    self.held[rel_dir] += 1
+                self._submit_locked(rel_dir, icon_filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return icon_filename
+
+    def _submit_locked(self, rel_dir, icon_filename):
+        if rel_dir in self.pending:
+            return
+        if os.path.exists(os.path.join(self.upload_folder, rel_dir, MANIFEST)):
+            return
+        future = self.executor.submit(self._process, rel_dir, icon_filename)
+        self.pending[rel_dir] = future
+
+    def wait(self):
+        # Дождаться обработки всего, что уже в очереди
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.result()
+
+    def unhold(self, icon_filename):
+        rel_dir = os.path.dirname(icon_filename)
+        with self.lock:
+            self.held[rel_dir] -= 1
+            if self.held[rel_dir] <= 0:
+                del self.held[rel_dir]
+
+    def release(self, icon_filename):
+        # Продукт больше не ссылается на иконку: если не ссылается и никто другой, удаляем её
+        if not icon_filename:
+            return
+        path = os.path.join(self.upload_folder, icon_filename)
+        with self.lock:
+            if self.products.icon_in_use(icon_filename):
+                return
+            if not icon_filename.startswith(ICON_DIR + os.sep):
+                # иконка, сохранённая до появления обработки, — просто файл
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                return
+            rel_dir = os.path.dirname(icon_filename)
+            if rel_dir in self.held:
+                return
+            if rel_dir in self.pending:
+                self.released.add(rel_dir)  # удалит сам обработчик, когда закончит
+                return
+            shutil.rmtree(os.path.join(self.upload_folder, rel_dir), ignore_errors=True)
+
+    def _process(self, rel_dir, icon_filename):
+        directory = os.path.join(self.upload_folder, rel_dir)
+        try:
+            manifest = self._make_variants(directory, os.path.join(self.upload_folder, icon_filename))
+        except (InvalidIcon, OSError, ValueError) as e:
+            print(f"[!] Icon {icon_filename} rejected: {e}")
+            manifest = None
+        with self.lock:
+            self.pending.pop(rel_dir, None)
+            if manifest is None:
+                self.released.discard(rel_dir)
+                shutil.rmtree(directory, ignore_errors=True)
+            # продукт получает icon_filename уже после save_upload, поэтому «никто не ссылается»
+            # значит «не нужна», только если иконку явно освободили через release()
+            elif (rel_dir in self.released and rel_dir not in self.held
+                  and not self.products.icon_in_use(icon_filename)):
+                self.released.discard(rel_dir)
+                shutil.rmtree(directory, ignore_errors=True)
+            else:
+                self.released.discard(rel_dir)
+                _write_atomic(os.path.join(directory, MANIFEST), json.dumps(manifest).encode())
+        if manifest is None:
+            # запись — вне self.lock: она может ждать, пока массовый импорт держит базу,
+            # а импорт тем временем сохраняет иконки. Не вышло — ссылку уберёт GET иконки
+            try:
+                self.products.clear_icon(icon_filename)
+            except Exception as e:
+                print(f"[!] Could not clear rejected icon {icon_filename}: {e}")
+
+    def _make_variants(self, directory, original):
+        mime = _sniff(original)
+        variants = [{'file': os.path.basename(original), 'mime': mime, 'bytes': os.path.getsize(original)}]
+        if Image is None:
+            return {'mime': mime, 'variants': variants}
+        try:
+            with Image.open(original) as img:
+                if img.format not in PIL_FORMATS or PIL_FORMATS[img.format] != mime:
+                    raise InvalidIcon(f'unexpected image format {img.format}')
+                if img.width * img.height > MAX_ICON_PIXELS:
+                    raise InvalidIcon(f'image too large: {img.width}x{img.height}')
+                img.verify()
+            with Image.open(original) as img:
+                img.load()
+                width, height = img.size
+                variants[0].update(width=width, height=height)
+                if getattr(img, 'n_frames', 1) > 1:
+                    # анимацию не пережимаем, чтобы её не потерять
+                    return {'mime': mime, 'width': width, 'height': height, 'variants': variants}
+                img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+                fallback = 'JPEG' if mime == 'image/jpeg' else 'PNG'
+                sizes = [size for size in THUMBNAIL_SIZES if size < max(width, height)] + [None]
+                for size in sizes:
+                    scaled = img
+                    if size is not None:
+                        scaled = img.copy()
+                        scaled.thumbnail((size, size), Image.LANCZOS)
+                    formats = [('WEBP', 'image/webp')]
+                    if size is not None:
+                        formats.append((fallback, f'image/{fallback.lower()}'))
+                    for fmt, fmt_mime in formats:
+                        name = f"{size or 'full'}.{EXTENSIONS[fmt_mime]}"
+                        buf = io.BytesIO()
+                        options = {'quality': WEBP_QUALITY} if fmt == 'WEBP' else {'optimize': True}
+                        scaled.save(buf, fmt, **options)
+                        _write_atomic(os.path.join(directory, name), buf.getvalue())
+                        variants.append({'file': name, 'mime': fmt_mime, 'bytes': buf.tell(),
+                                         'width': scaled.width, 'height': scaled.height})
+        except (Image.DecompressionBombError, SyntaxError) as e:
+            raise InvalidIcon(str(e))
+        return {'mime': mime, 'width': width, 'height': height, 'variants': variants}
+
+    def choose(self, icon_filename, accept, size=None):
+        # Вариант иконки для ответа: (путь относительно uploads, mime, final).
+        # Из вариантов в форматах, которые принимает клиент (accept — request.accept_mimetypes),
+        # и не меньше запрошенного размера берётся самый лёгкий. Пока иконка обрабатывается
+        # или если это старая иконка без вариантов, отдаётся загруженный файл (mime — None).
+        # final=False — ответ временный: после обработки по тому же адресу будет другой вариант.
+        # (None, None, False) — файла нет: иконка оказалась битой и уже удалена.
+        rel_dir = os.path.dirname(icon_filename)
+        manifest_path = os.path.join(self.upload_folder, rel_dir, MANIFEST)
+        try:
+            with open(manifest_path, 'rb') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            if not os.path.exists(os.path.join(self.upload_folder, icon_filename)):
+                # картинку отбросил обработчик раньше, чем продукт успел на неё сослаться
+                return None, None, False
+            if not icon_filename.startswith(ICON_DIR + os.sep):
+                return icon_filename, None, True
+            with self.lock:
+                # обработка могла потеряться при перезапуске — запускаем заново
+                self._submit_locked(rel_dir, icon_filename)
+            return icon_filename, None, False
+        original = manifest['variants'][0]
+        if size is None or 'width' not in manifest:
+            wanted = None
+        else:
+            wanted = min(size, max(manifest['width'], manifest['height']))
+        best = original
+        for variant in manifest['variants'][1:]:
+            if not accept[variant['mime']]:
+                continue
+            if wanted is not None and max(variant['width'], variant['height']) < wanted:
+                continue
+            if wanted is None and variant['width'] != manifest['width']:
+                continue
+            if variant['bytes'] < best['bytes'] or not accept[best['mime']]:
+                best = variant
+        return os.path.join(rel_dir, best['file']), best['mime'], True
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
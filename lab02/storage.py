@@ -0,0 +1,374 @@
+import os
+import sqlite3
+import contextlib
+import threading
+
+# Хранилище продуктов для app.py. Продукт — словарь {id, name, description, icon_filename, version}.
+# version растёт при каждом изменении продукта, версия коллекции (collection_version) —
+# при любом создании, изменении или удалении; из них app.py строит ETag.
+# SQLiteProductStore — основное: данные переживают перезапуск, и несколько процессов
+# (например, воркеры gunicorn) работают с одной базой. MemoryProductStore — запасной
+# вариант без файлов, для тестов и экспериментов.
+# transaction() объединяет изменения (массовый импорт) в одну транзакцию: при исключении
+# внутри блока ни одно из них не сохраняется.
+
+FIELDS = ('id', 'name', 'description', 'icon_filename')
+COLUMNS = 'id, name, description, icon_filename, version'
+BUSY_TIMEOUT_MS = 5000  # сколько ждать, пока другой процесс держит блокировку записи
+MIN_TRIGRAM = 3         # подстроки короче триграммы индекс не ускоряет — для них обычный перебор
+
+
+def _matches(prod, after, name_prefix, name_contains):
+    return (prod['id'] > after
+            and (not name_prefix or prod['name'].startswith(name_prefix))
+            and (not name_contains or name_contains in prod['name']))
+
+
+def _glob_escape(text):
+    # В GLOB спецсимволы * ? [ экранируются квадратными скобками
+    return ''.join(f'[{ch}]' if ch in '*?[' else ch for ch in text)
+
+
+class MemoryProductStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.products = {}
+        self.next_id = 1
+        self.version = 1
+        self.local = threading.local()  # tx — незакоммиченные изменения транзакции этого потока
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Изменения внутри транзакции копятся в отдельном слое (tx: id -> запись) и видны
+        # только её потоку; остальные запросы видят прежнее состояние. На commit слой
+        # переносится в общий словарь под блокировкой, при откате просто отбрасывается.
+        # Долгую блокировку транзакция не держит, поэтому изменения, сделанные другими
+        # потоками тем временем, не теряются: поверх них накладываются только изменённые поля
+        if getattr(self.local, 'tx', None) is not None:
+            yield self
+            return
+        self.local.tx = tx = {}
+        try:
+            yield self
+            self._commit(tx)
+        finally:
+            self.local.tx = None
+
+    def _commit(self, tx):
+        with self.lock:
+            created = False
+            for product_id, change in tx.items():
+                if change['created']:
+                    if change['prod'] is not None:
+                        self.products[product_id] = change['prod']
+                        created = True
+                elif change['prod'] is None:
+                    self.products.pop(product_id, None)
+                elif product_id in self.products:  # продукт мог удалить другой поток
+                    prod = self.products[product_id]
+                    prod.update(change['fields'])
+                    prod['version'] += change['bumps']
+            if created:
+                # другие потоки могли создать продукты с бо́льшими id, пока шла транзакция
+                self.products = dict(sorted(self.products.items()))
+            self.version += 1
+
+    def _tx(self):
+        return getattr(self.local, 'tx', None)
+
+    def _visible(self, product_id):
+        # под self.lock: продукт, каким его видит этот поток
+        tx = self._tx()
+        if tx is not None and product_id in tx:
+            return tx[product_id]['prod']
+        return self.products.get(product_id)
+
+    def _snapshot(self):
+        # под self.lock: все продукты, видимые этому потоку, по возрастанию id
+        tx = self._tx()
+        if not tx:
+            return list(self.products.values())  # словарь упорядочен по id: id только растут
+        merged = dict(self.products)
+        for product_id, change in tx.items():
+            merged[product_id] = change['prod']
+        return [prod for _, prod in sorted(merged.items()) if prod is not None]
+
+    def create(self, name, description, icon_filename=None):
+        with self.lock:
+            prod = {'id': self.next_id, 'name': name, 'description': description,
+                    'icon_filename': icon_filename, 'version': 1}
+            self.next_id += 1
+            tx = self._tx()
+            if tx is not None:
+                tx[prod['id']] = {'created': True, 'prod': prod}
+            else:
+                self.products[prod['id']] = prod
+                self.version += 1
+            return dict(prod)
+
+    def get(self, product_id):
+        with self.lock:
+            prod = self._visible(product_id)
+            return dict(prod) if prod else None
+
+    def update(self, product_id, **fields):
+        with self.lock:
+            prod = self._visible(product_id)
+            if not prod:
+                return None
+            if fields:
+                tx = self._tx()
+                if tx is not None:
+                    prod = dict(prod)
+                    change = tx.setdefault(product_id, {'created': False, 'fields': {}, 'bumps': 0})
+                    change['prod'] = prod
+                    if not change['created']:
+                        change['fields'].update(fields)
+                        change['bumps'] += 1
+                else:
+                    self.version += 1
+                prod.update(fields)
+                prod['version'] += 1
+            return dict(prod)
+
+    def delete(self, product_id):
+        with self.lock:
+            prod = self._visible(product_id)
+            if not prod:
+                return None
+            tx = self._tx()
+            if tx is not None:
+                tx.setdefault(product_id, {'created': False})['prod'] = None
+            else:
+                del self.products[product_id]
+                self.version += 1
+            return dict(prod)
+
+    def collection_version(self):
+        return self.version
+
+    def icon_in_use(self, icon_filename):
+        with self.lock:
+            return any(prod['icon_filename'] == icon_filename for prod in self._snapshot())
+
+    def clear_icon(self, icon_filename):
+        # Убирает иконку у всех продуктов, которые на неё ссылаются (иконка оказалась битой)
+        with self.lock:
+            for prod in self.products.values():
+                if prod['icon_filename'] == icon_filename:
+                    prod['icon_filename'] = None
+                    prod['version'] += 1
+                    self.version += 1
+
+    def all(self):
+        return list(self.list())
+
+    def list(self, after=0, limit=None, name_prefix=None, name_contains=None):
+        # Продукты с id > after по возрастанию id; фильтры по имени чувствительны к регистру
+        with self.lock:
+            snapshot = self._snapshot()
+        found = 0
+        for prod in snapshot:
+            if limit is not None and found >= limit:
+                return
+            if _matches(prod, after, name_prefix, name_contains):
+                found += 1
+                yield dict(prod)
+
+
+class SQLiteProductStore:
+    # Соединение у каждого потока своё (sqlite3 не разрешает делить его между потоками).
+    # Журнал WAL: читатели не блокируют писателя и друг друга, в том числе из других процессов.
+    # Запросы — постоянные строки с параметрами, поэтому sqlite3 готовит каждый один раз
+    # и дальше берёт из кэша подготовленных выражений соединения.
+    # id выдаёт сама база (AUTOINCREMENT): это атомарно и id удалённых продуктов не переиспользуются.
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS products (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                name TEXT NOT NULL,
+                                description TEXT NOT NULL,
+                                icon_filename TEXT,
+                                version INTEGER NOT NULL DEFAULT 1)''')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(products)')]
+            if 'version' not in columns:
+                # база создана до появления версий
+                conn.execute('ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            conn.execute('CREATE INDEX IF NOT EXISTS products_name ON products(name)')
+            # одинаковые иконки хранятся один раз — нужно быстро находить всех, кто на файл ссылается
+            conn.execute('CREATE INDEX IF NOT EXISTS products_icon ON products(icon_filename)')
+            self._create_collection_version(conn)
+            self.trigrams = self._create_trigram_index(conn)
+
+    @staticmethod
+    def _create_collection_version(conn):
+        # Версия всей коллекции — одна строка, которую триггеры увеличивают при любом изменении
+        # таблицы, в той же транзакции: так её видят и другие процессы, и массовые операции
+        conn.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('collection_version', 1)")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_version_{event.lower()} AFTER {event} ON products BEGIN
+                                 UPDATE store_meta SET value = value + 1 WHERE key = 'collection_version';
+                             END''')
+
+    @staticmethod
+    def _create_trigram_index(conn):
+        # Поиск подстроки в имени: полнотекстовый индекс FTS5 по триграммам
+        # (SQLite 3.34+), синхронизируется с таблицей триггерами.
+        # Если FTS5 или триграмм в сборке SQLite нет, подстрока ищется перебором.
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+        try:
+            conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                                name, content='products', content_rowid='id',
+                                tokenize='trigram case_sensitive 1')''')
+        except sqlite3.OperationalError:
+            return False
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+                        END''')
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                        END''')
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN
+                            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+                        END''')
+        if not exists:
+            # база создана до появления индекса — заполняем его по уже сохранённым продуктам
+            conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        return True
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=128)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # в режиме WAL NORMAL не теряет целостность, а fsync делается только на checkpoint
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: транзакция не упрётся в чужую запись
+        # посреди импорта. Методы записи внутри неё не коммитят (см. _write)
+        conn = self._conn()
+        if getattr(self.local, 'in_transaction', False):
+            yield self
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self.local.in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self.local.in_transaction = False
+
+    @contextlib.contextmanager
+    def _write(self):
+        # Отдельное изменение коммитится сразу, внутри transaction() — вместе с ней
+        conn = self._conn()
+        if getattr(self.local, 'in_transaction', False):
+            yield conn
+        else:
+            with conn:
+                yield conn
+
+    def create(self, name, description, icon_filename=None):
+        with self._write() as conn:
+            cur = conn.execute('INSERT INTO products (name, description, icon_filename) VALUES (?, ?, ?)',
+                               (name, description, icon_filename))
+            return {'id': cur.lastrowid, 'name': name, 'description': description,
+                    'icon_filename': icon_filename, 'version': 1}
+
+    def get(self, product_id):
+        row = self._conn().execute(f'SELECT {COLUMNS} FROM products WHERE id = ?',
+                                   (product_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, product_id, **fields):
+        unknown = set(fields) - set(FIELDS[1:])
+        if unknown:
+            raise ValueError(f'unknown fields: {sorted(unknown)}')
+        with self._write() as conn:
+            if fields:
+                # имена колонок берутся только из FIELDS, значения передаются параметрами
+                assignments = ', '.join(f'{name} = ?' for name in sorted(fields)) + ', version = version + 1'
+                conn.execute(f'UPDATE products SET {assignments} WHERE id = ?',
+                             [fields[name] for name in sorted(fields)] + [product_id])
+            row = conn.execute(f'SELECT {COLUMNS} FROM products WHERE id = ?',
+                               (product_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, product_id):
+        with self._write() as conn:
+            row = conn.execute(f'SELECT {COLUMNS} FROM products WHERE id = ?',
+                               (product_id,)).fetchone()
+            if row is None:
+                return None
+            # продукт мог удалить другой процесс между SELECT и DELETE
+            if conn.execute('DELETE FROM products WHERE id = ?', (product_id,)).rowcount == 0:
+                return None
+        return dict(row)
+
+    def collection_version(self):
+        return self._conn().execute("SELECT value FROM store_meta WHERE key = 'collection_version'").fetchone()[0]
+
+    def icon_in_use(self, icon_filename):
+        return self._conn().execute('SELECT 1 FROM products WHERE icon_filename = ? LIMIT 1',
+                                    (icon_filename,)).fetchone() is not None
+
+    def clear_icon(self, icon_filename):
+        with self._write() as conn:
+            conn.execute('UPDATE products SET icon_filename = NULL, version = version + 1 WHERE icon_filename = ?',
+                         (icon_filename,))
+
+    def all(self):
+        return list(self.list())
+
+    def list(self, after=0, limit=None, name_prefix=None, name_contains=None):
+        # Продукты с id > after по возрастанию id. Строки читаются из курсора по мере обхода,
+        # поэтому полная выгрузка не держит весь каталог в памяти.
+        # Префикс ищется диапазоном по индексу name: [prefix, prefix с увеличенным последним символом).
+        # С префиксом "+id" не даёт планировщику идти по первичному ключу и отсеивать строки
+        # перебором: выборка идёт по диапазону индекса name и потом сортируется по id
+        id_column = '+id' if name_prefix else 'id'
+        sql = f'SELECT {COLUMNS} FROM products WHERE {id_column} > ?'
+        params = [after]
+        if name_prefix:
+            if name_prefix[-1] == '\U0010ffff':
+                sql += ' AND name >= ? AND substr(name, 1, ?) = ?'
+                params += [name_prefix, len(name_prefix), name_prefix]
+            else:
+                sql += ' AND name >= ? AND name < ?'
+                params += [name_prefix, name_prefix[:-1] + chr(ord(name_prefix[-1]) + 1)]
+        if name_contains:
+            if self.trigrams and len(name_contains) >= MIN_TRIGRAM:
+                sql += ' AND id IN (SELECT rowid FROM products_fts WHERE name GLOB ?)'
+                params.append(f'*{_glob_escape(name_contains)}*')
+            else:
+                sql += ' AND instr(name, ?) > 0'
+                params.append(name_contains)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        for row in self._conn().execute(sql, params):
+            yield dict(row)
+
+
+def open_store(spec):
+    # spec — путь к файлу SQLite; "memory" (или пустая строка) — хранить только в памяти
+    if not spec or spec == 'memory':
+        return MemoryProductStore()
+    directory = os.path.dirname(os.path.abspath(spec))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return SQLiteProductStore(spec)
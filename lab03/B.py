@@ -1,113 +1,475 @@
-
 import sys
 import socket
 import threading
+import selectors
+import argparse
+import time
 import os
-import mimetypes
-
-
-def make_http_response_headers(status_code: int, content_length: int, content_type: str) -> bytes:
-    reason = {
-        200: "OK",
-        404: "Not Found",
-        500: "Internal Server Error"
-    }.get(status_code, "Unknown")
-    headers = [
-        f"HTTP/1.0 {status_code} {reason}",
-        f"Content-Type: {content_type}",
-        f"Content-Length: {content_length}",
-        "Connection: close",
-        "",
-        ""
-    ]
-    return ("\r\n".join(headers)).encode('utf-8')
-
-
-def handle_client(conn: socket.socket, addr):
-    print(f"[THREAD {threading.current_thread().name}] Handling connection from {addr}")
-    try:
-        request_data = b""
-        while True:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            request_data += chunk
-            if b"\r\n\r\n" in request_data:
-                break
+import errno
+import signal
 
-        request_text = request_data.decode('utf-8', errors='ignore')
-        request_lines = request_text.splitlines()
-        if not request_lines:
-            return
+from http_common import (
+    BUFFER_SIZE,
+    KEEP_ALIVE_TIMEOUT,
+    RequestReader,
+    FILE_CHUNK_SIZE,
+    CACHE_MAX_BYTES,
+    FILE_CACHE,
+    HTTPParseError,
+    new_request_parser,
+    build_response,
+    error_response,
+    send_response,
+)
 
-        request_line = request_lines[0]
-        parts = request_line.split()
-        if len(parts) < 2 or parts[0].upper() != "GET":
-            resp_head = make_http_response_headers(500, 0, "text/plain")
-            conn.sendall(resp_head + b"500 Internal Server Error")
-            return
 
-        raw_path = parts[1]
-        if raw_path.startswith("/"):
-            raw_path = raw_path[1:]
-        if raw_path == "":
-            raw_path = "index.html"
-
-        if not os.path.isfile(raw_path):
-            body = f"<html><body><h1>404 Not Found</h1><p>File {raw_path} not found.</p></body></html>".encode('utf-8')
-            resp_head = make_http_response_headers(404, len(body), "text/html")
-            conn.sendall(resp_head + body)
-            print(f"[THREAD {threading.current_thread().name}] 404: {raw_path}")
-        else:
+def handle_client(conn: socket.socket, addr, keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT):
+    print(f"[THREAD {threading.current_thread().name}] Handling connection from {addr}")
+    conn.settimeout(keep_alive_timeout)
+    reader = RequestReader(conn)
+    try:
+        # Обслуживаем запросы по порядку, пока клиент держит соединение
+        while True:
             try:
-                content_type, _ = mimetypes.guess_type(raw_path)
-                if content_type is None:
-                    content_type = "application/octet-stream"
-                with open(raw_path, "rb") as f:
-                    content = f.read()
-
-                resp_head = make_http_response_headers(200, len(content), content_type)
-                conn.sendall(resp_head + content)
-                print(f"[THREAD {threading.current_thread().name}] 200: Served {raw_path}")
-            except Exception as e:
-                body = f"<html><body><h1>500 Internal Server Error</h1><p>{e}</p></body></html>".encode('utf-8')
-                resp_head = make_http_response_headers(500, len(body), "text/html")
-                conn.sendall(resp_head + body)
-                print(f"[THREAD {threading.current_thread().name}] ERROR: {e}")
+                request = reader.next_request()
+            except socket.timeout:
+                print(f"[THREAD {threading.current_thread().name}] Idle timeout.")
+                return
+            except HTTPParseError as e:
+                send_response(conn, error_response(e))
+                print(f"[THREAD {threading.current_thread().name}] Bad request: {e}")
+                return
+            if request is None:
+                return
+            response = build_response(request)
+            send_response(conn, response)
+            print(f"[THREAD {threading.current_thread().name}] {response.message}")
+            if not response.keep_alive:
+                return
+    except OSError as e:
+        print(f"[THREAD {threading.current_thread().name}] Connection error: {e}")
     finally:
         conn.close()
         print(f"[THREAD {threading.current_thread().name}] Closed connection.")
 
-def serve_multithreaded(listen_port: int):
+GRACEFUL_TIMEOUT = 10.0  # сколько секунд воркер дообслуживает соединения после SIGTERM
+
+
+def make_server_socket(listen_port: int, backlog: int, reuse_port: bool = False) -> socket.socket:
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # у каждого воркера свой слушающий сокет, ядро само раскидывает соединения
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind(("", listen_port))
-    server_socket.listen(5)  # backlog=5
+    server_socket.listen(backlog)
+    return server_socket
+
+
+# stop — threading.Event: когда он выставлен, сервер перестаёт принимать соединения
+# и ждёт до GRACEFUL_TIMEOUT, пока дообслужатся уже принятые
+def serve_multithreaded(listen_port: int, keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT,
+                        server_socket: socket.socket = None, stop: threading.Event = None):
+    if server_socket is None:
+        server_socket = make_server_socket(listen_port, 5)  # backlog=5
+    if stop is not None:
+        server_socket.settimeout(1.0)  # периодически просыпаемся проверить stop
     print(f"[INFO] Threaded HTTP server listening on port {listen_port} ...")
 
+    client_threads = []
     try:
-        while True:
-            conn, addr = server_socket.accept()
+        while stop is None or not stop.is_set():
+            try:
+                conn, addr = server_socket.accept()
+            except socket.timeout:
+                continue
             client_thread = threading.Thread(
                 target=handle_client,
-                args=(conn, addr),
+                args=(conn, addr, keep_alive_timeout),
                 daemon=True
             )
             client_thread.start()
+            if stop is not None:
+                client_threads = [t for t in client_threads if t.is_alive()]
+                client_threads.append(client_thread)
     except KeyboardInterrupt:
         print("\n[INFO] Shutting down server (KeyboardInterrupt).")
     finally:
         server_socket.close()
         print("[INFO] Server socket closed.")
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        for t in client_threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        print(f"[INFO] File cache stats: {FILE_CACHE.stats()}")
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Использование: python3 threaded_http_server.py <port>")
-        sys.exit(1)
+
+# Состояния соединения в событийном режиме
+STATE_READING = 0
+STATE_WRITING = 1
+
+
+class _Connection:
+    # __slots__, чтобы десятки тысяч соединений не раздували память
+    __slots__ = ("sock", "addr", "parser", "outbuf", "sent", "state",
+                 "keep_alive", "last_active", "events", "response", "next_segment", "segment",
+                 "use_sendfile")
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.addr = addr
+        self.parser = new_request_parser()  # сам помнит, докуда дочитал
+        self.outbuf = None
+        self.sent = 0
+        self.state = STATE_READING
+        self.keep_alive = False
+        self.last_active = time.monotonic()
+        self.events = selectors.EVENT_READ  # на что сокет сейчас подписан в селекторе
+        self.response = None      # текущий ответ, если в нём есть куски файла
+        self.next_segment = 0     # индекс следующего элемента response.segments
+        self.segment = None       # кусок файла [offset, count], который сейчас отправляем
+        self.use_sendfile = True
+
+
+def raise_nofile_limit():
+    # Каждое соединение — файловый дескриптор, поднимаем мягкий лимит до жёсткого
     try:
-        port = int(sys.argv[1])
-    except ValueError:
-        print("Порт должен быть целым числом.")
-        sys.exit(1)
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def serve_event_loop(listen_port: int, keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT,
+                     server_socket: socket.socket = None, stop: threading.Event = None):
+    raise_nofile_limit()
+    if server_socket is None:
+        server_socket = make_server_socket(listen_port, socket.SOMAXCONN)
+    server_socket.setblocking(False)
+
+    sel = selectors.DefaultSelector()  # epoll на Linux, kqueue на BSD/macOS
+    sel.register(server_socket, selectors.EVENT_READ, None)
+    print(f"[INFO] Event-loop HTTP server ({type(sel).__name__}) listening on port {listen_port} ...")
+
+    connections = {}
+
+    def close_connection(state: _Connection):
+        state.state = None
+        if state.response is not None:
+            state.response.close()
+            state.response = None
+        connections.pop(state.sock.fileno(), None)
+        sel.unregister(state.sock)
+        state.sock.close()
+
+    def accept_all():
+        # Забираем из очереди все готовые соединения за один проход
+        while True:
+            try:
+                conn, addr = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # например, EMFILE — попробуем на следующей итерации
+                print(f"[WARN] accept failed: {e}")
+                return
+            conn.setblocking(False)
+            state = _Connection(conn, addr)
+            connections[conn.fileno()] = state
+            sel.register(conn, selectors.EVENT_READ, state)
+
+    def want(state: _Connection, events: int):
+        if state.state is not None and state.events != events:
+            state.events = events
+            sel.modify(state.sock, events, state)
+
+    def close_idle():
+        deadline = time.monotonic() - keep_alive_timeout
+        for state in [c for c in connections.values() if c.last_active < deadline]:
+            close_connection(state)
+
+    def start_next_response(state: _Connection) -> bool:
+        # Берём следующий полный запрос из буфера (pipelining); False — запроса ещё нет
+        try:
+            request = state.parser.next_message()
+        except HTTPParseError as e:
+            response = error_response(e)
+        else:
+            if request is None:
+                return False
+            response = build_response(request)
+        print(f"[LOOP] {state.addr}: {response.message}")
+        state.keep_alive = response.keep_alive
+        state.outbuf = memoryview(response.head + response.body)
+        state.sent = 0
+        if response.file is not None:
+            state.response = response
+            state.next_segment = 0
+        state.state = STATE_WRITING
+        return True
+
+    def on_readable(state: _Connection):
+        try:
+            chunk = state.sock.recv(BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            close_connection(state)
+            return
+        if not chunk:
+            close_connection(state)
+            return
+        state.last_active = time.monotonic()
+        state.parser.feed(chunk)
+        if not start_next_response(state):
+            return
+        # Пробуем отправить сразу: маленький ответ обычно уходит целиком
+        on_writable(state)
+        if state.state == STATE_WRITING:
+            want(state, selectors.EVENT_WRITE)
+
+    def send_file_part(state: _Connection) -> int:
+        # Неблокирующий sendfile: ядро само копирует файл в сокет, не трогая память процесса
+        offset, count = state.segment
+        count = min(count, FILE_CHUNK_SIZE * 16)
+        fd = state.response.file.fileno()
+        if state.use_sendfile:
+            try:
+                n = os.sendfile(state.sock.fileno(), fd, offset, count)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                state.use_sendfile = False
+            else:
+                if n == 0:
+                    raise OSError(errno.EIO, "file truncated while sending")
+                return n
+        # Запасной путь: читаем кусок с нужного смещения и отправляем сколько примет сокет
+        chunk = os.pread(fd, min(count, FILE_CHUNK_SIZE), offset)
+        if not chunk:
+            raise OSError(errno.EIO, "file truncated while sending")
+        return state.sock.send(chunk)
+
+    def advance_segment(state: _Connection) -> bool:
+        # Переходим к следующему элементу response.segments; False — ответ отправлен целиком
+        response = state.response
+        if response is None:
+            return False
+        if state.next_segment >= len(response.segments):
+            response.close()
+            state.response = None
+            return False
+        segment = response.segments[state.next_segment]
+        state.next_segment += 1
+        if isinstance(segment, bytes):
+            state.outbuf = memoryview(segment)
+            state.sent = 0
+        else:
+            state.segment = segment
+        return True
+
+    def on_writable(state: _Connection):
+        while True:
+            try:
+                if state.outbuf is not None:
+                    state.sent += state.sock.send(state.outbuf[state.sent:])
+                else:
+                    n = send_file_part(state)
+                    state.segment[0] += n
+                    state.segment[1] -= n
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                close_connection(state)
+                return
+            state.last_active = time.monotonic()
+            if state.outbuf is not None:
+                if state.sent < len(state.outbuf):
+                    continue
+                state.outbuf = None
+            elif state.segment[1] > 0:
+                continue
+            else:
+                state.segment = None
+            if advance_segment(state):
+                continue
+            if not state.keep_alive:
+                close_connection(state)
+                return
+            # Ответ ушёл — отвечаем на следующий pipelined-запрос или ждём новых данных
+            if not start_next_response(state):
+                if state.state is not None:
+                    state.state = STATE_READING
+                    want(state, selectors.EVENT_READ)
+                return
+
+    next_sweep = time.monotonic() + 1.0
+    drain_deadline = None
+    try:
+        while True:
+            if stop is not None and stop.is_set() and drain_deadline is None:
+                # Плавная остановка: новые соединения не берём, ждём текущие
+                sel.unregister(server_socket)
+                server_socket.close()
+                drain_deadline = time.monotonic() + GRACEFUL_TIMEOUT
+                for state in [c for c in connections.values() if c.state == STATE_READING and c.parser.idle]:
+                    close_connection(state)
+            if drain_deadline is not None and (not connections or time.monotonic() >= drain_deadline):
+                break
+            for key, mask in sel.select(timeout=1.0):
+                if key.data is None:
+                    accept_all()
+                    continue
+                state = key.data
+                if state.state == STATE_READING and mask & selectors.EVENT_READ:
+                    on_readable(state)
+                elif state.state == STATE_WRITING and mask & selectors.EVENT_WRITE:
+                    on_writable(state)
+            if time.monotonic() >= next_sweep:
+                close_idle()
+                next_sweep = time.monotonic() + 1.0
+    except KeyboardInterrupt:
+        print("\n[INFO] Shutting down server (KeyboardInterrupt).")
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+        print("[INFO] Server socket closed.")
+        print(f"[INFO] File cache stats: {FILE_CACHE.stats()}")
+
+
+def _run_worker(listen_port: int, mode: str, keep_alive_timeout: float):
+    # Выполняется в дочернем процессе: свой сокет с SO_REUSEPORT и свой цикл accept
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает супервизор
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server_socket = make_server_socket(listen_port, socket.SOMAXCONN, reuse_port=True)
+    if mode == "selectors":
+        serve_event_loop(listen_port, keep_alive_timeout, server_socket, stop)
+    else:
+        serve_multithreaded(listen_port, keep_alive_timeout, server_socket, stop)
+
+
+def _spawn_worker(listen_port: int, mode: str, keep_alive_timeout: float) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(listen_port, mode, keep_alive_timeout)
+        except BaseException as e:
+            print(f"[WORKER {os.getpid()}] crashed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    print(f"[SUPERVISOR] Started worker {pid}")
+    return pid
+
+
+# Супервизор: держит N воркеров, перезапускает упавших.
+# SIGHUP — плавная перезагрузка (новое поколение воркеров, старые дообслуживают
+# соединения и выходят), SIGTERM/SIGINT — плавная остановка.
+def serve_prefork(listen_port: int, workers: int, mode: str = "threaded",
+                  keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT):
+    # Проверяем порт заранее, чтобы не форкать воркеров, которые сразу упадут
+    make_server_socket(listen_port, 1, reuse_port=True).close()
+
+    flags = {"stop": False, "reload": False}
+
+    def on_stop(signum, frame):
+        flags["stop"] = True
+
+    def on_reload(signum, frame):
+        flags["reload"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_reload)
+
+    current = {}    # pid -> время запуска
+    retiring = set()
+    print(f"[SUPERVISOR] pid={os.getpid()}, {workers} x {mode} workers on port {listen_port}")
+    for _ in range(workers):
+        current[_spawn_worker(listen_port, mode, keep_alive_timeout)] = time.monotonic()
+
+    while not flags["stop"]:
+        if flags["reload"]:
+            flags["reload"] = False
+            print("[SUPERVISOR] Reloading: starting new workers, retiring old ones")
+            old = list(current)
+            current = {}
+            for _ in range(workers):
+                current[_spawn_worker(listen_port, mode, keep_alive_timeout)] = time.monotonic()
+            for pid in old:
+                retiring.add(pid)
+                os.kill(pid, signal.SIGTERM)
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        if pid in retiring:
+            retiring.discard(pid)
+            print(f"[SUPERVISOR] Old worker {pid} finished")
+            continue
+        started = current.pop(pid, None)
+        if started is None:
+            continue
+        print(f"[SUPERVISOR] Worker {pid} died (status {status}), restarting")
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)  # не крутим fork в цикле, если воркер падает сразу
+        current[_spawn_worker(listen_port, mode, keep_alive_timeout)] = time.monotonic()
+
+    print("[SUPERVISOR] Shutting down workers...")
+    remaining = set(current) | retiring
+    for pid in remaining:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT + 2.0
+    while remaining and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+        else:
+            remaining.discard(pid)
+    for pid in remaining:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    print("[SUPERVISOR] Stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Многопоточный или событийный HTTP-сервер")
+    parser.add_argument("port", type=int, help="порт для прослушивания")
+    parser.add_argument("--mode", choices=["threaded", "selectors"], default="threaded",
+                        help="threaded — поток на соединение, selectors — один поток с epoll")
+    parser.add_argument("--keep-alive-timeout", type=float, default=KEEP_ALIVE_TIMEOUT,
+                        help="через сколько секунд простоя закрывать keep-alive соединение")
+    parser.add_argument("--cache-mb", type=float, default=CACHE_MAX_BYTES / (1024 * 1024),
+                        help="объём кеша горячих файлов в МиБ (0 — кеш выключен)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="число процессов-воркеров с SO_REUSEPORT (0 — один процесс без супервизора)")
+    args = parser.parse_args()
+    FILE_CACHE.max_bytes = int(args.cache_mb * 1024 * 1024)
 
-    serve_multithreaded(port)
+    if args.workers > 0:
+        serve_prefork(args.port, args.workers, args.mode, args.keep_alive_timeout)
+    elif args.mode == "selectors":
+        serve_event_loop(args.port, args.keep_alive_timeout)
+    else:
+        serve_multithreaded(args.port, args.keep_alive_timeout)
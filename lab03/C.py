@@ -1,5 +1,75 @@
+import os
 import sys
+import json
+import time
 import socket
+import argparse
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, quote
+
+from http_parser import HTTPParser, HTTPMessage, MESSAGE_END
+
+BATCH_CONCURRENCY = 16     # сколько запросов пакетного режима выполняется одновременно
+BATCH_PER_HOST = 4         # и сколько из них может идти к одному серверу
+BATCH_TIMEOUT = 30.0
+BATCH_OUT_DIR = "downloads"
+
+def build_get_request(server_host: str, filename: str, version: str = "HTTP/1.0",
+                      keep_alive: bool = False) -> bytes:
+    if not filename.startswith("/"):
+        filename = "/" + filename
+    request_lines = [
+        f"GET {filename} {version}",
+        f"Host: {server_host}",
+    ]
+    if keep_alive:
+        request_lines.append("Connection: keep-alive")
+    request_lines += ["", ""]
+    return "\r\n".join(request_lines).encode('utf-8')
+
+
+# Читает из сокета один ответ и пишет его в out по мере прихода (write_head —
+# писать ли и заголовки). Возвращает (HTTPMessage с заголовками, байт тела).
+def read_response(sock: socket.socket, parser: HTTPParser, out, write_head: bool = True):
+    head = None
+    body_bytes = 0
+    while True:
+        while True:
+            event = parser.next_event()
+            if event is None:
+                break
+            if isinstance(event, HTTPMessage):
+                head = event
+                body_bytes = 0
+                if write_head:
+                    out.write(event.raw_head)
+            elif event is MESSAGE_END:
+                # промежуточные ответы 1xx пропускаем и ждём настоящий
+                if head is not None and head.status >= 200:
+                    return head, body_bytes
+            else:
+                body_bytes += len(event)
+                out.write(event)
+        chunk = sock.recv(4096)
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.feed_eof()
+            if parser.idle:
+                raise ConnectionError("connection closed before response")
+
+
+# Один GET без вывода ошибок: исключения пробрасываются вызывающему
+# (этим пользуются бенчмарк и пакетный режим)
+def fetch(server_host: str, server_port: int, filename: str, out, timeout=None):
+    with socket.create_connection((server_host, server_port), timeout=timeout) as client_socket:
+        client_socket.sendall(build_get_request(server_host, filename))
+        head, body_bytes = read_response(client_socket, HTTPParser("response"), out)
+        return head.status, body_bytes
+
 
 def http_get(server_host: str, server_port: int, filename: str):
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -8,33 +78,253 @@ def http_get(server_host: str, server_port: int, filename: str):
     except Exception as e:
         print(f"[ERROR] Не удалось подключиться к {server_host}:{server_port}: {e}")
         return
-    if not filename.startswith("/"):
-        filename = "/" + filename
-    request_lines = [
-        f"GET {filename} HTTP/1.0",
-        f"Host: {server_host}",
-        "",
-        ""
-    ]
-    request_data = "\r\n".join(request_lines).encode('utf-8')
-    client_socket.sendall(request_data)
-    response = b""
+    client_socket.sendall(build_get_request(server_host, filename))
+    # Ответ пишем в stdout по мере прихода, не накапливая его в памяти
+    out = sys.stdout.buffer
     try:
-        while True:
-            chunk = client_socket.recv(4096)
-            if not chunk:
-                break
-            response += chunk
+        read_response(client_socket, HTTPParser("response"), out)
     except Exception as e:
         print(f"[ERROR] Ошибка при чтении ответа: {e}")
     finally:
         client_socket.close()
-    sys.stdout.buffer.write(response)
+        out.flush()
+
+
+class _PooledConnection:
+    __slots__ = ("sock", "parser", "reused")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.parser = HTTPParser("response")
+        self.reused = False
+
+
+class ConnectionPool:
+    # Keep-alive соединения по (host, port). Сколько запросов одновременно идёт
+    # к одному серверу, решает batch_get, поэтому acquire() никогда не ждёт.
+    def __init__(self, timeout: float = BATCH_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}    # (host, port) -> [_PooledConnection]
+        self.opened = 0
+
+    def acquire(self, host: str, port: int):
+        key = (host, port)
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.reused = True
+                return conn
+        sock = socket.create_connection(key, timeout=self.timeout)
+        with self.lock:
+            self.opened += 1
+        return _PooledConnection(sock)
+
+    def release(self, host: str, port: int, conn: _PooledConnection, reusable: bool):
+        key = (host, port)
+        if reusable:
+            with self.lock:
+                self.idle.setdefault(key, []).append(conn)
+        else:
+            conn.sock.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.sock.close()
+            self.idle.clear()
+
+
+def batch_output_path(out_dir: str, host: str, port: int, target: str) -> str:
+    # Как в кэше прокси: весь путь с query кодируется в одно имя файла,
+    # поэтому "../" из URL не выводит за пределы out_dir
+    return os.path.join(out_dir, f"{host}_{port}", quote(target, safe="") or "%2F")
+
+
+def _host_key(url: str):
+    # (host, port) для http:// URL, None — URL, который _fetch_one сразу отклонит
+    parts = urlsplit(url)
+    try:
+        port = parts.port or 80
+    except ValueError:
+        return None
+    return (parts.hostname, port) if parts.scheme == "http" and parts.hostname else None
+
+
+def _new_result(url: str, error: str = None) -> dict:
+    return {"url": url, "status": None, "bytes": 0, "reused": False,
+            "wait_ms": 0.0, "connect_ms": 0.0, "total_ms": 0.0, "path": None, "error": error}
+
+
+def _fetch_one(pool: ConnectionPool, url: str, out_dir: str) -> dict:
+    # Любая ошибка (сеть, диск, ответ) записывается в error этого URL, а не прерывает весь пакет
+    result = _new_result(url)
+    start = time.perf_counter()
+    parts = urlsplit(url)
+    key = _host_key(url)
+    if key is None:
+        result["error"] = "only http:// URLs are supported"
+        return result
+    host, port = key
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    path = batch_output_path(out_dir, host, port, target)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    except OSError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    host_header = host if port == 80 else f"{host}:{port}"
+    request = build_get_request(host_header, target, "HTTP/1.1", keep_alive=True)
+
+    # Одна повторная попытка: сервер мог закрыть простаивавшее keep-alive соединение
+    for attempt in range(2):
+        wait_start = time.perf_counter()
+        try:
+            conn = pool.acquire(host, port)
+        except OSError as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            break
+        acquired = time.perf_counter()
+        if conn.reused:
+            result["wait_ms"] += (acquired - wait_start) * 1000
+        else:
+            # для нового соединения в это время входит и connect
+            result["connect_ms"] = (acquired - wait_start) * 1000
+        result["reused"] = conn.reused
+        reusable = False
+        tmp_path = None
+        try:
+            # Временный файл у каждого запроса свой: один URL может качаться дважды одновременно
+            fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(path))
+            conn.sock.sendall(request)
+            # Тело пишется в файл по мере прихода, в памяти ничего не копится
+            with open(fd, "wb") as f:
+                head, body_bytes = read_response(conn.sock, conn.parser, f, write_head=False)
+            os.replace(tmp_path, path)
+            reusable = head.keep_alive and conn.parser.idle
+            result.update(status=head.status, bytes=body_bytes, path=path, error=None)
+            break
+        except (OSError, ValueError) as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            result["error"] = f"{type(e).__name__}: {e}"
+            # не создался временный файл — это диск, а не соединение, повтор не поможет
+            if tmp_path is None or not conn.reused or isinstance(e, socket.timeout):
+                break
+        finally:
+            pool.release(host, port, conn, reusable)
+    result["total_ms"] = (time.perf_counter() - start) * 1000
+    for key in ("wait_ms", "connect_ms", "total_ms"):
+        result[key] = round(result[key], 3)
+    return result
+
+
+def _print_result(result: dict):
+    if result["error"]:
+        print(f"[ERROR] {result['url']}: {result['error']}")
+    else:
+        print(f"[INFO] {result['status']} {result['bytes']} B {result['total_ms']:.1f} ms "
+              f"{'reused' if result['reused'] else 'new'} {result['url']}")
+
+
+# Пакетный режим: скачать все URL из списка, параллельно и через keep-alive.
+# У каждого хоста своя очередь URL, и в пул потоков URL попадает, только когда у его хоста
+# меньше per_host запросов в работе: поток никогда не ждёт слота у занятого сервера,
+# пока URL других серверов лежат без дела. Хосты с очередью обходятся по кругу.
+def batch_get(urls, out_dir: str = BATCH_OUT_DIR, concurrency: int = BATCH_CONCURRENCY,
+              per_host: int = BATCH_PER_HOST, timeout: float = BATCH_TIMEOUT):
+    pool = ConnectionPool(timeout)
+    results = [None] * len(urls)   # в порядке списка, печатаются — по мере готовности
+    queues = {}                    # (host, port) -> deque[(номер в списке, url)]
+    for index, url in enumerate(urls):
+        key = _host_key(url)
+        if key is None:
+            results[index] = _fetch_one(pool, url, out_dir)
+            _print_result(results[index])
+        else:
+            queues.setdefault(key, deque()).append((index, url))
+    active = dict.fromkeys(queues, 0)
+    ready = deque(queues)          # хосты, у которых есть и URL в очереди, и свободный слот
+    running = {}                   # future -> (host, port), номер в списке
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while ready or running:
+                while ready and len(running) < concurrency:
+                    key = ready.popleft()
+                    index, url = queues[key].popleft()
+                    running[executor.submit(_fetch_one, pool, url, out_dir)] = key, index
+                    active[key] += 1
+                    if queues[key] and active[key] < per_host:
+                        ready.append(key)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, index = running.pop(future)
+                    active[key] -= 1
+                    # хост был занят полностью — теперь у него снова есть слот
+                    if queues[key] and active[key] == per_host - 1:
+                        ready.append(key)
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        results[index] = _new_result(urls[index], f"{type(e).__name__}: {e}")
+                    _print_result(results[index])
+    finally:
+        pool.close()
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if r["error"])
+    summary = {
+        "requests": len(results),
+        "failed": failed,
+        "bytes": sum(r["bytes"] for r in results),
+        "connections_opened": pool.opened,
+        "elapsed_s": round(elapsed, 3),
+    }
+    print(f"[INFO] Batch done: {summary}")
+    return results, summary
+
+
+def read_url_list(path: str):
+    # По URL на строку; пустые строки и комментарии (#) пропускаются. "-" — stdin.
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="C.py --batch", description="Пакетная загрузка списка URL")
+    parser.add_argument("url_list", help="файл со списком URL (по одному на строку), - для stdin")
+    parser.add_argument("--out-dir", default=BATCH_OUT_DIR, help="куда сохранять тела ответов")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=BATCH_PER_HOST,
+                        help="максимум одновременных запросов к одному серверу")
+    parser.add_argument("--timeout", type=float, default=BATCH_TIMEOUT)
+    parser.add_argument("--report", help="записать тайминги по каждому запросу в JSON-файл")
+    args = parser.parse_args(argv)
+    if args.concurrency <= 0 or args.per_host <= 0:
+        parser.error("--concurrency and --per-host must be positive")
+
+    results, summary = batch_get(read_url_list(args.url_list), args.out_dir, args.concurrency,
+                                 args.per_host, args.timeout)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "requests": results}, f, indent=2)
+    sys.exit(1 if summary["failed"] else 0)
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
     if len(sys.argv) != 4:
         print("Использование: python3 simple_http_client.py <server_host> <server_port> <filename>")
+        print("           или: python3 simple_http_client.py --batch <url_list> [--out-dir DIR] ...")
         sys.exit(1)
     host = sys.argv[1]
     try:
@@ -1,128 +1,226 @@
 import sys
 import socket
 import threading
-import os
-import mimetypes
-
-def make_http_response_headers(status_code: int, content_length: int, content_type: str) -> bytes:
-    reason = {
-        200: "OK",
-        404: "Not Found",
-        500: "Internal Server Error"
-    }.get(status_code, "Unknown")
-    headers = [
-        f"HTTP/1.0 {status_code} {reason}",
-        f"Content-Type: {content_type}",
-        f"Content-Length: {content_length}",
-        "Connection: close",
-        "",
-        ""
-    ]
-    return ("\r\n".join(headers)).encode('utf-8')
+import queue
+import time
+import json
+import argparse
+
+from http_common import (
+    KEEP_ALIVE_TIMEOUT,
+    FILE_CACHE,
+    RequestReader,
+    HTTPResponse,
+    HTTPParseError,
+    make_http_response_headers,
+    build_response,
+    error_response,
+    send_response,
+)
+
+QUEUE_SIZE = 128          # сколько принятых соединений может ждать свободного воркера
+# Срок на приём запроса: для первого — от accept (вместе с ожиданием в очереди; прождавшему
+# дольше сразу отвечаем 503), для следующих keep-alive — от их первого байта. Не уложился — 408
+REQUEST_DEADLINE = 5.0
+RETRY_AFTER = 1           # значение заголовка Retry-After в ответе 503
+POOL_STATS_PATH = "/__pool_stats"
+
+# Что делать, когда очередь заполнена:
+#   queue  — ждать места в очереди (accept приостанавливается, как раньше с семафором)
+#   reject — сразу ответить 503 Service Unavailable с Retry-After
+#   drop   — молча закрыть соединение
+OVERFLOW_POLICIES = ("queue", "reject", "drop")
+
 
 class LimitedThreadHTTPServer:
-    def __init__(self, port: int, max_workers: int):
+    def __init__(self, port: int, max_workers: int, keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT,
+                 queue_size: int = QUEUE_SIZE, overflow: str = "reject",
+                 request_deadline: float = REQUEST_DEADLINE, retry_after: int = RETRY_AFTER):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
         self.port = port
         self.max_workers = max_workers
+        self.keep_alive_timeout = keep_alive_timeout
+        self.overflow = overflow
+        self.request_deadline = request_deadline
+        self.retry_after = retry_after
 
-        # Семафор, который не позволит запустить больше max_workers потоков
-        self.semaphore = threading.Semaphore(max_workers)
+        # Постоянный пул: max_workers потоков разбирают очередь принятых соединений
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.workers = []
+
+        self.stats_lock = threading.Lock()
+        self.accepted = 0
+        self.served = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.expired = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind(("", port))
-        self.server_socket.listen(5)
-        print(f"[INFO] Limited HTTP server listening on port {port}, max_workers={max_workers}")
+        self.server_socket.listen(socket.SOMAXCONN)
+        print(f"[INFO] Limited HTTP server listening on port {port}, max_workers={max_workers}, "
+              f"queue_size={queue_size}, overflow={overflow}")
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            waited = self.served + self.expired
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self.work_queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "accepted": self.accepted,
+                "served": self.served,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "expired": self.expired,
+                "avg_wait_ms": round(self.total_wait / waited * 1000, 3) if waited else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
 
     def serve_forever(self):
+        for i in range(self.max_workers):
+            t = threading.Thread(target=self._worker_loop, name=f"worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
         try:
             while True:
                 conn, addr = self.server_socket.accept()
-                print(f"[INFO] Incoming connection from {addr}, waiting for a free worker...")
-                self.semaphore.acquire()
-                print(f"[INFO] {addr} allowed to proceed.")
-                t = threading.Thread(
-                    target=self._thread_worker,
-                    args=(conn, addr),
-                    daemon=True
-                )
-                t.start()
+                with self.stats_lock:
+                    self.accepted += 1
+                item = (conn, addr, time.monotonic())
+                try:
+                    self.work_queue.put_nowait(item)
+                except queue.Full:
+                    self._on_overflow(item)
+                    continue
+                depth = self.work_queue.qsize()
+                with self.stats_lock:
+                    self.max_queue_depth = max(self.max_queue_depth, depth)
 
         except KeyboardInterrupt:
             print("\n[INFO] Shutting down server (KeyboardInterrupt).")
         finally:
             self.server_socket.close()
             print("[INFO] Server socket closed.")
+            print(f"[INFO] Pool stats: {self.stats()}")
+            print(f"[INFO] File cache stats: {FILE_CACHE.stats()}")
 
-    def _thread_worker(self, conn: socket.socket, addr):
+    def _on_overflow(self, item):
+        conn, addr, _ = item
+        if self.overflow == "queue":
+            print(f"[INFO] Queue is full, {addr} waits for a free slot...")
+            self.work_queue.put(item)
+            return
+        if self.overflow == "reject":
+            with self.stats_lock:
+                self.rejected += 1
+            print(f"[WARN] Queue is full, rejecting {addr} with 503")
+            self._send_unavailable(conn)
+        else:
+            with self.stats_lock:
+                self.dropped += 1
+            print(f"[WARN] Queue is full, dropping {addr}")
+        conn.close()
+
+    def _send_unavailable(self, conn: socket.socket):
+        body = b"503 Service Unavailable: server is overloaded, retry later."
+        resp_head = make_http_response_headers(503, len(body), "text/plain", False,
+                                               [f"Retry-After: {self.retry_after}"])
+        try:
+            # не даём медленному клиенту задержать accept
+            conn.settimeout(0.5)
+            conn.sendall(resp_head + body)
+        except OSError:
+            pass
+
+    def _worker_loop(self):
+        while True:
+            conn, addr, enqueued_at = self.work_queue.get()
+            waited = time.monotonic() - enqueued_at
+            expired = waited > self.request_deadline
+            with self.stats_lock:
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                if expired:
+                    self.expired += 1
+                else:
+                    self.served += 1
+            if expired:
+                # клиент ждал слишком долго — быстро отказываем, а не обслуживаем с опозданием
+                print(f"[THREAD {threading.current_thread().name}] {addr} waited {waited:.2f}s in queue, 503")
+                self._send_unavailable(conn)
+                conn.close()
+                continue
+            self._thread_worker(conn, addr, enqueued_at)
+
+    def _thread_worker(self, conn: socket.socket, addr, accepted_at: float):
         thread_name = threading.current_thread().name
         print(f"[THREAD {thread_name}] Handling {addr}")
+        conn.settimeout(self.keep_alive_timeout)
+        reader = RequestReader(conn)
+        started = accepted_at
         try:
-            request_data = b""
+            # Пока клиент держит keep-alive, воркер обслуживает его запросы по порядку
             while True:
-                chunk = conn.recv(4096)
-                if not chunk:
-                    break
-                request_data += chunk
-                if b"\r\n\r\n" in request_data:
-                    break
-
-            request_text = request_data.decode('utf-8', errors='ignore')
-            request_lines = request_text.splitlines()
-            if not request_lines:
-                return
-
-            request_line = request_lines[0]
-            parts = request_line.split()
-            if len(parts) < 2 or parts[0].upper() != "GET":
-                resp_head = make_http_response_headers(500, 0, "text/plain")
-                conn.sendall(resp_head + b"500 Internal Server Error")
-                return
-
-            raw_path = parts[1]
-            if raw_path.startswith("/"):
-                raw_path = raw_path[1:]
-            if raw_path == "":
-                raw_path = "index.html"
-
-            if not os.path.isfile(raw_path):
-                body = f"<html><body><h1>404 Not Found</h1><p>File {raw_path} not found.</p></body></html>".encode('utf-8')
-                resp_head = make_http_response_headers(404, len(body), "text/html")
-                conn.sendall(resp_head + body)
-                print(f"[THREAD {thread_name}] 404: {raw_path}")
-            else:
                 try:
-                    content_type, _ = mimetypes.guess_type(raw_path)
-                    if content_type is None:
-                        content_type = "application/octet-stream"
-                    with open(raw_path, "rb") as f:
-                        content = f.read()
-
-                    resp_head = make_http_response_headers(200, len(content), content_type)
-                    conn.sendall(resp_head + content)
-                    print(f"[THREAD {thread_name}] 200: Served {raw_path}")
-                except Exception as e:
-                    body = f"<html><body><h1>500 Internal Server Error</h1><p>{e}</p></body></html>".encode('utf-8')
-                    resp_head = make_http_response_headers(500, len(body), "text/html")
-                    conn.sendall(resp_head + body)
-                    print(f"[THREAD {thread_name}] ERROR: {e}")
+                    request = reader.next_request(self.request_deadline, started)
+                except socket.timeout:
+                    if reader.parser.idle:
+                        print(f"[THREAD {thread_name}] Idle timeout.")
+                        return
+                    # запрос начат, но не пришёл целиком за request_deadline — медленный клиент
+                    conn.settimeout(0.5)
+                    send_response(conn, error_response(HTTPParseError("request deadline exceeded", 408)))
+                    print(f"[THREAD {thread_name}] Request deadline exceeded, 408")
+                    return
+                except HTTPParseError as e:
+                    send_response(conn, error_response(e))
+                    print(f"[THREAD {thread_name}] Bad request: {e}")
+                    return
+                if request is None:
+                    return
+                started = None  # следующему запросу срок отсчитывается от его первого байта
+                # Если в очереди уже ждут другие клиенты, не держим воркер под keep-alive
+                allow_keep_alive = self.work_queue.empty()
+                if request.target == POOL_STATS_PATH:
+                    body = json.dumps(self.stats()).encode('utf-8')
+                    response = HTTPResponse(
+                        make_http_response_headers(200, len(body), "application/json", False),
+                        body, "200: pool stats", False)
+                else:
+                    response = build_response(request, allow_keep_alive)
+                send_response(conn, response)
+                print(f"[THREAD {thread_name}] {response.message}")
+                if not response.keep_alive:
+                    return
+        except OSError as e:
+            print(f"[THREAD {thread_name}] Connection error: {e}")
         finally:
             conn.close()
-            print(f"[THREAD {thread_name}] Closed connection.")
-            self.semaphore.release()
-            print(f"[THREAD {thread_name}] Released a worker slot. Available slots: {self.semaphore._value}")
+            print(f"[THREAD {thread_name}] Closed connection. Queue depth: {self.work_queue.qsize()}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        sys.exit(1)
-
-    try:
-        port = int(sys.argv[1])
-        max_workers = int(sys.argv[2])
-        if max_workers <= 0:
-            raise ValueError()
-    except ValueError:
+    parser = argparse.ArgumentParser(description="HTTP-сервер с ограниченным пулом потоков")
+    parser.add_argument("port", type=int)
+    parser.add_argument("max_workers", type=int)
+    parser.add_argument("keep_alive_timeout", type=float, nargs="?", default=KEEP_ALIVE_TIMEOUT)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="сколько соединений может ждать свободного воркера")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default="reject",
+                        help="что делать при переполнении очереди")
+    parser.add_argument("--deadline", type=float, default=REQUEST_DEADLINE,
+                        help="срок на приём запроса (для первого — вместе с ожиданием в очереди), секунд")
+    parser.add_argument("--retry-after", type=int, default=RETRY_AFTER,
+                        help="Retry-After в ответе 503, секунд")
+    args = parser.parse_args()
+    if args.max_workers <= 0 or args.queue_size <= 0:
         sys.exit(1)
 
-    server = LimitedThreadHTTPServer(port, max_workers)
+    server = LimitedThreadHTTPServer(args.port, args.max_workers, args.keep_alive_timeout,
+                                     args.queue_size, args.overflow, args.deadline, args.retry_after)
     server.serve_forever()
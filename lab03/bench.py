@@ -0,0 +1,426 @@
+import os
+import json
+import math
+import time
+import random
+import shlex
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import multiprocessing
+
+from C import fetch, build_get_request
+from http_parser import HTTPParser, HTTPMessage, MESSAGE_END
+
+# Нагрузочный тест для серверов из lab03 (A.py / B.py / D.py).
+# Пример:
+#   python3 bench.py 127.0.0.1 8080 --concurrency 200 --duration 20 \
+#       --sizes 1k:60,64k:30,1m:10 --server-cmd "python3 B.py 8080 --mode selectors"
+# Результат — JSON (stdout или --out), чтобы сравнивать версии между собой.
+
+SIZE_SUFFIXES = {"k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+class _NullSink:
+    # Тело ответа нам не нужно — считаем только байты
+    def write(self, data):
+        return len(data)
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+# "a.html:3,b.txt:1" -> [("a.html", 3.0), ("b.txt", 1.0)]
+def parse_weighted(spec: str):
+    items = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.rpartition(":")
+        if not name:
+            name, weight = weight, "1"
+        items.append((name, float(weight)))
+    return items
+
+
+# Создаёт в docroot файлы bench_<size>.bin и возвращает взвешенный список путей
+def prepare_size_files(docroot: str, size_spec: str):
+    paths = []
+    for size_text, weight in parse_weighted(size_spec):
+        size = parse_size(size_text)
+        name = f"bench_{size_text.lower()}.bin"
+        path = os.path.join(docroot, name)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                remaining = size
+                block = os.urandom(min(size, 1024 * 1024)) if size else b""
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= len(block)
+        paths.append((name, weight))
+    return paths
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # метод ближайшего ранга
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class _Recorder:
+    # Результаты одного драйвера: латентности, коды ответов, ошибки
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+
+    def ok(self, latency: float, status: int, nbytes: int):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += nbytes
+
+    def error(self, e: Exception):
+        kind = type(e).__name__
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def merge(self, other: "_Recorder"):
+        self.latencies += other.latencies
+        for k, v in other.statuses.items():
+            self.statuses[k] = self.statuses.get(k, 0) + v
+        for k, v in other.errors.items():
+            self.errors[k] = self.errors.get(k, 0) + v
+        self.bytes += other.bytes
+
+    def as_dict(self) -> dict:
+        return {"latencies": self.latencies, "statuses": self.statuses,
+                "errors": self.errors, "bytes": self.bytes}
+
+
+def _thread_driver(host, port, paths, weights, deadline, max_requests, counter, lock, timeout, seed, rec):
+    rnd = random.Random(seed)
+    sink = _NullSink()
+    while time.monotonic() < deadline:
+        if max_requests is not None:
+            with lock:
+                if counter[0] >= max_requests:
+                    return
+                counter[0] += 1
+        path = rnd.choices(paths, weights)[0]
+        start = time.perf_counter()
+        try:
+            status, nbytes = fetch(host, port, path, sink, timeout=timeout)
+        except Exception as e:
+            rec.error(e)
+            continue
+        rec.ok(time.perf_counter() - start, status, nbytes)
+
+
+# Процесс-драйвер: threads потоков, каждый в цикле вызывает fetch() из C.py
+def _process_driver(host, port, paths, weights, threads, duration, max_requests, timeout, seed, result_queue):
+    deadline = time.monotonic() + duration
+    counter, lock = [0], threading.Lock()
+    recorders = [_Recorder() for _ in range(threads)]  # у каждого потока свой, без блокировок
+    workers = [
+        threading.Thread(target=_thread_driver,
+                         args=(host, port, paths, weights, deadline, max_requests, counter, lock,
+                               timeout, seed * 1000 + i, recorders[i]))
+        for i in range(threads)
+    ]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    for rec in recorders[1:]:
+        recorders[0].merge(rec)
+    result_queue.put(recorders[0].as_dict())
+
+
+async def _async_fetch(host, port, path, timeout):
+    # Тот же запрос, что шлёт http_get, и тот же парсер ответа, но без потоков
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(build_get_request(host, path))
+        await writer.drain()
+        parser = HTTPParser("response")
+        status, nbytes = None, 0
+        while True:
+            event = parser.next_event()
+            if event is None:
+                data = await asyncio.wait_for(reader.read(65536), timeout)
+                if data:
+                    parser.feed(data)
+                else:
+                    parser.feed_eof()
+                    if parser.idle:
+                        raise ConnectionError("connection closed before response")
+                continue
+            if isinstance(event, HTTPMessage):
+                status, nbytes = event.status, 0
+            elif event is MESSAGE_END:
+                if status is not None and status >= 200:
+                    return status, nbytes
+            else:
+                nbytes += len(event)
+    finally:
+        writer.close()
+
+
+async def _async_driver(host, port, paths, weights, concurrency, duration, max_requests, timeout, seed):
+    rec = _Recorder()
+    rnd = random.Random(seed)
+    deadline = time.monotonic() + duration
+    issued = [0]
+
+    async def worker():
+        while time.monotonic() < deadline:
+            if max_requests is not None:
+                if issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            path = rnd.choices(paths, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, nbytes = await _async_fetch(host, port, path, timeout)
+            except Exception as e:
+                rec.error(e)
+                continue
+            rec.ok(time.perf_counter() - start, status, nbytes)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return rec.as_dict()
+
+
+def _async_process_driver(host, port, paths, weights, concurrency, duration, max_requests, timeout, seed,
+                          result_queue):
+    result_queue.put(asyncio.run(_async_driver(host, port, paths, weights, concurrency, duration,
+                                               max_requests, timeout, seed)))
+
+
+def _proc_children(pid: int):
+    # pid и все его потомки (для сервера в режиме --workers)
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    result, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        result.append(p)
+        stack.extend(children.get(p, []))
+    return result
+
+
+def sample_process(pid: int):
+    # (процессорное время в секундах, RSS в КиБ) для pid и его потомков; только Linux
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu, rss = 0.0, 0
+    for p in _proc_children(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+class _ServerMonitor(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stop = threading.Event()
+        self.start_cpu, self.start_rss = sample_process(pid)
+        self.peak_rss = self.start_rss
+        self.start_time = time.monotonic()
+        self.end_cpu, self.end_rss = self.start_cpu, self.start_rss
+        self.end_time = self.start_time
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        cpu, rss = sample_process(self.pid)
+        self.end_cpu, self.end_rss, self.end_time = cpu, rss, time.monotonic()
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def finish(self) -> dict:
+        self.stop.set()
+        self.join()
+        self._sample()
+        wall = max(self.end_time - self.start_time, 1e-9)
+        return {
+            "pid": self.pid,
+            "cpu_seconds": round(self.end_cpu - self.start_cpu, 3),
+            "cpu_percent": round((self.end_cpu - self.start_cpu) / wall * 100, 1),
+            "rss_start_kb": self.start_rss,
+            "rss_peak_kb": self.peak_rss,
+            "rss_end_kb": self.end_rss,
+        }
+
+
+def port_open(host: str, port: int) -> bool:
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10.0, process: subprocess.Popen = None):
+    # process — запущенный сервер: если он завершился (например, порт занят), ждать нечего
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode} before listening on {host}:{port}")
+        if port_open(host, port):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"server on {host}:{port} did not start in {timeout}s")
+
+
+def run_benchmark(args) -> dict:
+    paths = parse_weighted(args.mix) if args.mix else []
+    if args.sizes:
+        paths += prepare_size_files(args.docroot, args.sizes)
+    if not paths:
+        paths = [("index.html", 1.0)]
+    names = [p for p, _ in paths]
+    weights = [w for _, w in paths]
+
+    server = None
+    server_pid = args.server_pid
+    if args.server_cmd:
+        # порт уже кем-то занят — замерили бы не тот сервер, а запущенный упал бы с EADDRINUSE
+        if port_open(args.host, args.port):
+            raise RuntimeError(f"{args.host}:{args.port} is already in use, stop the other server first")
+        # без shell: иначе terminate() получит оболочка, а сервер останется жить
+        server = subprocess.Popen(shlex.split(args.server_cmd), cwd=args.docroot,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server.pid
+        try:
+            wait_for_port(args.host, args.port, process=server)
+        except RuntimeError:
+            server.kill()
+            server.wait()
+            raise
+
+    processes = max(1, args.processes)
+    per_process = max(1, args.concurrency // processes)
+    per_process_requests = None if args.requests is None else max(1, args.requests // processes)
+    monitor = _ServerMonitor(server_pid) if server_pid and os.path.isdir("/proc") else None
+    if monitor is not None:
+        monitor.start()
+
+    ctx = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    result_queue = ctx.Queue()
+    target = _async_process_driver if args.driver == "asyncio" else _process_driver
+    drivers = [
+        ctx.Process(target=target,
+                    args=(args.host, args.port, names, weights, per_process, args.duration,
+                          per_process_requests, args.timeout, args.seed + i, result_queue))
+        for i in range(processes)
+    ]
+    started = time.monotonic()
+    for d in drivers:
+        d.start()
+    results = [result_queue.get() for _ in drivers]
+    for d in drivers:
+        d.join()
+    elapsed = time.monotonic() - started
+
+    server_stats = monitor.finish() if monitor is not None else None
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(x for r in results for x in r["latencies"])
+    statuses, errors = {}, {}
+    for r in results:
+        for k, v in r["statuses"].items():
+            statuses[str(k)] = statuses.get(str(k), 0) + v
+        for k, v in r["errors"].items():
+            errors[k] = errors.get(k, 0) + v
+    total_bytes = sum(r["bytes"] for r in results)
+    completed = len(latencies)
+    # ошибка — и оборванный запрос, и любой ответ не 2xx/3xx (404 от не того docroot тоже)
+    failed = sum(errors.values()) + sum(v for k, v in statuses.items() if not 200 <= int(k) < 400)
+    attempted = completed + sum(errors.values())
+
+    return {
+        "config": {
+            "host": args.host, "port": args.port, "driver": args.driver,
+            "concurrency": per_process * processes, "processes": processes,
+            "duration": args.duration, "requests": args.requests,
+            "mix": dict(zip(names, weights)), "server_cmd": args.server_cmd,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "requests": attempted,
+        "completed": completed,
+        "throughput_rps": round(completed / elapsed, 1) if elapsed else 0.0,
+        "throughput_mib_s": round(total_bytes / elapsed / (1024 * 1024), 2) if elapsed else 0.0,
+        "bytes": total_bytes,
+        "latency_ms": {
+            **{f"p{p:g}": round(percentile(latencies, p) * 1000, 3) for p in PERCENTILES},
+            "mean": round(sum(latencies) / completed * 1000, 3) if completed else 0.0,
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "statuses": statuses,
+        "errors": errors,
+        "error_rate": round(failed / attempted, 5) if attempted else 0.0,
+        "server": server_stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP-серверов из lab03")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных клиентов всего")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="сколько процессов-драйверов запускать")
+    parser.add_argument("--driver", choices=["threads", "asyncio"], default="threads",
+                        help="threads — потоки с fetch() из C.py, asyncio — корутины с тем же парсером")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность теста, секунд")
+    parser.add_argument("--requests", type=int, default=None, help="остановиться после N запросов")
+    parser.add_argument("--mix", default="", help="смесь путей с весами, например index.html:3,hello.txt:1")
+    parser.add_argument("--sizes", default="",
+                        help="распределение размеров файлов, например 1k:60,64k:30,1m:10 (файлы создаются в --docroot)")
+    parser.add_argument("--docroot", default=".", help="каталог, из которого сервер отдаёт файлы")
+    parser.add_argument("--timeout", type=float, default=10.0, help="таймаут одного запроса, секунд")
+    parser.add_argument("--server-pid", type=int, default=None, help="pid сервера для замера CPU/RSS")
+    parser.add_argument("--server-cmd", default=None,
+                        help="команда запуска сервера (в --docroot); сервер будет остановлен после теста")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="куда записать JSON-отчёт (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,471 @@
+import os
+import stat
+import time
+import socket
+import json
+import threading
+import mimetypes
+import email.utils
+from collections import OrderedDict
+
+from http_parser import HTTPParser, HTTPParseError, HTTPMessage
+
+BUFFER_SIZE = 4096
+MAX_HEADER_SIZE = 64 * 1024
+MAX_REQUEST_BODY = 1024 * 1024  # тела запросов нам не нужны, но дочитать их надо
+KEEP_ALIVE_TIMEOUT = 15.0  # сколько секунд держим простаивающее соединение
+SENDFILE_THRESHOLD = 64 * 1024  # файлы больше этого отдаём через sendfile, не читая в память
+FILE_CHUNK_SIZE = 64 * 1024     # размер куска для отправки без sendfile
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # общий объём кеша горячих файлов
+CACHE_VALIDATE_INTERVAL = 1.0       # как часто (в секундах) сверять mtime/size закешированного файла
+CACHE_STATS_PATH = "__cache_stats"  # GET /__cache_stats отдаёт счётчики кеша в JSON
+MAX_RANGES = 16  # больше диапазонов в одном Range не обслуживаем — отдаём файл целиком
+
+
+REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    408: "Request Timeout",
+    413: "Content Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+}
+
+
+# content_type/content_length = None — заголовок не пишем (например, для 304);
+# extra_headers — дополнительные строки вида "ETag: ..."
+def make_http_response_headers(status_code: int, content_length, content_type,
+                               keep_alive: bool = False, extra_headers=None) -> bytes:
+    reason = REASONS.get(status_code, "Unknown")
+    headers = [f"HTTP/1.1 {status_code} {reason}"]
+    if content_type is not None:
+        headers.append(f"Content-Type: {content_type}")
+    if content_length is not None:
+        headers.append(f"Content-Length: {content_length}")
+    if extra_headers:
+        headers.extend(extra_headers)
+    headers += [
+        # keep-alive: соединение остаётся открытым для следующих запросов
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+        "",                        # пустая строка означает конец блока заголовков
+        ""
+    ]
+    return ("\r\n".join(headers)).encode('utf-8')
+
+
+class RequestReader:
+    # Читает из блокирующего сокета запросы по одному; лишние байты
+    # (следующие pipelined-запросы) остаются в парсере до следующего вызова
+    def __init__(self, conn):
+        self.conn = conn
+        self.parser = new_request_parser()
+
+    # HTTPMessage или None, если клиент закрыл соединение;
+    # HTTPParseError и socket.timeout пробрасываются наверх.
+    # request_timeout — сколько может приниматься один запрос: от started (time.monotonic()),
+    # а если он не задан — от первого байта запроса. Пока байтов нет, действует только
+    # таймаут сокета (простой keep-alive), а медленный клиент не растянет приём дольше срока.
+    def next_request(self, request_timeout=None, started=None):
+        idle_timeout = self.conn.gettimeout()
+        try:
+            while True:
+                request = self.parser.next_message()
+                if request is not None:
+                    return request
+                if request_timeout is not None:
+                    if started is None and not self.parser.idle:
+                        started = time.monotonic()
+                    if started is not None:
+                        remaining = started + request_timeout - time.monotonic()
+                        if remaining <= 0:
+                            raise socket.timeout("request deadline exceeded")
+                        self.conn.settimeout(remaining if idle_timeout is None else min(idle_timeout, remaining))
+                chunk = self.conn.recv(BUFFER_SIZE)
+                if not chunk:
+                    return None
+                self.parser.feed(chunk)
+        finally:
+            if request_timeout is not None:
+                self.conn.settimeout(idle_timeout)
+
+
+def new_request_parser() -> HTTPParser:
+    return HTTPParser("request", MAX_HEADER_SIZE, MAX_REQUEST_BODY)
+
+
+class HTTPResponse:
+    # head — заголовки, body — небольшое тело в памяти. Для больших файлов вместо
+    # body открыт file, а тело описывают segments: каждый элемент — либо bytes
+    # (отправляются как есть), либо [offset, count] — кусок файла для sendfile
+    __slots__ = ("head", "body", "file", "segments", "message", "keep_alive")
+
+    def __init__(self, head: bytes, body: bytes, message: str, keep_alive: bool,
+                 file=None, segments=None):
+        self.head = head
+        self.body = body
+        self.file = file
+        self.segments = segments or []
+        self.message = message
+        self.keep_alive = keep_alive
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Отправляет count байт файла с позиции offset (count=None — до конца файла).
+# Для обычных файлов socket.sendfile копирует данные прямо в ядре (os.sendfile);
+# иначе читаем кусками в один заранее выделенный буфер, так что память не растёт.
+def send_file_body(conn, f, offset: int = 0, count=None):
+    if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        conn.sendfile(f, offset, count)
+        return
+    if offset:
+        f.seek(offset)
+    buf = memoryview(bytearray(FILE_CHUNK_SIZE))
+    remaining = count
+    while remaining is None or remaining > 0:
+        want = FILE_CHUNK_SIZE if remaining is None else min(FILE_CHUNK_SIZE, remaining)
+        n = f.readinto(buf[:want])
+        if not n:
+            break
+        conn.sendall(buf[:n])
+        if remaining is not None:
+            remaining -= n
+
+
+def send_response(conn, response: HTTPResponse):
+    try:
+        if response.file is None:
+            conn.sendall(response.head + response.body)
+        else:
+            conn.sendall(response.head)
+            for segment in response.segments:
+                if isinstance(segment, bytes):
+                    conn.sendall(segment)
+                else:
+                    send_file_body(conn, response.file, segment[0], segment[1])
+    finally:
+        response.close()
+
+
+def make_etag(size: int, mtime_ns: int) -> str:
+    return f'"{size:x}-{mtime_ns:x}"'
+
+
+def file_validator_headers(size: int, mtime_ns: int) -> list:
+    return [
+        f"ETag: {make_etag(size, mtime_ns)}",
+        f"Last-Modified: {email.utils.formatdate(mtime_ns / 1e9, usegmt=True)}",
+        "Accept-Ranges: bytes",
+    ]
+
+
+class _CacheEntry:
+    __slots__ = ("mtime_ns", "size", "content_type", "body", "heads", "checked_at")
+
+    def __init__(self, mtime_ns: int, size: int, content_type: str, body: bytes):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.content_type = content_type
+        self.body = body
+        # заранее собранные заголовки 200 OK для keep-alive и для close
+        validators = file_validator_headers(size, mtime_ns)
+        self.heads = {
+            keep_alive: make_http_response_headers(200, len(body), content_type, keep_alive, validators)
+            for keep_alive in (False, True)
+        }
+        self.checked_at = time.monotonic()
+
+    def nbytes(self) -> int:
+        return len(self.body) + len(self.heads[False]) + len(self.heads[True])
+
+
+class FileCache:
+    # LRU-кеш готовых ответов для небольших файлов. Ограничен общим объёмом в байтах;
+    # запись выбрасывается, если у файла на диске поменялись mtime или размер.
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, max_entry_size: int = SENDFILE_THRESHOLD,
+                 validate_interval: float = CACHE_VALIDATE_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.validate_interval = validate_interval
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            fresh = now - entry.checked_at < self.validate_interval
+        if not fresh:
+            # раз в validate_interval проверяем, не изменился ли файл
+            try:
+                st = os.stat(path)
+                changed = st.st_mtime_ns != entry.mtime_ns or st.st_size != entry.size
+            except OSError:
+                changed = True
+            with self._lock:
+                if changed:
+                    if self._entries.get(path) is entry:
+                        self._remove(path)
+                    self.invalidations += 1
+                    self.misses += 1
+                    return None
+                entry.checked_at = now
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            self.hits += 1
+        return entry
+
+    def put(self, path: str, st: os.stat_result, content_type: str, body: bytes):
+        if len(body) > self.max_entry_size or len(body) != st.st_size:
+            return
+        entry = _CacheEntry(st.st_mtime_ns, st.st_size, content_type, body)
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = entry
+            self._bytes += entry.nbytes()
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path)
+        self._bytes -= entry.nbytes()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+FILE_CACHE = FileCache()
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request_headers: dict, etag: str, mtime_ns: int) -> bool:
+    # If-None-Match главнее If-Modified-Since (RFC 7232, раздел 6)
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        return any(_strip_weak(tag) == etag for tag in if_none_match.split(","))
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        parsed = email.utils.parsedate_tz(if_modified_since)
+        if parsed is None:
+            return False
+        # в HTTP-датах нет долей секунды, поэтому сравниваем целые секунды
+        return mtime_ns // 1_000_000_000 <= email.utils.mktime_tz(parsed)
+    return False
+
+
+def if_range_matches(if_range, etag: str, last_modified: str) -> bool:
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag  # для If-Range допустимо только сильное сравнение
+    return if_range == last_modified
+
+
+# Разбирает заголовок Range. Возвращает None, если его нужно проигнорировать и
+# отдать файл целиком; [] — если ни один диапазон не попадает в файл (416);
+# иначе — отсортированный список непересекающихся (start, end) включительно.
+def parse_range(range_header: str, size: int):
+    range_header = range_header.strip()
+    if not range_header.lower().startswith("bytes="):
+        return None
+    ranges = []
+    for spec in range_header[6:].split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        if "-" not in spec:
+            return None
+        first, last = spec.split("-", 1)
+        try:
+            if first.strip() == "":
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+            else:
+                start = int(first)
+                if last.strip():
+                    end = int(last)
+                    if end < start:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start < 0 or start >= size or start > end:
+            continue
+        ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    # Пересекающиеся и соседние диапазоны склеиваем
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Ответ для найденного файла с учётом условных заголовков и Range. Тело берётся
+# либо из body (файл уже в памяти), либо из открытого f (кусками через sendfile).
+def file_response(raw_path: str, request_headers: dict, keep_alive: bool, size: int, mtime_ns: int,
+                  content_type: str, body=None, f=None, full_head=None, source="") -> HTTPResponse:
+    validators = file_validator_headers(size, mtime_ns)
+    etag = make_etag(size, mtime_ns)
+    last_modified = validators[1].split(": ", 1)[1]
+
+    if is_not_modified(request_headers, etag, mtime_ns):
+        if f is not None:
+            f.close()
+        resp_head = make_http_response_headers(304, None, None, keep_alive, validators)
+        return HTTPResponse(resp_head, b"", f"304: {raw_path} not modified", keep_alive)
+
+    ranges = None
+    range_header = request_headers.get("range")
+    if range_header is not None and if_range_matches(request_headers.get("if-range"), etag, last_modified):
+        ranges = parse_range(range_header, size)
+
+    if ranges is None:
+        if full_head is None:
+            full_head = make_http_response_headers(200, size, content_type, keep_alive, validators)
+        message = f"200: Served {raw_path} ({size} bytes{source})"
+        if f is not None:
+            return HTTPResponse(full_head, b"", message, keep_alive, file=f, segments=[[0, size]])
+        return HTTPResponse(full_head, body, message, keep_alive)
+
+    if not ranges:
+        if f is not None:
+            f.close()
+        resp_head = make_http_response_headers(416, 0, None, keep_alive,
+                                               [f"Content-Range: bytes */{size}"] + validators)
+        return HTTPResponse(resp_head, b"", f"416: {raw_path} range {range_header!r} not satisfiable",
+                            keep_alive)
+
+    message = f"206: Served {raw_path} ranges {ranges}{source}"
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        resp_head = make_http_response_headers(206, length, content_type, keep_alive,
+                                               [f"Content-Range: bytes {start}-{end}/{size}"] + validators)
+        if f is not None:
+            return HTTPResponse(resp_head, b"", message, keep_alive, file=f, segments=[[start, length]])
+        return HTTPResponse(resp_head, body[start:end + 1], message, keep_alive)
+
+    # Несколько диапазонов — multipart/byteranges
+    boundary = os.urandom(12).hex()
+    segments = []
+    for start, end in ranges:
+        part_head = (f"\r\n--{boundary}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('utf-8')
+        segments.append(part_head)
+        segments.append([start, end - start + 1])
+    segments.append(f"\r\n--{boundary}--\r\n".encode('utf-8'))
+    length = sum(len(seg) if isinstance(seg, bytes) else seg[1] for seg in segments)
+    resp_head = make_http_response_headers(206, length, f"multipart/byteranges; boundary={boundary}",
+                                           keep_alive, validators)
+    if f is not None:
+        return HTTPResponse(resp_head, b"", message, keep_alive, file=f, segments=segments)
+    multipart_body = b"".join(
+        seg if isinstance(seg, bytes) else body[seg[0]:seg[0] + seg[1]] for seg in segments
+    )
+    return HTTPResponse(resp_head, multipart_body, message, keep_alive)
+
+
+# Ответ на запрос, который не удалось разобрать; соединение после него закрываем
+def error_response(error: HTTPParseError) -> HTTPResponse:
+    body = f"{error.status} {REASONS.get(error.status, 'Error')}: {error}".encode('utf-8')
+    resp_head = make_http_response_headers(error.status, len(body), "text/plain")
+    return HTTPResponse(resp_head, body, f"{error.status}: {error}", False)
+
+
+def build_response(request: HTTPMessage, allow_keep_alive: bool = True) -> HTTPResponse:
+    keep_alive = allow_keep_alive and request.keep_alive
+    if request.method != "GET":
+        # тело запроса парсер уже дочитал, так что соединение можно оставить
+        body = b"500 Internal Server Error"
+        resp_head = make_http_response_headers(500, len(body), "text/plain", keep_alive)
+        return HTTPResponse(resp_head, body, f"500: unsupported method {request.method}", keep_alive)
+
+    request_headers = request.headers
+    raw_path = request.target
+    if raw_path.startswith("/"):
+        raw_path = raw_path[1:]
+    if raw_path == "":
+        raw_path = "index.html"
+
+    if raw_path == CACHE_STATS_PATH:
+        body = json.dumps(FILE_CACHE.stats()).encode('utf-8')
+        resp_head = make_http_response_headers(200, len(body), "application/json", keep_alive)
+        return HTTPResponse(resp_head, body, "200: cache stats", keep_alive)
+
+    # Горячий файл отдаём из памяти: без stat/open/read
+    entry = FILE_CACHE.get(raw_path)
+    if entry is not None:
+        return file_response(raw_path, request_headers, keep_alive, entry.size, entry.mtime_ns,
+                             entry.content_type, body=entry.body, full_head=entry.heads[keep_alive],
+                             source=", cache")
+
+    if not os.path.isfile(raw_path):
+        body = f"<html><body><h1>404 Not Found</h1><p>File {raw_path} not found.</p></body></html>".encode('utf-8')
+        resp_head = make_http_response_headers(404, len(body), "text/html", keep_alive)
+        return HTTPResponse(resp_head, body, f"404: {raw_path} not found", keep_alive)
+
+    try:
+        content_type, _ = mimetypes.guess_type(raw_path)
+        if content_type is None:
+            content_type = "application/octet-stream"
+        f = open(raw_path, "rb")
+        st = os.fstat(f.fileno())
+        if st.st_size > SENDFILE_THRESHOLD:
+            # файл остаётся открытым, тело уйдёт через sendfile
+            return file_response(raw_path, request_headers, keep_alive, st.st_size, st.st_mtime_ns,
+                                 content_type, f=f, source=", sendfile")
+        with f:
+            content = f.read()
+        FILE_CACHE.put(raw_path, st, content_type, content)
+        return file_response(raw_path, request_headers, keep_alive, len(content), st.st_mtime_ns,
+                             content_type, body=content)
+    except Exception as e:
+        body = f"<html><body><h1>500 Internal Server Error</h1><p>{e}</p></body></html>".encode('utf-8')
+        resp_head = make_http_response_headers(500, len(body), "text/html")
+        return HTTPResponse(resp_head, body, f"ERROR: Failed to read/send {raw_path}: {e}", False)
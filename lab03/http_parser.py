@@ -0,0 +1,336 @@
+MAX_HEADER_SIZE = 64 * 1024
+MAX_CHUNK_LINE = 4096
+
+# Состояния парсера
+_HEAD = 0         # ждём конец заголовков
+_LENGTH = 1       # тело фиксированной длины (Content-Length)
+_CHUNK_SIZE = 2   # строка с размером очередного chunk
+_CHUNK_DATA = 3   # данные chunk
+_CHUNK_CRLF = 4   # \r\n после данных chunk
+_TRAILERS = 5     # заголовки после последнего chunk
+_EOF = 6          # тело до закрытия соединения (только в ответах)
+_DONE = 7         # сообщение разобрано, осталось отдать MESSAGE_END
+
+MESSAGE_END = object()  # событие «сообщение закончилось»
+
+
+class HTTPParseError(ValueError):
+    # status — код, которым серверу стоит ответить на такой запрос
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPMessage:
+    __slots__ = ("method", "target", "version", "status", "reason",
+                 "headers", "header_list", "raw_head", "body", "keep_alive")
+
+    def __init__(self):
+        self.method = None
+        self.target = None
+        self.version = None
+        self.status = None
+        self.reason = None
+        self.headers = {}       # имя в нижнем регистре -> значение
+        self.header_list = []   # [(имя как пришло, значение)] — для пересылки как есть
+        self.raw_head = b""
+        self.body = b""
+        self.keep_alive = False
+
+
+# strict=False — строки без двоеточия пропускаются, а не считаются ошибкой
+def parse_header_lines(lines, strict: bool = True):
+    headers = {}
+    header_list = []
+    for line in lines:
+        if not line:
+            continue
+        if ":" not in line:
+            if not strict:
+                continue
+            raise HTTPParseError(f"malformed header line {line!r}")
+        name, value = line.split(":", 1)
+        name = name.strip()
+        value = value.strip()
+        header_list.append((name, value))
+        key = name.lower()
+        # повторяющиеся заголовки склеиваем через запятую (RFC 7230, 3.2.2)
+        headers[key] = f"{headers[key]}, {value}" if key in headers else value
+    return headers, header_list
+
+
+def _wants_keep_alive(version: str, headers: dict) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        return "close" not in connection
+    return "keep-alive" in connection
+
+
+class HTTPParser:
+    # Инкрементальный парсер HTTP/1.x поверх одного bytearray.
+    # feed() дописывает байты, next_event() выдаёт по одному событию:
+    # HTTPMessage (заголовки), memoryview (кусок тела), MESSAGE_END или None (нужны ещё данные).
+    # Куски тела не копируются: это окна в буфер парсера, их сразу пишут или отправляют.
+    # Сохранять их тоже можно — пока окно живо, feed() не трогает старый буфер, а заводит новый.
+    # next_message() собирает сообщение целиком — удобно для небольших запросов.
+    # Поиск конца заголовков и строк chunk продолжается с места, где остановился,
+    # поэтому медленно приходящие по байту заголовки не разбираются заново.
+    __slots__ = ("kind", "max_header_size", "max_body_size", "head_request", "_buf", "_pos",
+                 "_scan", "_state", "_remaining", "_eof", "_message", "_body")
+
+    def __init__(self, kind: str = "request", max_header_size: int = MAX_HEADER_SIZE,
+                 max_body_size=None):
+        if kind not in ("request", "response"):
+            raise ValueError("kind must be 'request' or 'response'")
+        self.kind = kind
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.head_request = False  # для ответов: запрос был HEAD, тела не будет
+        self._buf = bytearray()
+        self._pos = 0              # начало неразобранных данных в _buf
+        self._scan = 0             # откуда продолжать поиск разделителя
+        self._state = _HEAD
+        self._remaining = 0
+        self._eof = False
+        self._message = None       # текущее сообщение (для next_message)
+        self._body = None
+
+    @property
+    def idle(self) -> bool:
+        # между сообщениями и без недочитанных байт
+        return self._state == _HEAD and self._pos == len(self._buf)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buf) - self._pos
+
+    def feed(self, data):
+        try:
+            if self._pos and self._pos >= len(self._buf) // 2:
+                # Сдвигаем буфер редко и целиком, а не после каждого сообщения
+                del self._buf[:self._pos]
+                self._scan -= self._pos
+                self._pos = 0
+            self._buf += data
+        except BufferError:
+            # на буфер ещё смотрит выданный кусок тела — менять размер нельзя,
+            # переносим неразобранный хвост в новый буфер, старый остаётся тому куску
+            self._buf = self._buf[self._pos:] + data
+            self._scan -= self._pos
+            self._pos = 0
+
+    def feed_eof(self):
+        self._eof = True
+
+    def take_buffered(self) -> bytes:
+        # Забрать непрочитанный хвост (например, после CONNECT или Upgrade)
+        data = bytes(memoryview(self._buf)[self._pos:])
+        self._buf = bytearray()
+        self._pos = self._scan = 0
+        return data
+
+    def next_event(self):
+        buf = self._buf
+        if self._state == _HEAD:
+            end = buf.find(b"\r\n\r\n", max(self._scan, self._pos))
+            if end == -1:
+                if len(buf) - self._pos > self.max_header_size:
+                    raise HTTPParseError("header section too large", 431)
+                if self._eof and len(buf) > self._pos:
+                    raise HTTPParseError("connection closed inside headers")
+                self._scan = max(self._pos, len(buf) - 3)
+                return None
+            if end - self._pos > self.max_header_size:
+                raise HTTPParseError("header section too large", 431)
+            raw_head = bytes(memoryview(buf)[self._pos:end + 4])
+            self._pos = end + 4
+            self._scan = self._pos
+            return self._start_message(raw_head)
+
+        if self._state == _LENGTH:
+            if self._remaining == 0:
+                self._state = _DONE
+                return self.next_event()
+            available = len(buf) - self._pos
+            if not available:
+                if self._eof:
+                    raise HTTPParseError("connection closed inside body")
+                return None
+            n = min(available, self._remaining)
+            data = memoryview(buf)[self._pos:self._pos + n]
+            self._pos += n
+            self._remaining -= n
+            return data
+
+        if self._state == _CHUNK_SIZE:
+            line = self._read_line()
+            if line is None:
+                return None
+            size_text = line.split(b";", 1)[0].strip()
+            try:
+                size = int(size_text, 16)
+            except ValueError:
+                raise HTTPParseError(f"bad chunk size {size_text!r}")
+            if size < 0:
+                raise HTTPParseError("negative chunk size")
+            if size == 0:
+                self._state = _TRAILERS
+            else:
+                self._state = _CHUNK_DATA
+                self._remaining = size
+            return self.next_event()
+
+        if self._state == _CHUNK_DATA:
+            available = len(buf) - self._pos
+            if not available:
+                if self._eof:
+                    raise HTTPParseError("connection closed inside chunk")
+                return None
+            n = min(available, self._remaining)
+            data = memoryview(buf)[self._pos:self._pos + n]
+            self._pos += n
+            self._remaining -= n
+            if self._remaining == 0:
+                self._state = _CHUNK_CRLF
+            return data
+
+        if self._state == _CHUNK_CRLF:
+            if len(buf) - self._pos < 2:
+                if self._eof:
+                    raise HTTPParseError("connection closed inside chunk")
+                return None
+            if buf[self._pos:self._pos + 2] != b"\r\n":
+                raise HTTPParseError("missing CRLF after chunk data")
+            self._pos += 2
+            self._scan = self._pos
+            self._state = _CHUNK_SIZE
+            return self.next_event()
+
+        if self._state == _TRAILERS:
+            # Трейлеры читаем и отбрасываем до пустой строки
+            while True:
+                line = self._read_line()
+                if line is None:
+                    return None
+                if not line:
+                    self._state = _DONE
+                    return self.next_event()
+
+        if self._state == _EOF:
+            available = len(buf) - self._pos
+            if available:
+                data = memoryview(buf)[self._pos:]
+                self._pos = len(buf)
+                return data
+            if self._eof:
+                self._state = _DONE
+                return self.next_event()
+            return None
+
+        # _DONE
+        self._state = _HEAD
+        self._scan = self._pos
+        return MESSAGE_END
+
+    def next_message(self):
+        # Возвращает полностью прочитанное HTTPMessage (body — всё тело) или None
+        while True:
+            event = self.next_event()
+            if event is None:
+                return None
+            if isinstance(event, HTTPMessage):
+                self._message = event
+                self._body = bytearray()
+            elif event is MESSAGE_END:
+                message, self._message = self._message, None
+                message.body = bytes(self._body)
+                self._body = None
+                return message
+            else:
+                self._body += event
+                if self.max_body_size is not None and len(self._body) > self.max_body_size:
+                    raise HTTPParseError("body too large", 413)
+
+    def _read_line(self):
+        end = self._buf.find(b"\r\n", max(self._scan, self._pos))
+        if end == -1:
+            if len(self._buf) - self._pos > MAX_CHUNK_LINE:
+                raise HTTPParseError("chunk line too long")
+            if self._eof:
+                raise HTTPParseError("connection closed inside chunked body")
+            self._scan = max(self._pos, len(self._buf) - 1)
+            return None
+        line = bytes(self._buf[self._pos:end])
+        self._pos = end + 2
+        self._scan = self._pos
+        return line
+
+    def _start_message(self, raw_head: bytes) -> HTTPMessage:
+        lines = raw_head.decode("latin-1").split("\r\n")
+        # RFC 7230 разрешает пустые строки перед start-line
+        while lines and not lines[0]:
+            lines.pop(0)
+        if not lines:
+            raise HTTPParseError("empty message")
+        message = HTTPMessage()
+        message.raw_head = raw_head
+        parts = lines[0].split(None, 2)
+        if self.kind == "request":
+            if len(parts) == 2:
+                parts.append("HTTP/1.0")  # запрос в стиле HTTP/0.9 без версии
+            if len(parts) != 3 or not parts[2].upper().startswith("HTTP/"):
+                raise HTTPParseError(f"bad request line {lines[0]!r}")
+            message.method = parts[0].upper()
+            message.target = parts[1]
+            message.version = parts[2].upper()
+        else:
+            if len(parts) < 2 or not parts[0].upper().startswith("HTTP/"):
+                raise HTTPParseError(f"bad status line {lines[0]!r}")
+            try:
+                message.status = int(parts[1])
+            except ValueError:
+                raise HTTPParseError(f"bad status code {parts[1]!r}")
+            message.version = parts[0].upper()
+            message.reason = parts[2] if len(parts) > 2 else ""
+        message.headers, message.header_list = parse_header_lines(lines[1:])
+        message.keep_alive = _wants_keep_alive(message.version, message.headers)
+        self._choose_body_mode(message)
+        return message
+
+    def _choose_body_mode(self, message: HTTPMessage):
+        headers = message.headers
+        if self.kind == "response" and (
+                self.head_request or 100 <= message.status < 200 or message.status in (204, 304)):
+            self._state = _DONE
+            return
+        transfer_encoding = headers.get("transfer-encoding", "").lower()
+        if transfer_encoding:
+            if transfer_encoding.split(",")[-1].strip() == "chunked":
+                self._state = _CHUNK_SIZE
+                return
+            if self.kind == "request":
+                raise HTTPParseError("unsupported transfer-encoding", 501)
+            self._state = _EOF
+            message.keep_alive = False
+            return
+        if "content-length" in headers:
+            values = {v.strip() for v in headers["content-length"].split(",")}
+            if len(values) != 1:
+                raise HTTPParseError("conflicting Content-Length")
+            try:
+                length = int(values.pop())
+            except ValueError:
+                raise HTTPParseError("bad Content-Length")
+            if length < 0:
+                raise HTTPParseError("bad Content-Length")
+            if self.max_body_size is not None and length > self.max_body_size:
+                raise HTTPParseError("body too large", 413)
+            self._state = _LENGTH
+            self._remaining = length
+            return
+        if self.kind == "request":
+            self._state = _DONE
+        else:
+            # у ответа без длины тело идёт до закрытия соединения
+            self._state = _EOF
+            message.keep_alive = False
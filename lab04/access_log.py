@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import queue
+import itertools
+import threading
+
+ACCESS_LOG_FILE = "proxy.log"
+LOG_MAX_BYTES = 16 * 1024 * 1024   # после этого размера файл ротируется: proxy.log -> proxy.log.1 -> ...
+LOG_BACKUPS = 5
+LOG_QUEUE_SIZE = 10000             # записи сверх этого не ждут места, а отбрасываются и считаются
+LOG_BATCH_SIZE = 512               # сколько записей пишется на диск за один write
+LOG_FLUSH_INTERVAL = 0.5           # и как долго запись может ждать в очереди, пока пачка не наберётся
+
+_STOP = object()
+
+
+class AccessLog:
+    # Журнал запросов в формате JSON lines, одна запись на запрос:
+    # {"ts", "client", "method", "url", "status", "cache", "bytes", "upstream_ms", "total_ms", ...}.
+    # Обработчики только кладут запись в очередь (put_nowait, без блокировок и диска),
+    # отдельный поток собирает записи пачками, пишет их одним write и ротирует файл.
+    # Если очередь переполнена, запись отбрасывается, а в журнал потом попадает
+    # запись {"event": "dropped", "count": N} — запросы при этом никогда не ждут журнал.
+    def __init__(self, path: str = ACCESS_LOG_FILE, max_bytes: int = LOG_MAX_BYTES,
+                 backups: int = LOG_BACKUPS, queue_size: int = LOG_QUEUE_SIZE,
+                 batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+        self._drops = itertools.count()   # next() атомарен под GIL, блокировка не нужна
+        self.dropped = 0
+        self.reported_drops = 0
+        self.written = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self.thread.start()
+
+    def begin(self, client: str = None) -> dict:
+        # Заготовка записи: обработчик дополняет её по ходу запроса и отдаёт в finish()
+        return {"client": client, "method": None, "url": None, "status": None, "cache": None,
+                "bytes": 0, "upstream_ms": None, "_started": time.monotonic()}
+
+    def finish(self, entry: dict):
+        started = entry.pop("_started")
+        entry["ts"] = time.time()
+        entry["total_ms"] = round((time.monotonic() - started) * 1000, 1)
+        self.record(entry)
+
+    def record(self, entry: dict):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped = next(self._drops) + 1
+
+    def close(self):
+        # Дописывает всё, что уже в очереди; вызывается при остановке прокси
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+            dropped = self.dropped
+            if dropped != self.reported_drops:
+                batch.append({"ts": time.time(), "event": "dropped", "count": dropped - self.reported_drops})
+                self.reported_drops = dropped
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        data = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch)
+        data = data.encode("utf-8")
+        try:
+            if self.max_bytes and os.path.exists(self.path) \
+                    and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError as e:
+            print(f"[!] Access log write failed: {e}")
+            return
+        self.written += len(batch)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
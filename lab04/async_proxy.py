@@ -0,0 +1,665 @@
+import os
+import time
+import signal
+import asyncio
+import traceback
+import resource
+
+import proxy_server as px
+from http_parser import HTTPParser, HTTPParseError, HTTPMessage
+from tunnel import (parse_connect_target, CONNECT_ESTABLISHED, TUNNEL_BUFFER_SIZE, TUNNEL_CONNECT_TIMEOUT,
+                    TUNNEL_POLL_INTERVAL)
+
+# Тот же конвейер, что и в proxy_server.handle_client (разбор запроса, чёрный список,
+# кэш, пересылка в origin, сохранение ответа), но на asyncio: одно соединение —
+# одна корутина, а не поток. Кэш, чёрный список и правила свежести общие с proxy_server.
+# Запуск: python3 async_proxy.py 8888 [--max-connections N] [таймауты] [параметры кэша]
+
+MAX_CONNECTIONS = 20000        # больше одновременных клиентов не держим, лишним отвечаем 503
+REQUEST_TIMEOUT = 15.0         # на чтение запроса клиента целиком (защита от медленных клиентов)
+CONNECT_TIMEOUT = 10.0         # на соединение с origin
+UPSTREAM_READ_TIMEOUT = 30.0   # на каждое чтение из origin
+CLIENT_WRITE_TIMEOUT = 30.0    # на каждую отправку клиенту (drain)
+SENDFILE_CHUNK = 4 * 1024 * 1024   # кусок ответа из кэша, на отправку которого есть CLIENT_WRITE_TIMEOUT
+LISTEN_BACKLOG = 1024
+
+RESPONSE_503 = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+RESPONSE_502 = b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+RESPONSE_504 = b"HTTP/1.1 504 Gateway Timeout\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+class Timeouts:
+    def __init__(self, request=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT,
+                 upstream_read=UPSTREAM_READ_TIMEOUT, client_write=CLIENT_WRITE_TIMEOUT):
+        self.request = request
+        self.connect = connect
+        self.upstream_read = upstream_read
+        self.client_write = client_write
+
+
+TIMEOUTS = Timeouts()
+
+
+class UpstreamTimeout(px.UpstreamError):
+    pass
+
+
+class AsyncUpstreamPool:
+    # То же, что px.UpstreamPool, но для пар (StreamReader, StreamWriter).
+    # Всё выполняется в одном потоке цикла событий, поэтому блокировки не нужны.
+    def __init__(self, idle_timeout: float = px.UPSTREAM_IDLE_TIMEOUT,
+                 max_idle_per_host: int = px.UPSTREAM_MAX_IDLE_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}   # (host, port) -> [(reader, writer, время возврата в пул)]
+        self.created = 0
+        self.reused = 0
+
+    async def acquire(self, host: str, port: int):
+        conns = self.idle.get((host, port))
+        while conns:
+            reader, writer, released_at = conns.pop()
+            # origin закрыл соединение, пока оно простаивало, — в буфере уже лежит EOF
+            if time.monotonic() - released_at > self.idle_timeout or reader.at_eof() or writer.is_closing():
+                writer.close()
+                continue
+            self.reused += 1
+            return reader, writer, True
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=px.STREAM_BUFFER_SIZE), TIMEOUTS.connect)
+        self.created += 1
+        return reader, writer, False
+
+    def release(self, host: str, port: int, reader, writer, reusable: bool):
+        conns = self.idle.setdefault((host, port), [])
+        now = time.monotonic()
+        for old in [c for c in conns if now - c[2] > self.idle_timeout]:
+            conns.remove(old)
+            old[1].close()
+        if reusable and not writer.is_closing() and len(conns) < self.max_idle_per_host:
+            conns.append((reader, writer, now))
+        else:
+            writer.close()
+
+    def stats(self) -> dict:
+        return {"idle": sum(len(c) for c in self.idle.values()), "created": self.created, "reused": self.reused}
+
+
+UPSTREAM_POOL = AsyncUpstreamPool()
+
+
+class Upstream:
+    __slots__ = ("host", "port", "reader", "writer")
+
+    def __init__(self, host, port, reader, writer):
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+
+    def release(self, reusable: bool):
+        UPSTREAM_POOL.release(self.host, self.port, self.reader, self.writer, reusable)
+
+
+async def _read_upstream(reader) -> bytes:
+    try:
+        return await asyncio.wait_for(reader.read(px.STREAM_BUFFER_SIZE), TIMEOUTS.upstream_read)
+    except asyncio.TimeoutError:
+        raise UpstreamTimeout("upstream read timed out")
+
+
+async def forward_http(method: str, url: str, version: str, hdrs: dict, body: bytes):
+    # Асинхронный аналог px.forward_http: возвращает (Upstream, parser, head, pending)
+    host, port, raw_req = px.build_upstream_request(method, url, version, hdrs, body)
+    retries = 1 if method in px.IDEMPOTENT_METHODS else 0
+    while True:
+        try:
+            reader, writer, reused = await UPSTREAM_POOL.acquire(host, port)
+        except asyncio.TimeoutError:
+            raise UpstreamTimeout(f"connect to {host}:{port} timed out")
+        except OSError as e:
+            raise px.UpstreamError(f"cannot connect to {host}:{port}: {e}")
+        upstream = Upstream(host, port, reader, writer)
+        pending = bytearray()
+        try:
+            writer.write(raw_req)
+            await asyncio.wait_for(writer.drain(), TIMEOUTS.upstream_read)
+            parser = HTTPParser("response")
+            parser.head_request = method == "HEAD"
+            while True:
+                event = parser.next_event()
+                if event is None:
+                    chunk = await _read_upstream(reader)
+                    if chunk:
+                        parser.feed(chunk)
+                        pending += chunk
+                    else:
+                        parser.feed_eof()
+                        if parser.idle:
+                            raise ConnectionResetError("upstream closed connection without response")
+                elif isinstance(event, HTTPMessage) and event.status >= 200:
+                    return upstream, parser, event, bytes(pending)
+        except HTTPParseError as e:
+            upstream.release(False)
+            raise px.UpstreamError(f"bad upstream response: {e}")
+        except asyncio.TimeoutError:
+            upstream.release(False)
+            raise UpstreamTimeout(f"upstream {host}:{port} timed out")
+        except OSError as e:
+            upstream.release(False)
+            if reused and retries and not pending:
+                retries -= 1
+                continue
+            raise px.UpstreamError(f"upstream {host}:{port} failed: {e}")
+        except BaseException:
+            upstream.release(False)
+            raise
+
+
+async def in_thread(func, *args):
+    # Дисковые операции кэша (open, чтение, запись, rename, удаление) выполняются в пуле потоков:
+    # медленный диск не должен останавливать цикл событий, а с ним и всех остальных клиентов
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _write_chunk(writer, data):
+    writer.write(data)
+    writer.flush()
+
+
+class ClientStream:
+    # Отправка клиенту с учётом backpressure: после каждой порции ждём drain(),
+    # так что медленный клиент притормаживает чтение из origin, а не раздувает буферы
+    def __init__(self, writer):
+        self.writer = writer
+        self.sent = 0
+
+    async def send(self, data):
+        self.writer.write(data)
+        self.sent += len(data)
+        await asyncio.wait_for(self.writer.drain(), TIMEOUTS.client_write)
+
+    async def send_cached(self, found) -> None:
+        # found — результат CACHE.lookup(): bytes или открытый файл
+        if isinstance(found, bytes):
+            await self.send(found)
+            return
+        with found:
+            loop = asyncio.get_running_loop()
+            # sendfile без копирования через пространство пользователя, где это возможно.
+            # Кусками по SENDFILE_CHUNK, и на каждый — тот же таймаут, что на drain() в send():
+            # клиент, переставший читать, не держит корутину и место в лимите соединений вечно
+            offset = 0
+            while True:
+                n = await asyncio.wait_for(loop.sendfile(self.writer.transport, found, offset, SENDFILE_CHUNK),
+                                           TIMEOUTS.client_write)
+                if not n:
+                    break
+                offset += n
+                self.sent += n
+            await asyncio.wait_for(self.writer.drain(), TIMEOUTS.client_write)
+
+
+class AsyncFlight:
+    # Асинхронный аналог px.Flight: ведущая корутина пишет ответ в файл,
+    # остальные читают его через общий дескриптор по мере появления байт.
+    # Дескриптор открывает сам ведущий (в пуле потоков, см. in_thread), start() его только публикует
+    def __init__(self):
+        self.changed = asyncio.Event()
+        self.fd = None
+        self.status = None
+        self.vary = None
+        self.shared = False
+        self.size = 0
+        self.done = False
+        self.failed = False
+        self.followers = 0
+
+    def _wake(self):
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+    def start(self, fd: int, status: int, vary: dict, shared: bool):
+        self.fd = fd
+        self.status = status
+        self.vary = vary
+        self.shared = shared
+        self._wake()
+
+    def advance(self, n: int):
+        self.size += n
+        self._wake()
+
+    def finish(self, failed: bool):
+        self.done = True
+        self.failed = failed
+        self._wake()
+        self._close_if_unused()
+
+    def leave(self):
+        self.followers -= 1
+        self._close_if_unused()
+
+    def _close_if_unused(self):
+        if self.done and self.followers == 0 and self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+FLIGHTS = {}   # url -> AsyncFlight
+
+
+async def follow_flight(flight: AsyncFlight, client: ClientStream, request_headers: dict) -> bool:
+    offset = 0
+    try:
+        # как в px.follow_flight: сначала дождаться заголовков ответа и проверить,
+        # можно ли отдать его этому клиенту (не private/no-store, тот же Vary)
+        while flight.fd is None and not flight.done:
+            try:
+                await asyncio.wait_for(flight.changed.wait(), px.FLIGHT_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                return False
+        if flight.fd is None or not px.shares_response(flight, request_headers):
+            return False
+        while True:
+            if flight.size <= offset and not flight.done:
+                try:
+                    await asyncio.wait_for(flight.changed.wait(), px.FLIGHT_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if offset == 0:
+                        return False
+                    raise px.UpstreamError("coalesced fetch stalled", response_started=True)
+                continue
+            if offset < flight.size:
+                data = await in_thread(os.pread, flight.fd, min(flight.size - offset, px.STREAM_BUFFER_SIZE),
+                                       offset)
+                await client.send(data)
+                offset += len(data)
+                continue
+            if not flight.failed:
+                return True
+            if offset == 0:
+                return False
+            raise px.UpstreamError("coalesced fetch failed", response_started=True)
+    finally:
+        flight.leave()
+
+
+async def relay_and_cache(upstream: Upstream, parser, head: HTTPMessage, pending: bytes,
+                          client: ClientStream, url: str, cache: bool, request_headers: dict,
+                          flight: AsyncFlight = None):
+    # То же, что px.relay_and_cache: ответ идёт клиенту по мере прихода и параллельно в кэш
+    response_time = time.time()
+    writer = None
+    if cache or flight is not None:
+        writer = await in_thread(px.CACHE.writer, url, flight is not None)
+    if flight is not None:
+        try:
+            fd = await in_thread(os.open, writer.tmp_path, os.O_RDONLY)
+        except BaseException:
+            writer.abort()
+            upstream.release(False)
+            raise
+        flight.start(fd, head.status, px.vary_values(request_headers, head.headers),
+                     px.is_storable(request_headers, head.headers))
+    data = px.for_client(head, pending)
+    client_alive = True
+    try:
+        while True:
+            if data:
+                if writer:
+                    await in_thread(_write_chunk, writer, data)
+                    if flight is not None:
+                        flight.advance(len(data))
+                if client_alive:
+                    try:
+                        await client.send(data)
+                    except (OSError, asyncio.TimeoutError):
+                        # ответ ждут другие клиенты — дочитываем его без этого клиента
+                        if flight is None:
+                            raise
+                        client_alive = False
+            if px._message_finished(parser):
+                break
+            data = await _read_upstream(upstream.reader)
+            if data:
+                parser.feed(data)
+            else:
+                parser.feed_eof()
+    except HTTPParseError as e:
+        if writer:
+            writer.abort()
+        upstream.release(False)
+        raise px.UpstreamError(f"bad upstream response: {e}", response_started=True)
+    except BaseException as e:
+        if writer:
+            writer.abort()
+        upstream.release(False)
+        if isinstance(e, px.UpstreamError):
+            e.response_started = True
+        raise
+    upstream.release(head.keep_alive and parser.idle)
+    if writer and cache:
+        await in_thread(writer.commit, px.make_meta(request_headers, head.headers, response_time))
+    elif writer:
+        await in_thread(writer.abort)
+
+
+async def read_request(reader):
+    # Возвращает (запрос, парсер): после CONNECT в парсере могут остаться байты туннеля
+    parser = HTTPParser("request", max_body_size=px.MAX_REQUEST_BODY)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + TIMEOUTS.request
+    while True:
+        request = parser.next_message()
+        if request is not None:
+            return request, parser
+        chunk = await asyncio.wait_for(reader.read(px.BUFFER_SIZE), max(0.0, deadline - loop.time()))
+        if not chunk:
+            return None, parser
+        parser.feed(chunk)
+
+
+class AsyncTunnel:
+    # Асинхронный аналог tunnel.Tunnel: два направления — две корутины.
+    # Пока получатель не забрал данные (drain), следующая порция не читается.
+    def __init__(self, client_reader, client_writer, upstream_reader, upstream_writer,
+                 idle_timeout: float):
+        self.client = (client_reader, client_writer)
+        self.upstream = (upstream_reader, upstream_writer)
+        self.idle_timeout = idle_timeout
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.idle_closed = False
+
+    @property
+    def duration(self) -> float:
+        return time.monotonic() - self.started
+
+    async def run(self, initial: bytes = b""):
+        upstream_writer = self.upstream[1]
+        if initial:
+            upstream_writer.write(initial)
+            self.bytes_up += len(initial)
+        await asyncio.gather(self._pump(self.client[0], upstream_writer, True),
+                             self._pump(self.upstream[0], self.client[1], False))
+
+    async def _pump(self, reader, writer, upstream_bound: bool):
+        poll = min(self.idle_timeout, TUNNEL_POLL_INTERVAL)
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(TUNNEL_BUFFER_SIZE), poll)
+                except asyncio.TimeoutError:
+                    if self._idle():
+                        return
+                    continue
+                if not data:
+                    break
+                self.last_activity = time.monotonic()
+                writer.write(data)
+                while True:
+                    try:
+                        await asyncio.wait_for(writer.drain(), poll)
+                        break
+                    except asyncio.TimeoutError:
+                        if self._idle():
+                            return
+                self.last_activity = time.monotonic()
+                if upstream_bound:
+                    self.bytes_up += len(data)
+                else:
+                    self.bytes_down += len(data)
+            # half-close: другая сторона ещё может досылать ответ
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            self._abort()
+
+    def _idle(self) -> bool:
+        if time.monotonic() - self.last_activity < self.idle_timeout:
+            return False
+        self.idle_closed = True
+        self._abort()
+        return True
+
+    def _abort(self):
+        for _, writer in (self.client, self.upstream):
+            writer.transport.abort()
+
+
+async def serve_connect(request, parser, reader, client: ClientStream, entry: dict):
+    host, port = parse_connect_target(request.target)
+    target = f"{host}:{port}"
+    if px.in_blacklist(target):
+        await client.send(px.BLOCKED_RESPONSE)
+        entry.update(status=403, cache="BLOCK")
+        return
+    started = time.monotonic()
+    try:
+        upstream_reader, upstream_writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=TUNNEL_BUFFER_SIZE), TUNNEL_CONNECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise UpstreamTimeout(f"connect to {target} timed out")
+    except OSError as e:
+        raise px.UpstreamError(f"cannot connect to {target}: {e}")
+    entry["upstream_ms"] = px._ms_since(started)
+    tunnel = AsyncTunnel(reader, client.writer, upstream_reader, upstream_writer, px.tunnel_idle_timeout)
+    try:
+        await client.send(CONNECT_ESTABLISHED)
+        entry.update(status=200, cache="TUNNEL")
+        await tunnel.run(parser.take_buffered())
+    finally:
+        upstream_writer.close()
+        client.sent += tunnel.bytes_down
+        entry.update(bytes_up=tunnel.bytes_up, idle_timeout=tunnel.idle_closed)
+
+
+async def serve_request(request, client: ClientStream, entry: dict):
+    method, url, version = request.method, request.target, request.version
+    if url.startswith("/"):
+        url = url.lstrip("/")
+        entry["url"] = url
+    headers = dict(request.header_list)
+
+    if px.in_blacklist(url):
+        await client.send(px.BLOCKED_RESPONSE)
+        entry.update(status=403, cache="BLOCK")
+        return
+
+    meta = px.CACHE.get_meta(url) if method == "GET" else None
+    if meta is not None and px.vary_matches(meta, request.headers):
+        if px.is_fresh(meta, request.headers):
+            found = await in_thread(px.CACHE.lookup, url)
+            if found is not None:
+                await client.send_cached(found)
+                entry.update(status=200, cache="HIT")
+                return
+        revalidate = {k: v for k, v in headers.items()
+                      if k.lower() not in ("if-none-match", "if-modified-since")}
+        revalidate.update(px.conditional_headers(meta))
+        started = time.monotonic()
+        upstream, parser, head, pending = await forward_http(method, url, version, revalidate, b"")
+        entry["upstream_ms"] = px._ms_since(started)
+        if head.status == 304:
+            try:
+                px._message_finished(parser)
+            except HTTPParseError:
+                pass
+            upstream.release(head.keep_alive and parser.idle)
+            meta.update({name: head.headers[name] for name in px.META_FIELDS if name in head.headers})
+            meta["stored_at"] = time.time()
+            px.CACHE.update_meta(url, meta)
+            found = await in_thread(px.CACHE.lookup, url)
+            if found is not None:
+                await client.send_cached(found)
+                entry.update(status=200, cache="REVALIDATED")
+                return
+            await client.send(px.for_client(head, pending))
+            entry.update(status=304, cache="MISS")
+            return
+        storable = head.status == 200 and px.is_storable(request.headers, head.headers)
+        if not storable:
+            await in_thread(px.CACHE.remove, url)
+        entry.update(status=head.status, cache="UPDATE")
+        await relay_and_cache(upstream, parser, head, pending, client, url, storable, request.headers)
+        return
+
+    flight = None
+    if px.can_coalesce(method, request.headers):
+        flight = FLIGHTS.get(url)
+        if flight is not None:
+            flight.followers += 1
+            if await follow_flight(flight, client, request.headers):
+                entry.update(status=flight.status, cache="COALESCED")
+                return
+            flight = None
+        else:
+            flight = FLIGHTS[url] = AsyncFlight()
+
+    failed = True
+    try:
+        started = time.monotonic()
+        upstream, parser, head, pending = await forward_http(method, url, version, headers, request.body)
+        entry.update(upstream_ms=px._ms_since(started), status=head.status,
+                     cache="MISS" if method == "GET" else "BYPASS")
+        await relay_and_cache(upstream, parser, head, pending, client, url,
+                              method == "GET" and head.status == 200
+                              and px.is_storable(request.headers, head.headers),
+                              request.headers, flight)
+        failed = False
+    finally:
+        if flight is not None:
+            if FLIGHTS.get(url) is flight:
+                del FLIGHTS[url]
+            flight.finish(failed)
+
+
+class AsyncProxy:
+    def __init__(self, port: int, max_connections: int = MAX_CONNECTIONS):
+        self.port = port
+        self.max_connections = max_connections
+        self.active = 0
+        self.rejected = 0
+
+    async def handle(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        if self.active >= self.max_connections:
+            # лимит соединений: сразу отказываем, а не копим ожидающих
+            self.rejected += 1
+            writer.write(RESPONSE_503)
+            writer.close()
+            return
+        self.active += 1
+        px.METRICS.connection_opened()
+        client = ClientStream(writer)
+        entry = px.ACCESS_LOG.begin(f"{addr[0]}:{addr[1]}")
+        try:
+            try:
+                request, parser = await read_request(reader)
+            except asyncio.TimeoutError:
+                entry["error"] = "client request timed out"
+                return
+            if request is None:
+                return
+            entry.update(method=request.method, url=request.target)
+            if request.method == "GET" and request.target == px.STATS_PATH:
+                await client.send(px.stats_response(UPSTREAM_POOL.stats(), rejected=self.rejected,
+                                                    max_connections=self.max_connections))
+                entry.update(status=200, cache="STATS")
+            elif request.method == "CONNECT":
+                await serve_connect(request, parser, reader, client, entry)
+            else:
+                await serve_request(request, client, entry)
+        except px.UpstreamError as e:
+            entry["error"] = str(e)
+            if not e.response_started and client.sent == 0:
+                timed_out = isinstance(e, UpstreamTimeout)
+                entry["status"] = 504 if timed_out else 502
+                await self._send_quietly(writer, RESPONSE_504 if timed_out else RESPONSE_502)
+        except HTTPParseError as e:
+            entry.update(status=e.status, error=str(e))
+            await self._send_quietly(
+                writer, f"HTTP/1.1 {e.status} Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        except (OSError, asyncio.TimeoutError) as e:
+            # клиент отключился или не забирает данные — недоотправленное выбрасываем,
+            # иначе close() ждал бы, пока он прочитает буфер
+            entry["error"] = f"client: {type(e).__name__}: {e}"
+            writer.transport.abort()
+        except Exception:
+            entry["error"] = traceback.format_exc()
+            if client.sent == 0:
+                entry["status"] = 500
+                await self._send_quietly(writer, b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+        finally:
+            self.active -= 1
+            px.METRICS.connection_closed()
+            writer.close()
+            if entry["method"] is not None or entry["status"] is not None or "error" in entry:
+                entry["bytes"] = client.sent
+                px.METRICS.observe(entry)
+                px.ACCESS_LOG.finish(entry)
+
+    @staticmethod
+    async def _send_quietly(writer, data: bytes):
+        try:
+            writer.write(data)
+            await asyncio.wait_for(writer.drain(), TIMEOUTS.client_write)
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        server = await asyncio.start_server(self.handle, port=self.port, backlog=LISTEN_BACKLOG,
+                                            limit=px.STREAM_BUFFER_SIZE, reuse_address=True)
+        print(f"[+] Async proxy listening on port {self.port}, max_connections={self.max_connections}")
+        async with server:
+            await stop
+        print("\n[!] Shutting down…")
+
+
+def raise_nofile_limit():
+    # десятки тысяч соединений требуют столько же дескрипторов
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def main():
+    parser = px.build_arg_parser("Кэширующий HTTP-прокси на asyncio")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="максимум одновременных клиентских соединений")
+    parser.add_argument("--request-timeout", type=float, default=REQUEST_TIMEOUT,
+                        help="таймаут чтения запроса клиента, секунд")
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help="таймаут соединения с origin, секунд")
+    parser.add_argument("--read-timeout", type=float, default=UPSTREAM_READ_TIMEOUT,
+                        help="таймаут каждого чтения из origin, секунд")
+    parser.add_argument("--write-timeout", type=float, default=CLIENT_WRITE_TIMEOUT,
+                        help="таймаут отправки клиенту, секунд")
+    args = parser.parse_args()
+    if args.max_connections <= 0:
+        parser.error("--max-connections must be positive")
+    px.configure(args)
+    TIMEOUTS.request = args.request_timeout
+    TIMEOUTS.connect = args.connect_timeout
+    TIMEOUTS.upstream_read = args.read_timeout
+    TIMEOUTS.client_write = args.write_timeout
+    nofile = raise_nofile_limit()
+    if nofile < args.max_connections * 2:
+        print(f"[!] RLIMIT_NOFILE={nofile} may be too low for {args.max_connections} connections")
+    try:
+        asyncio.run(AsyncProxy(args.port, args.max_connections).serve())
+    finally:
+        px.CACHE.save()
+        px.ACCESS_LOG.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import threading
+import urllib.parse
+
+POLL_INTERVAL = 2.0  # как часто проверять, не изменился ли файл чёрного списка
+
+# Строка чёрного списка считается доменом, если состоит только из меток [a-z0-9-]
+# через точку (можно с "*." или "." в начале): такой домен блокируется вместе со
+# всеми поддоменами. Поддерживаются и строки в формате hosts ("0.0.0.0 ads.example.com").
+# Всё остальное (куски путей, ключевые слова) ищется как подстрока во всём URL.
+_DOMAIN_RE = re.compile(r"^(?:\*?\.)?([a-z0-9-]+(?:\.[a-z0-9-]+)+)\.?$")
+_HOSTS_PREFIXES = ("0.0.0.0 ", "127.0.0.1 ", "::1 ")
+_END = ""  # метка-признак конца домена в суффиксном дереве (пустых меток в доменах не бывает)
+
+
+class AhoCorasick:
+    # Автомат Ахо–Корасик: за один проход по тексту проверяет сразу все подстроки-шаблоны
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [False]
+        for pattern in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(False)
+                node = nxt
+            self.out[node] = True
+        # ссылки неудач строим обходом в ширину
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] or self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> bool:
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return True
+        return False
+
+
+class DomainTrie:
+    # Дерево по меткам домена справа налево: com -> example -> ads.
+    # Проверка хоста стоит O(число меток) и не зависит от размера списка.
+    def __init__(self, domains):
+        self.root = {}
+        for domain in domains:
+            node = self.root
+            for label in reversed(domain.split(".")):
+                node = node.setdefault(label, {})
+            node[_END] = True
+
+    def matches(self, host: str) -> bool:
+        node = self.root
+        for label in reversed(host.rstrip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+class BlacklistMatcher:
+    def __init__(self, lines):
+        domains, substrings = [], []
+        for line in lines:
+            line = line.strip().lower()
+            if not line or line.startswith("#"):
+                continue
+            for prefix in _HOSTS_PREFIXES:
+                if line.startswith(prefix):
+                    line = line[len(prefix):].strip()
+                    break
+            m = _DOMAIN_RE.match(line)
+            if m:
+                domains.append(m.group(1))
+            else:
+                substrings.append(line)
+        self.domain_count = len(domains)
+        self.substring_count = len(substrings)
+        self.domains = DomainTrie(domains)
+        self.substrings = AhoCorasick(substrings) if substrings else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "BlacklistMatcher":
+        if not os.path.exists(path):
+            return cls([])
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f)
+
+    def matches(self, url: str) -> bool:
+        url_l = url.lower()
+        # URL может прийти без схемы (http://proxy:8888/www.google.com)
+        parsed = urllib.parse.urlparse(url_l if "://" in url_l else "http://" + url_l)
+        host = parsed.hostname or ""
+        if host and self.domains.matches(host):
+            return True
+        return self.substrings is not None and self.substrings.search(url_l)
+
+
+class BlacklistWatcher:
+    # Держит актуальный BlacklistMatcher и пересобирает его в фоне, когда файл меняется.
+    # Запросы читают self.matcher без блокировок: новый автомат подменяется одним присваиванием.
+    def __init__(self, path: str, poll_interval: float = POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.signature = self._signature()
+        self.matcher = BlacklistMatcher.from_file(path)
+        self.reloads = 0
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def start(self):
+        threading.Thread(target=self._watch, name="blacklist-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            signature = self._signature()
+            if signature == self.signature:
+                continue
+            try:
+                matcher = BlacklistMatcher.from_file(self.path)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[!] Blacklist reload failed: {e}")
+                continue
+            self.signature = signature
+            self.matcher = matcher
+            self.reloads += 1
+            print(f"[+] Blacklist reloaded: {matcher.domain_count} domains, "
+                  f"{matcher.substring_count} substrings")
+
+    def matches(self, url: str) -> bool:
+        return self.matcher.matches(url)
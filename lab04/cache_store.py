@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_MAX_BYTES = 512 * 1024 * 1024     # общий бюджет дискового кэша
+MEMORY_MAX_BYTES = 32 * 1024 * 1024     # бюджет горячих объектов в памяти
+MEMORY_MAX_OBJECT = 256 * 1024          # объекты крупнее в память не попадают
+INDEX_SAVE_INTERVAL = 5.0               # как часто фоновый поток сохраняет изменившийся индекс, секунд
+EVICT_TO = 0.9                          # вытесняем с запасом, до 90% бюджета
+EVICTION_POLICIES = ("lru", "lfu")
+
+INDEX_FILE = "index.json"
+TMP_DIR = "tmp"
+
+
+class CacheWriter:
+    # Запись одного ответа в кэш. Данные идут во временный файл в <cache>/tmp,
+    # и только commit() атомарно (os.replace) кладёт его на место и добавляет в индекс,
+    # поэтому другие потоки никогда не видят недописанный объект.
+    # spool=True — файл нужен не только кэшу (его читают ждущие того же ответа клиенты),
+    # поэтому ответ дописывается целиком, даже если в бюджет кэша он не помещается.
+    def __init__(self, store: "CacheStore", url: str, tmp_path: str, spool: bool = False):
+        self.store = store
+        self.url = url
+        self.tmp_path = tmp_path
+        self.spool = spool
+        self.file = open(tmp_path, "wb")
+        self.size = 0
+        self.oversize = False
+        # небольшой ответ заодно собираем в памяти, чтобы не перечитывать его для memory-уровня
+        self.memory = bytearray() if store.memory_max_object else None
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.size += len(data)
+        if self.size > self.store.max_bytes:
+            self.oversize = True
+            self.memory = None
+            if not self.spool:
+                # в бюджет всё равно не влезет — перестаём писать, commit ничего не сохранит
+                self.abort()
+                return
+        self.file.write(data)
+        if self.memory is not None:
+            if self.size <= self.store.memory_max_object:
+                self.memory += data
+            else:
+                self.memory = None
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def commit(self, meta: dict):
+        if self.file is None:
+            return
+        if self.oversize:
+            self.abort()
+            return
+        self.file.close()
+        self.file = None
+        self.store._commit(self, meta)
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class CacheStore:
+    # Двухуровневый кэш ответов.
+    # Диск: <cache>/<первые 2 символа sha256(url)>/<sha256(url)> — имя не зависит от длины URL,
+    #   а 256 подкаталогов не дают одному каталогу разрастись до сотен тысяч файлов.
+    # Индекс (url, размер, метаданные, счётчики обращений) живёт в памяти, при старте загружается
+    #   из <cache>/index.json, а сохраняет его фоновый поток (start()): запросы только
+    #   помечают индекс изменённым и никогда не ждут записи всего индекса на диск.
+    # Память: LRU небольших горячих объектов, которые отдаются без обращения к диску.
+    # Суммарный размер на диске ограничен max_bytes, лишнее вытесняется по LRU или LFU.
+    def __init__(self, cache_dir: str, max_bytes: int = CACHE_MAX_BYTES,
+                 memory_max_bytes: int = MEMORY_MAX_BYTES, memory_max_object: int = MEMORY_MAX_OBJECT,
+                 policy: str = "lru"):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"policy must be one of {EVICTION_POLICIES}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_object = memory_max_object
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # digest -> {url, size, meta, hits, last_access}, от старых к свежим
+        self.memory = OrderedDict()    # digest -> bytes
+        self.total_bytes = 0
+        self.memory_bytes = 0
+        self.dirty = False
+        self.tmp_counter = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def load(self):
+        os.makedirs(os.path.join(self.cache_dir, TMP_DIR), exist_ok=True)
+        # недописанные ответы от прошлого запуска
+        for name in os.listdir(os.path.join(self.cache_dir, TMP_DIR)):
+            os.remove(os.path.join(self.cache_dir, TMP_DIR, name))
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        with self.lock:
+            # восстанавливаем порядок обращений, объекты без файла выбрасываем
+            for digest, entry in sorted(saved.items(), key=lambda item: item[1].get("last_access", 0)):
+                try:
+                    entry["size"] = os.path.getsize(self.path(digest))
+                except OSError:
+                    continue
+                self.entries[digest] = entry
+                self.total_bytes += entry["size"]
+            self._evict_locked()
+        self.save()
+
+    def start(self):
+        threading.Thread(target=self._save_periodically, name="cache-index", daemon=True).start()
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(INDEX_SAVE_INTERVAL)
+            if not self.dirty:
+                continue
+            try:
+                self.save()
+            except OSError as e:
+                print(f"[!] Cache index save failed: {e}")
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            snapshot = dict(self.entries)
+            self.dirty = False
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp = f"{index_path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, index_path)
+
+    def get_meta(self, url: str):
+        with self.lock:
+            entry = self.entries.get(self.digest(url))
+            return dict(entry["meta"]) if entry is not None else None
+
+    def update_meta(self, url: str, meta: dict):
+        with self.lock:
+            entry = self.entries.get(self.digest(url))
+            if entry is None:
+                return
+            entry["meta"] = meta
+            self.dirty = True
+
+    def writer(self, url: str, spool: bool = False) -> CacheWriter:
+        with self.lock:
+            self.tmp_counter += 1
+            name = f"{self.digest(url)}.{threading.get_ident()}.{self.tmp_counter}.tmp"
+        return CacheWriter(self, url, os.path.join(self.cache_dir, TMP_DIR, name), spool)
+
+    def _commit(self, writer: CacheWriter, meta: dict):
+        digest = self.digest(writer.url)
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            # rename под блокировкой: файл и запись в индексе меняются вместе
+            self._forget_locked(digest)
+            os.replace(writer.tmp_path, path)
+            self.entries[digest] = {"url": writer.url, "size": writer.size, "meta": meta,
+                                    "hits": 0, "last_access": time.time()}
+            self.total_bytes += writer.size
+            if writer.memory is not None:
+                self._remember_locked(digest, bytes(writer.memory))
+            self._evict_locked(keep=digest)
+            self.dirty = True
+
+    def lookup(self, url: str):
+        # Находит сохранённый ответ и учитывает обращение к нему.
+        # Возвращает bytes (объект из памяти), открытый файл (крупный объект с диска) или None.
+        digest = self.digest(url)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            entry["hits"] += 1
+            entry["last_access"] = time.time()
+            self.entries.move_to_end(digest)
+            self.dirty = True
+            data = self.memory.get(digest)
+            if data is not None:
+                self.memory.move_to_end(digest)
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+                size = entry["size"]
+        if data is not None:
+            return data
+        try:
+            # открытый файл остаётся читаемым, даже если его тут же вытеснят или заменят
+            f = open(self.path(digest), "rb")
+        except FileNotFoundError:
+            self.remove(url)
+            return None
+        if size > self.memory_max_object:
+            return f
+        with f:
+            data = f.read()
+        with self.lock:
+            if digest in self.entries:
+                self._remember_locked(digest, data)
+        return data
+
+    def send(self, client, url: str) -> int:
+        # Отдаёт сохранённый ответ клиенту: из памяти или с диска через sendfile.
+        # Возвращает число отправленных байт, 0 — ответа в кэше нет.
+        found = self.lookup(url)
+        if found is None:
+            return 0
+        if isinstance(found, bytes):
+            client.sendall(found)
+            return len(found)
+        with found:
+            return client.sendfile(found)
+
+    def remove(self, url: str):
+        digest = self.digest(url)
+        with self.lock:
+            if self._forget_locked(digest):
+                self.dirty = True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "policy": self.policy,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+            }
+
+    def _remember_locked(self, digest: str, data: bytes):
+        if len(data) > self.memory_max_object:
+            return
+        old = self.memory.pop(digest, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        self.memory[digest] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _forget_locked(self, digest: str) -> bool:
+        entry = self.entries.pop(digest, None)
+        data = self.memory.pop(digest, None)
+        if data is not None:
+            self.memory_bytes -= len(data)
+        if entry is None:
+            return False
+        self.total_bytes -= entry["size"]
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _evict_locked(self, keep: str = None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO
+        if self.policy == "lru":
+            victims = iter(list(self.entries))  # entries уже упорядочены по последнему обращению
+        else:
+            victims = iter(sorted(self.entries, key=lambda d: (self.entries[d]["hits"],
+                                                                 self.entries[d]["last_access"])))
+        for digest in victims:
+            if self.total_bytes <= target:
+                break
+            if digest == keep:
+                continue
+            self._forget_locked(digest)
+            self.evictions += 1
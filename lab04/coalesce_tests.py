@@ -0,0 +1,144 @@
+import socket
+import asyncio
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import proxy_server as px
+import async_proxy
+
+# Одновременные запросы одного URL объединяются в одну загрузку (см. px.can_coalesce),
+# но закрытый ответ одного пользователя не должен достаться другому.
+# Запуск: python3 coalesce_tests.py
+
+ORIGIN_DELAY = 0.5   # origin отвечает медленно, чтобы запросы успели пересечься
+
+
+class Origin(BaseHTTPRequestHandler):
+    # /public/... — общий ответ с номером запроса к origin, остальное — закрытый ответ пользователю
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def do_GET(self):
+        time.sleep(ORIGIN_DELAY)
+        if self.path.startswith("/public/"):
+            Origin.hits += 1
+            body = f"hit {Origin.hits}".encode()
+            cache_control = "public, max-age=60"
+        else:
+            who = self.headers.get("Cookie") or self.headers.get("X-User")
+            body = f"secret for {who}".encode()
+            cache_control = "private, max-age=60"
+        self.send_response(200)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_origin():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def start_threaded_proxy():
+    px.CACHE.cache_dir = tempfile.mkdtemp(prefix="proxy-cache-")
+    px.CACHE.load()
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+
+    def accept_loop():
+        while True:
+            client, addr = server.accept()
+            threading.Thread(target=px.handle_client, args=(client, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def start_async_proxy():
+    # цикл событий в отдельном потоке; кэш общий с px, его уже загрузил start_threaded_proxy()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    ports = []
+
+    async def serve():
+        server = await asyncio.start_server(async_proxy.AsyncProxy(0).handle, "127.0.0.1", 0)
+        ports.append(server.sockets[0].getsockname()[1])
+        started.set()
+        await server.serve_forever()
+
+    threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True).start()
+    started.wait()
+    return ports[0]
+
+
+def fetch(proxy_port: int, url: str, headers: dict) -> bytes:
+    lines = [f"GET /{url} HTTP/1.1", "Host: 127.0.0.1", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    with socket.create_connection(("127.0.0.1", proxy_port), timeout=10) as sock:
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return data.partition(b"\r\n\r\n")[2]
+
+
+def fetch_concurrently(proxy_port: int, url: str, header_sets) -> list:
+    bodies = [None] * len(header_sets)
+
+    def run(i):
+        bodies[i] = fetch(proxy_port, url, header_sets[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(header_sets))]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)   # первый запрос становится ведущим, остальные застают его загрузку
+    for t in threads:
+        t.join()
+    return bodies
+
+
+def check_private_not_shared(proxy_port: int, origin_port: int, name: str):
+    # разные cookie — разные пользователи
+    url = f"http://127.0.0.1:{origin_port}/cookie-{name}"
+    bodies = fetch_concurrently(proxy_port, url, [{"Cookie": "session=alice"}, {"Cookie": "session=bob"}])
+    assert bodies == [b"secret for session=alice", b"secret for session=bob"], bodies
+    # заголовок, по которому запросы не исключаются из объединения, но ответ private
+    url = f"http://127.0.0.1:{origin_port}/user-{name}"
+    bodies = fetch_concurrently(proxy_port, url, [{"X-User": "alice"}, {"X-User": "bob"}])
+    assert bodies == [b"secret for alice", b"secret for bob"], bodies
+    print(f"{name}: private responses are not shared between coalesced requests")
+
+
+def check_public_shared(proxy_port: int, origin_port: int, name: str):
+    hits = Origin.hits
+    bodies = fetch_concurrently(proxy_port, f"http://127.0.0.1:{origin_port}/public/{name}", [{}, {}, {}])
+    assert Origin.hits == hits + 1, Origin.hits - hits
+    assert len(set(bodies)) == 1, bodies
+    # и сохранён в кэш: следующий запрос в origin не идёт
+    assert fetch(proxy_port, f"http://127.0.0.1:{origin_port}/public/{name}", {}) == bodies[0]
+    assert Origin.hits == hits + 1, Origin.hits - hits
+    print(f"{name}: public response fetched once for {len(bodies)} concurrent requests and cached")
+
+
+def main():
+    print("=== Coalescing tests ===\n")
+    origin_port = start_origin()
+    for name, proxy_port in (("threaded", start_threaded_proxy()), ("async", start_async_proxy())):
+        check_private_not_shared(proxy_port, origin_port, name)
+        check_public_shared(proxy_port, origin_port, name)
+    print("\n=== All coalescing tests completed ===")
+
+
+if __name__ == "__main__":
+    main()
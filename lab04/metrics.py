@@ -0,0 +1,143 @@
+import bisect
+import threading
+import time
+import urllib.parse
+
+# Верхние границы корзин гистограммы задержек origin, мс (последняя корзина — всё, что дольше)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+MAX_HOSTS = 1000          # хосты сверх этого числа попадают в одну гистограмму "other"
+FOLD_EVERY = 256          # как часто новые потоки сворачивают счётчики завершившихся потоков
+CACHE_OUTCOMES = ("HIT", "REVALIDATED")   # ответ отдан из кэша
+ORIGIN_OUTCOMES = ("MISS", "UPDATE", "BYPASS", "COALESCED")
+
+
+class _Accumulator:
+    # Счётчики одного потока. Пишет в них только этот поток, поэтому блокировки не нужны;
+    # snapshot() из другого потока читает их копиями (copy() словаря атомарен под GIL).
+    __slots__ = ("thread", "outcomes", "bytes", "latency", "opened", "closed")
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.outcomes = {}   # исход (HIT, UPDATE, BLOCK, ...) -> число запросов
+        self.bytes = {}      # cache / origin / tunnel -> байт отправлено клиентам
+        self.latency = {}    # host -> [счётчики по корзинам..., сумма мс]
+        self.opened = 0
+        self.closed = 0
+
+    def merge(self, other: "_Accumulator"):
+        for key, n in other.outcomes.copy().items():
+            self.outcomes[key] = self.outcomes.get(key, 0) + n
+        for key, n in other.bytes.copy().items():
+            self.bytes[key] = self.bytes.get(key, 0) + n
+        for host, counts in other.latency.copy().items():
+            # у каждого потока своё ограничение MAX_HOSTS, а в общий счётчик завершившихся
+            # потоков хосты стекаются со всех — ограничиваем и здесь
+            if host not in self.latency and len(self.latency) >= MAX_HOSTS:
+                host = "other"
+            mine = self.latency.setdefault(host, [0] * (len(LATENCY_BUCKETS_MS) + 2))
+            for i, n in enumerate(list(counts)):
+                mine[i] += n
+        self.opened += other.opened
+        self.closed += other.closed
+
+
+class Metrics:
+    # Метрики прокси для GET /__proxy/stats. Каждый поток-обработчик копит счётчики
+    # в своём _Accumulator (threading.local), общая блокировка берётся только
+    # при появлении нового потока и при сборе снимка. Счётчики завершившихся потоков
+    # сворачиваются в один общий, чтобы при потоке на соединение список не рос.
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.accumulators = []
+        self.retired = _Accumulator()
+        self.registered = 0
+        self.started = time.time()
+
+    def _acc(self) -> _Accumulator:
+        try:
+            return self.local.acc
+        except AttributeError:
+            acc = self.local.acc = _Accumulator(threading.current_thread())
+            with self.lock:
+                self.accumulators.append(acc)
+                self.registered += 1
+                if self.registered % FOLD_EVERY == 0:
+                    self._fold_locked()
+            return acc
+
+    def _fold_locked(self):
+        alive = []
+        for acc in self.accumulators:
+            if acc.thread.is_alive():
+                alive.append(acc)
+            else:
+                self.retired.merge(acc)
+        self.accumulators = alive
+
+    def connection_opened(self):
+        self._acc().opened += 1
+
+    def connection_closed(self):
+        self._acc().closed += 1
+
+    def observe(self, entry: dict):
+        # entry — запись журнала запросов (см. AccessLog.begin)
+        acc = self._acc()
+        outcome = entry.get("cache") or "ERROR"
+        acc.outcomes[outcome] = acc.outcomes.get(outcome, 0) + 1
+        if outcome in CACHE_OUTCOMES:
+            source = "cache"
+        elif outcome in ORIGIN_OUTCOMES:
+            source = "origin"
+        elif outcome == "TUNNEL":
+            source = "tunnel"
+        else:
+            source = "other"
+        acc.bytes[source] = acc.bytes.get(source, 0) + entry.get("bytes", 0)
+        upstream_ms = entry.get("upstream_ms")
+        if upstream_ms is not None and entry.get("url"):
+            host = _host(entry["url"], entry.get("method"))
+            counts = acc.latency.get(host)
+            if counts is None:
+                if len(acc.latency) >= MAX_HOSTS:
+                    host = "other"
+                counts = acc.latency.setdefault(host, [0] * (len(LATENCY_BUCKETS_MS) + 2))
+            counts[bisect.bisect_left(LATENCY_BUCKETS_MS, upstream_ms)] += 1
+            counts[-1] += upstream_ms
+
+    def snapshot(self) -> dict:
+        total = _Accumulator()
+        with self.lock:
+            self._fold_locked()
+            total.merge(self.retired)
+            for acc in self.accumulators:
+                total.merge(acc)
+        served = sum(total.outcomes.get(o, 0) for o in CACHE_OUTCOMES + ORIGIN_OUTCOMES)
+        from_cache = sum(total.outcomes.get(o, 0) for o in CACHE_OUTCOMES)
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "threads": threading.active_count(),
+            "connections": {"active": total.opened - total.closed, "total": total.opened},
+            "outcomes": total.outcomes,
+            "hit_ratio": round(from_cache / served, 4) if served else None,
+            "bytes": total.bytes,
+            "upstream_latency_ms": {host: _histogram(counts) for host, counts in sorted(total.latency.items())},
+        }
+
+
+def _host(url: str, method: str = None) -> str:
+    if method == "CONNECT":
+        return url
+    parsed = urllib.parse.urlsplit(url if "://" in url else "http://" + url)
+    return parsed.netloc or "unknown"
+
+
+def _histogram(counts) -> dict:
+    # Корзины накопительные, как le в Prometheus: сколько ответов уложилось в N мс
+    count = sum(counts[:-1])
+    buckets, running = {}, 0
+    for bound, n in zip(LATENCY_BUCKETS_MS + ("+Inf",), counts):
+        running += n
+        buckets[str(bound)] = running
+    return {"count": count, "mean": round(counts[-1] / count, 1) if count else None, "buckets": buckets}
@@ -0,0 +1,52 @@
+import threading
+
+from metrics import Metrics, _Accumulator, MAX_HOSTS, LATENCY_BUCKETS_MS
+
+# Число хостов в гистограммах задержек ограничено MAX_HOSTS не только в одном потоке,
+# но и после сворачивания счётчиков завершившихся потоков.
+# Запуск: python3 metrics_tests.py
+
+
+def observe(metrics: Metrics, host: str):
+    metrics.observe({"cache": "MISS", "url": f"http://{host}/", "upstream_ms": 3, "bytes": 10})
+
+
+def test_merge_caps_hosts():
+    total = _Accumulator()
+    hosts = MAX_HOSTS * 3
+    for i in range(hosts):
+        acc = _Accumulator()
+        counts = acc.latency[f"host{i}"] = [0] * (len(LATENCY_BUCKETS_MS) + 2)
+        counts[0], counts[-1] = 1, 0.5
+        total.merge(acc)
+    assert len(total.latency) <= MAX_HOSTS + 1, len(total.latency)
+    assert sum(counts[0] for counts in total.latency.values()) == hosts
+    assert total.latency["other"][0] == hosts - MAX_HOSTS, total.latency["other"][0]
+    print(f"merge: {hosts} single-host accumulators -> {len(total.latency)} histograms")
+
+
+def test_retired_threads_capped():
+    # поток на соединение, как в proxy_server: каждый видит один хост
+    metrics = Metrics()
+    hosts = MAX_HOSTS * 2
+    for i in range(hosts):
+        t = threading.Thread(target=observe, args=(metrics, f"host{i}"))
+        t.start()
+        t.join()
+    snapshot = metrics.snapshot()
+    latency = snapshot["upstream_latency_ms"]
+    assert len(metrics.retired.latency) <= MAX_HOSTS + 1, len(metrics.retired.latency)
+    assert len(latency) <= MAX_HOSTS + 1, len(latency)
+    assert sum(h["count"] for h in latency.values()) == hosts
+    print(f"retired: {hosts} threads with one host each -> {len(latency)} histograms")
+
+
+def main():
+    print("=== Metrics tests ===\n")
+    test_merge_caps_hosts()
+    test_retired_threads_capped()
+    print("\n=== All metrics tests completed ===")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,269 @@
 import socket
 import threading
-import logging
+import traceback
 import os
 import sys
+import time
+import signal
+import argparse
+import email.utils
 import json
 import urllib.parse
 
+# Общий инкрементальный HTTP-парсер лежит рядом с сервером из lab03
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab03"))
+from http_parser import HTTPParser, HTTPParseError, HTTPMessage, MESSAGE_END
+from cache_store import CacheStore, CACHE_MAX_BYTES, MEMORY_MAX_BYTES, EVICTION_POLICIES
+from blacklist import BlacklistWatcher
+from access_log import AccessLog
+from metrics import Metrics
+from tunnel import Tunnel, parse_connect_target, CONNECT_ESTABLISHED, TUNNEL_IDLE_TIMEOUT, TUNNEL_CONNECT_TIMEOUT
+
 BUFFER_SIZE = 4096
+STREAM_BUFFER_SIZE = 64 * 1024  # столько байт ответа за раз читаем из upstream и отдаём клиенту
+MAX_REQUEST_BODY = 16 * 1024 * 1024
 CACHE_DIR = "cache"
 LOG_FILE = "proxy.log"
 BLACKLIST_FILE = "blacklist.txt"
-
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s")
-
-
-def load_blacklist():
-    if not os.path.exists(BLACKLIST_FILE):
-        return set()
-    with open(BLACKLIST_FILE, "r", encoding="utf‑8") as f:
-        return {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
-
-BLACKLIST = load_blacklist()
+UPSTREAM_IDLE_TIMEOUT = 30.0     # сколько простаивающее соединение с origin живёт в пуле
+UPSTREAM_MAX_IDLE_PER_HOST = 8   # и сколько таких соединений держим на один (host, port)
+# Запросы, которые можно безопасно повторить, если соединение из пула оказалось мёртвым
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"}
+# Заголовки, которые относятся только к одному соединению и дальше не пересылаются
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection"}
+# Эвристическая свежесть для ответов только с Last-Modified (RFC 9111, 4.2.2):
+# 10% от возраста документа, но не больше суток
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_AGE = 24 * 3600
+# Сколько клиент, присоединившийся к чужой загрузке, ждёт новых байт, прежде чем сдаться
+FLIGHT_WAIT_TIMEOUT = 30.0
+COALESCE_EXCLUDED_HEADERS = {"range", "authorization", "cookie", "if-none-match", "if-modified-since",
+                             "if-range"}
+# Заголовки ответа, которые 304 обновляет у сохранённой копии
+META_FIELDS = ("etag", "last-modified", "date", "expires", "cache-control", "age")
+BLOCKED_RESPONSE = (b"HTTP/1.1 403 Forbidden\r\nContent-Length: 24\r\nContent-Type: text/plain\r\n\r\n"
+                    b"Blocked by proxy server.")
+# Служебный адрес самого прокси: GET /__proxy/stats отдаёт метрики в JSON
+STATS_PATH = "/__proxy/stats"
+# Сколько может простаивать туннель CONNECT (задаётся --tunnel-idle-timeout)
+tunnel_idle_timeout = TUNNEL_IDLE_TIMEOUT
+
+# Журнал запросов пишется фоновым потоком (см. access_log.py), поток запускается в configure()
+ACCESS_LOG = AccessLog(LOG_FILE)
+METRICS = Metrics()
+
+
+# Чёрный список компилируется в суффиксное дерево доменов и автомат Ахо–Корасик
+# и пересобирается в фоне, когда blacklist.txt меняется (см. blacklist.py)
+BLACKLIST = BlacklistWatcher(BLACKLIST_FILE)
 
 
 def in_blacklist(url: str) -> bool:
-    parsed = urllib.parse.urlparse(url)
-    host = (parsed.hostname or "").lower()
-    url_l = url.lower()
-    return any(pat in host or pat in url_l for pat in BLACKLIST)
-
-
-def cache_path(url: str) -> str:
-    fname = urllib.parse.quote_plus(url)
-    return os.path.join(CACHE_DIR, fname)
+    return BLACKLIST.matches(url)
 
 
-def meta_path(url: str) -> str:
-    return cache_path(url) + ".meta"
+# Ответы и их метаданные хранятся в CacheStore (память + диск), индекс загружается в main()
+CACHE = CacheStore(CACHE_DIR)
 
 
-def save_response_to_cache(url: str, raw: bytes, headers: dict):
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    with open(cache_path(url), "wb") as f:
-        f.write(raw)
-    etag = headers.get("etag")
-    lm = headers.get("last-modified")
-    if etag or lm:
-        with open(meta_path(url), "w", encoding="utf‑8") as m:
-            json.dump({"etag": etag, "last-modified": lm}, m)
+def parse_cache_control(value: str) -> dict:
+    # "max-age=60, no-cache" -> {"max-age": "60", "no-cache": ""}
+    directives = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip().strip('"')
+    return directives
 
 
-def cached_response(url: str):
-    p = cache_path(url)
-    if os.path.exists(p):
-        with open(p, "rb") as f:
-            return f.read()
-    return None
+def _http_date(value):
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
 
 
-def conditional_headers(url: str) -> dict:
-    p = meta_path(url)
-    if not os.path.exists(p):
-        return {}
-    with open(p, "r", encoding="utf‑8") as m:
-        meta = json.load(m)
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_storable(request_headers: dict, response_headers: dict) -> bool:
+    # Ключи обоих словарей — имена заголовков в нижнем регистре
+    request_cc = parse_cache_control(request_headers.get("cache-control", ""))
+    response_cc = parse_cache_control(response_headers.get("cache-control", ""))
+    if "no-store" in request_cc or "no-store" in response_cc or "private" in response_cc:
+        return False
+    if response_headers.get("vary", "").strip() == "*":
+        return False
+    # ответ на запрос с авторизацией общий кэш хранит только с явного разрешения
+    if "authorization" in request_headers and not (
+            {"public", "s-maxage", "must-revalidate"} & response_cc.keys()):
+        return False
+    return True
+
+
+def vary_values(request_headers: dict, response_headers: dict) -> dict:
+    # Значения заголовков запроса, от которых по Vary зависит ответ
+    vary = [v.strip().lower() for v in response_headers.get("vary", "").split(",") if v.strip()]
+    return {name: request_headers.get(name) for name in vary}
+
+
+def make_meta(request_headers: dict, response_headers: dict, response_time: float) -> dict:
+    meta = {name: response_headers.get(name) for name in META_FIELDS}
+    meta["stored_at"] = response_time
+    # Для Vary запоминаем значения заголовков запроса, под которые сохранён ответ
+    meta["vary"] = vary_values(request_headers, response_headers)
+    return meta
+
+
+def vary_matches(meta: dict, request_headers: dict) -> bool:
+    return all(request_headers.get(name) == value for name, value in meta.get("vary", {}).items())
+
+
+def can_coalesce(method: str, request_headers: dict) -> bool:
+    # Запросы с Range, авторизацией, cookie или условные получают свой ответ
+    # (206, 304, данные конкретного пользователя) и с другими не объединяются
+    return method == "GET" and not (COALESCE_EXCLUDED_HEADERS & request_headers.keys())
+
+
+def shares_response(flight, request_headers: dict) -> bool:
+    # Подходит ли ответ, загруженный для ведущего запроса, другому запросу того же URL:
+    # только тот, что можно хранить в общем кэше (не private и не no-store),
+    # и только если совпадают заголовки из его Vary
+    return flight.shared and "*" not in flight.vary and vary_matches({"vary": flight.vary}, request_headers)
+
+
+def freshness(meta: dict, now: float = None):
+    # Возвращает (текущий возраст копии, срок её свежести) в секундах
+    now = time.time() if now is None else now
+    stored_at = meta.get("stored_at") or 0
+    date = _http_date(meta.get("date")) or stored_at
+    apparent_age = max(0.0, stored_at - date)
+    age = max(apparent_age, _seconds(meta.get("age")) or 0) + max(0.0, now - stored_at)
+
+    cc = parse_cache_control(meta.get("cache-control") or "")
+    if "no-cache" in cc or not stored_at:
+        return age, 0.0
+    for directive in ("s-maxage", "max-age"):  # мы общий кэш, s-maxage важнее
+        if directive in cc:
+            return age, float(_seconds(cc[directive]) or 0)
+    if meta.get("expires") is not None:
+        expires = _http_date(meta["expires"])
+        return age, max(0.0, expires - date) if expires is not None else 0.0
+    last_modified = _http_date(meta.get("last-modified"))
+    if last_modified is not None:
+        return age, min(HEURISTIC_MAX_AGE, max(0.0, (date - last_modified) * HEURISTIC_FRACTION))
+    return age, 0.0
+
+
+def is_fresh(meta: dict, request_headers: dict) -> bool:
+    request_cc = parse_cache_control(request_headers.get("cache-control", ""))
+    if "no-cache" in request_cc or "no-cache" in request_headers.get("pragma", "").lower():
+        return False
+    age, lifetime = freshness(meta)
+    max_age = _seconds(request_cc.get("max-age"))
+    if max_age is not None and age > max_age:
+        return False
+    return age < lifetime
+
+
+class UpstreamError(Exception):
+    # response_started — клиенту уже ушла часть ответа, 502 отправлять поздно
+    def __init__(self, message: str, response_started: bool = False):
+        super().__init__(message)
+        self.response_started = response_started
+
+
+def _is_stale(sock: socket.socket) -> bool:
+    # Простаивающее соединение ничего не должно присылать: EOF, ошибка или
+    # лишние данные означают, что origin его закрыл и использовать его нельзя
+    timeout = sock.gettimeout()
+    try:
+        sock.setblocking(False)
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    finally:
+        try:
+            sock.settimeout(timeout)
+        except OSError:
+            pass
+    return True
+
+
+class UpstreamPool:
+    # Постоянные (keep-alive) соединения с origin-серверами, список на каждый (host, port).
+    # acquire() отдаёт самое свежее живое соединение или открывает новое,
+    # release() возвращает его в пул, если ответ дочитан и сервер не просил закрыть.
+    def __init__(self, idle_timeout: float = UPSTREAM_IDLE_TIMEOUT,
+                 max_idle_per_host: int = UPSTREAM_MAX_IDLE_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.lock = threading.Lock()
+        self.idle = {}     # (host, port) -> [(sock, время возврата в пул)]
+        self.keys = {}     # sock -> (host, port) для всех выданных соединений
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, host: str, port: int):
+        key = (host, port)
+        while True:
+            with self.lock:
+                conns = self.idle.get(key)
+                if not conns:
+                    break
+                sock, released_at = conns.pop()
+            if time.monotonic() - released_at > self.idle_timeout or _is_stale(sock):
+                self._discard(sock)
+                continue
+            with self.lock:
+                self.reused += 1
+            return sock, True
+        sock = socket.create_connection(key)
+        with self.lock:
+            self.keys[sock] = key
+            self.created += 1
+        return sock, False
+
+    def release(self, sock: socket.socket, reusable: bool):
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            key = self.keys.get(sock)
+            if reusable and key is not None:
+                conns = self.idle.setdefault(key, [])
+                expired = [c for c in conns if now - c[1] > self.idle_timeout]
+                conns[:] = [c for c in conns if now - c[1] <= self.idle_timeout]
+                if len(conns) < self.max_idle_per_host:
+                    conns.append((sock, now))
+                    sock = None
+        for old, _ in expired:
+            self._discard(old)
+        if sock is not None:
+            self._discard(sock)
+
+    def _discard(self, sock: socket.socket):
+        with self.lock:
+            self.keys.pop(sock, None)
+        sock.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"idle": sum(len(c) for c in self.idle.values()), "open": len(self.keys),
+                    "created": self.created, "reused": self.reused}
+
+
+UPSTREAM_POOL = UpstreamPool()
+
+
+def conditional_headers(meta: dict) -> dict:
     hdrs = {}
     if meta.get("etag"):
         hdrs["If-None-Match"] = meta["etag"]
@@ -75,140 +272,497 @@ def conditional_headers(url: str) -> dict:
     return hdrs
 
 
-def recv_all(sock):
-    data = bytearray()
-    while True:
-        chunk = sock.recv(BUFFER_SIZE)
-        if not chunk:
-            break
-        data.extend(chunk)
-    return bytes(data)
-
-
-def forward_http(method: str, url: str, version: str, hdrs: dict, body: bytes):
+def build_upstream_request(method: str, url: str, version: str, hdrs: dict, body: bytes):
+    # Возвращает (host, port, байты запроса к origin)
     parsed = urllib.parse.urlparse(url)
     host = parsed.hostname
     port = parsed.port or 80
     path = parsed.path or "/"
-    print(f"[DEBUG] forward_http() called with method={method}, url={url}")
 
     if parsed.query:
         path += "?" + parsed.query
 
-    hdrs = {k: v for k, v in hdrs.items() if k.lower() != "proxy-connection"}
-    hdrs["Host"] = host
-    hdrs["Connection"] = "close"
-    if method == "GET":
-        hdrs.update(conditional_headers(url))
+    hdrs = {k: v for k, v in hdrs.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+    # Тело запроса уже собрано парсером (chunked раскодирован), поэтому пересылаем его с длиной
+    hdrs = {k: v for k, v in hdrs.items() if k.lower() not in ("transfer-encoding", "content-length")}
+    if body or method in ("POST", "PUT", "PATCH"):
+        hdrs["Content-Length"] = str(len(body))
+    hdrs["Host"] = host if port == 80 else f"{host}:{port}"
+    hdrs["Connection"] = "keep-alive"
 
     req_lines = [f"{method} {path} {version}"] + [f"{k}: {v}" for k, v in hdrs.items()] + ["", ""]
-    raw_req = "\r\n".join(req_lines).encode() + body
+    return host, port, "\r\n".join(req_lines).encode() + body
+
+
+def forward_http(method: str, url: str, version: str, hdrs: dict, body: bytes):
+    host, port, raw_req = build_upstream_request(method, url, version, hdrs, body)
+
+    # Читаем только заголовки ответа; тело потом пересылает relay_response.
+    # pending — все сырые байты, прочитанные до сих пор (включая 1xx и начало тела).
+    retries = 1 if method in IDEMPOTENT_METHODS else 0
+    while True:
+        try:
+            upstream, reused = UPSTREAM_POOL.acquire(host, port)
+        except OSError as e:
+            raise UpstreamError(f"cannot connect to {host}:{port}: {e}")
+        pending = bytearray()
+        try:
+            upstream.sendall(raw_req)
+            parser = HTTPParser("response")
+            parser.head_request = method == "HEAD"
+            while True:
+                event = parser.next_event()
+                if event is None:
+                    chunk = upstream.recv(STREAM_BUFFER_SIZE)
+                    if chunk:
+                        parser.feed(chunk)
+                        pending += chunk
+                    else:
+                        parser.feed_eof()
+                        if parser.idle:
+                            raise ConnectionResetError("upstream closed connection without response")
+                elif isinstance(event, HTTPMessage) and event.status >= 200:
+                    return upstream, parser, event, bytes(pending)
+        except HTTPParseError as e:
+            UPSTREAM_POOL.release(upstream, False)
+            raise UpstreamError(f"bad upstream response: {e}")
+        except OSError as e:
+            UPSTREAM_POOL.release(upstream, False)
+            # соединение из пула origin мог закрыть, пока оно простаивало —
+            # если ответа ещё не было, повторяем на новом соединении
+            if reused and retries and not pending and not isinstance(e, socket.timeout):
+                retries -= 1
+                continue
+            raise UpstreamError(f"upstream {host}:{port} failed: {e}")
+        except BaseException:
+            UPSTREAM_POOL.release(upstream, False)
+            raise
+
+
+def for_client(head: HTTPMessage, pending: bytes) -> bytes:
+    # Соединение с клиентом после ответа закрывается, поэтому keep-alive
+    # от origin ему не передаём, а прямо пишем Connection: close
+    start = pending.find(head.raw_head)
+    lines = head.raw_head[:-4].split(b"\r\n")
+    kept = [lines[0]] + [line for line in lines[1:]
+                         if line.split(b":", 1)[0].strip().lower().decode("latin-1") not in HOP_BY_HOP_HEADERS]
+    new_head = b"\r\n".join(kept + [b"Connection: close", b"", b""])
+    return pending[:start] + new_head + pending[start + len(head.raw_head):]
+
+
+def release_upstream(upstream, parser: HTTPParser, head: HTTPMessage):
+    # В пул возвращаем только соединение, на котором ответ дочитан до конца и без лишних байт
+    UPSTREAM_POOL.release(upstream, head.keep_alive and parser.idle)
+
+
+def _message_finished(parser: HTTPParser) -> bool:
+    # Парсер здесь нужен только чтобы найти конец ответа, сами байты идут как есть
+    while True:
+        event = parser.next_event()
+        if event is None:
+            return False
+        if event is MESSAGE_END:
+            return True
+
+
+def relay_response(upstream, parser: HTTPParser, pending: bytes, client, tee=None,
+                   survive_client_abort: bool = False) -> int:
+    # Отдаём ответ клиенту по мере прихода через один буфер фиксированного размера,
+    # попутно дописывая те же байты в кэш. Память на соединение не зависит от размера ответа.
+    # survive_client_abort — если клиент отключился, всё равно дочитать ответ в tee
+    # (его ждут другие клиенты).
+    buf = bytearray(STREAM_BUFFER_SIZE)
+    view = memoryview(buf)
+    data = pending
+    sent = 0
+    try:
+        while True:
+            if data:
+                if tee:
+                    tee.write(data)
+                if client is not None:
+                    try:
+                        client.sendall(data)
+                    except OSError:
+                        if not survive_client_abort:
+                            raise
+                        client = None
+                    sent += len(data)
+            if _message_finished(parser):
+                return sent
+            n = upstream.recv_into(buf)
+            if n:
+                data = view[:n]
+                parser.feed(data)
+            else:
+                data = b""
+                parser.feed_eof()
+    except HTTPParseError as e:
+        raise UpstreamError(f"bad upstream response: {e}", response_started=True)
+
+
+class Flight:
+    # Одна загрузка URL из origin, которую могут читать несколько клиентов сразу.
+    # Ведущий поток пишет ответ в файл кэша, остальные читают его через общий
+    # дескриптор (os.pread) по мере появления байт.
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.fd = None          # дескриптор на чтение временного файла с ответом
+        self.status = None      # статус, vary_values ответа и можно ли отдать его другим
+        self.vary = None        # клиентам (is_storable) — известны вместе с fd
+        self.shared = False
+        self.size = 0           # сколько байт ответа уже записано
+        self.done = False
+        self.failed = False
+        self.followers = 0
+
+    def start(self, path: str, status: int, vary: dict, shared: bool):
+        with self.cond:
+            self.fd = os.open(path, os.O_RDONLY)
+            self.status = status
+            self.vary = vary
+            self.shared = shared
+            self.cond.notify_all()
+
+    def advance(self, n: int):
+        with self.cond:
+            self.size += n
+            self.cond.notify_all()
+
+    def finish(self, failed: bool):
+        with self.cond:
+            self.done = True
+            self.failed = failed
+            self.cond.notify_all()
+            self._close_if_unused()
+
+    def leave(self):
+        with self.cond:
+            self.followers -= 1
+            self._close_if_unused()
+
+    def _close_if_unused(self):
+        if self.done and self.followers == 0 and self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SingleFlight:
+    # Реестр текущих загрузок: первый промах по URL становится ведущим,
+    # остальные одновременные запросы того же URL ждут его результат
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def join(self, key: str):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                with flight.cond:
+                    flight.followers += 1
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key: str, flight: Flight, failed: bool):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.finish(failed)
+
+
+FLIGHTS = SingleFlight()
+
+
+class FlightTee:
+    # Пишет ответ в кэш и будит клиентов, ждущих этот же ответ
+    def __init__(self, writer, flight: Flight):
+        self.writer = writer
+        self.flight = flight
+
+    def write(self, data):
+        self.writer.write(data)
+        self.writer.flush()
+        self.flight.advance(len(data))
+
+
+def follow_flight(flight: Flight, client, request_headers: dict) -> bool:
+    # Отдаёт клиенту ответ, который загружает другой поток.
+    # False — клиенту ещё ничего не отправлено, а ответа нет, он закрытый (private, no-store)
+    # или по Vary зависит от заголовков, которыми этот запрос отличается от ведущего.
+    offset = 0
+    try:
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.fd is not None or flight.done, FLIGHT_WAIT_TIMEOUT)
+            if flight.fd is None or not shares_response(flight, request_headers):
+                return False
+        while True:
+            with flight.cond:
+                deadline = time.monotonic() + FLIGHT_WAIT_TIMEOUT
+                while flight.size <= offset and not flight.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    flight.cond.wait(remaining)
+                size, done, failed, fd = flight.size, flight.done, flight.failed, flight.fd
+            if offset < size:
+                data = os.pread(fd, min(size - offset, STREAM_BUFFER_SIZE), offset)
+                client.sendall(data)
+                offset += len(data)
+                continue
+            if done and not failed:
+                return True
+            # загрузка оборвалась или зависла: если клиенту ещё ничего не ушло, он может попробовать сам
+            if offset == 0:
+                return False
+            raise UpstreamError("coalesced fetch failed", response_started=True)
+    finally:
+        flight.leave()
+
+
+def relay_and_cache(upstream, parser, head: HTTPMessage, pending: bytes, client, url: str,
+                    cache: bool, request_headers: dict = None, flight: Flight = None) -> int:
+    # Копия ответа пишется в кэш одновременно с отправкой клиенту; до commit()
+    # её никто не видит, поэтому оборванная загрузка не подменит старую копию.
+    # Если к загрузке присоединились другие клиенты (flight), ответ пишется в файл
+    # в любом случае, а в кэш попадает только когда cache=True.
+    response_time = time.time()  # от этого момента считается возраст копии
+    tee = CACHE.writer(url, spool=flight is not None) if cache or flight is not None else None
+    if flight is not None:
+        flight.start(tee.tmp_path, head.status, vary_values(request_headers or {}, head.headers),
+                     is_storable(request_headers or {}, head.headers))
+        tee = FlightTee(tee, flight)
+    writer = tee.writer if flight is not None else tee
+    try:
+        sent = relay_response(upstream, parser, for_client(head, pending), client, tee,
+                              survive_client_abort=flight is not None)
+    except BaseException:
+        if writer:
+            writer.abort()
+        UPSTREAM_POOL.release(upstream, False)
+        raise
+    release_upstream(upstream, parser, head)
+    if writer and cache:
+        writer.commit(make_meta(request_headers or {}, head.headers, response_time))
+    elif writer:
+        writer.abort()
+    return sent
+
+def stats_response(upstream_pool: dict, **extra) -> bytes:
+    stats = METRICS.snapshot()
+    stats.update(extra)
+    stats.update(cache=CACHE.stats(), upstream_pool=upstream_pool, access_log=ACCESS_LOG.stats(),
+                 blacklist_reloads=BLACKLIST.reloads)
+    body = json.dumps(stats, indent=2).encode()
+    return (f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Cache-Control: no-store\r\nConnection: close\r\n\r\n").encode() + body
+
+
+def _ms_since(started: float) -> float:
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def handle_connect(client, request: HTTPMessage, parser: HTTPParser, entry: dict):
+    # HTTPS и прочее поверх CONNECT: после "200 Connection Established" прокси
+    # просто пересылает байты в обе стороны, не заглядывая в них и ничего не кэшируя
+    host, port = parse_connect_target(request.target)
+    target = f"{host}:{port}"
+    if in_blacklist(target):
+        client.sendall(BLOCKED_RESPONSE)
+        entry.update(status=403, cache="BLOCK", bytes=len(BLOCKED_RESPONSE))
+        return
+    started = time.monotonic()
+    try:
+        upstream = socket.create_connection((host, port), timeout=TUNNEL_CONNECT_TIMEOUT)
+    except OSError as e:
+        raise UpstreamError(f"cannot connect to {target}: {e}")
+    entry["upstream_ms"] = _ms_since(started)
+    with upstream:
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.sendall(CONNECT_ESTABLISHED)
+        entry.update(status=200, cache="TUNNEL")
+        tunnel = Tunnel(client, upstream, tunnel_idle_timeout)
+        try:
+            # байты, пришедшие сразу за CONNECT (например, начало TLS ClientHello), уже в парсере
+            tunnel.run(parser.take_buffered())
+        finally:
+            entry.update(bytes=tunnel.bytes_down, bytes_up=tunnel.bytes_up, idle_timeout=tunnel.idle_closed)
 
-    with socket.create_connection((host, port)) as upstream:
-        upstream.sendall(raw_req)
-        return recv_all(upstream)
 
 def handle_client(client, addr):
-    print(f"[DEBUG] New connection from {addr}")
+    # Всё, что известно о запросе, собирается в entry и одной записью уходит в журнал
+    entry = ACCESS_LOG.begin(f"{addr[0]}:{addr[1]}")
+    METRICS.connection_opened()
     try:
-        buff = bytearray()
-        while b"\r\n\r\n" not in buff:
+        parser = HTTPParser("request", max_body_size=MAX_REQUEST_BODY)
+        request = None
+        while request is None:
             chunk = client.recv(BUFFER_SIZE)
             if not chunk:
-                client.close()
                 return
-            buff.extend(chunk)
-        hdr_part, body = buff.split(b"\r\n\r\n", 1)
-        lines = hdr_part.decode(errors="replace").split("\r\n")
-        if len(lines) < 1:
-            client.close()
+            parser.feed(chunk)
+            request = parser.next_message()
+        method, url, version = request.method, request.target, request.version
+        entry.update(method=method, url=url)
+        if method == "CONNECT":
+            handle_connect(client, request, parser, entry)
+            return
+        if method == "GET" and url == STATS_PATH:
+            response = stats_response(UPSTREAM_POOL.stats())
+            client.sendall(response)
+            entry.update(status=200, cache="STATS", bytes=len(response))
             return
-        method, url, version = lines[0].split()
         if url.startswith("/"):
             url = url.lstrip("/")
-        headers = {}
-        for line in lines[1:]:
-            if ":" in line:
-                k, v = line.split(":", 1)
-                headers[k.strip()] = v.strip()
-
-        if method.upper() == "POST":
-            need = int(headers.get("Content-Length", "0"))
-            while len(body) < need:
-                body += client.recv(BUFFER_SIZE)
-        else:
-            body = b""
-        method = method.upper()
+            entry["url"] = url
+        # имена заголовков пересылаем в том виде, в каком их прислал клиент
+        headers = dict(request.header_list)
+        body = request.body
 
         if in_blacklist(url):
-            msg = b"HTTP/1.1 403 Forbidden\r\nContent-Length: 25\r\nContent-Type: text/plain\r\n\r\nBlocked by proxy server."
-            client.sendall(msg)
-            logging.info(f"BLOCK {url}")
+            client.sendall(BLOCKED_RESPONSE)
+            entry.update(status=403, cache="BLOCK", bytes=len(BLOCKED_RESPONSE))
             return
 
-        if method == "GET":
-            cached = cached_response(url)
-            if cached:
-                resp = forward_http(method, url, version, headers, b"")
-                code = int(resp.split(b" ")[1])
-                if code == 304:  # Not Modified
-                    client.sendall(cached)
-                    logging.info(f"CACHE‑HIT {url} -> 200 (304)")
+        meta = CACHE.get_meta(url) if method == "GET" else None
+        # копия, сохранённая под другие значения Vary-заголовков, этому клиенту не подходит
+        if meta is not None and vary_matches(meta, request.headers):
+            # Свежую копию отдаём с диска, вообще не обращаясь к origin
+            if is_fresh(meta, request.headers):
+                sent = CACHE.send(client, url)
+                if sent:
+                    entry.update(status=200, cache="HIT", bytes=sent)
                     return
-                else:
-                    # Обновляем кеш
-                    head = resp.split(b"\r\n\r\n", 1)[0]
-                    save_response_to_cache(url, resp, parse_headers(head))
-                    client.sendall(resp)
-                    logging.info(f"CACHE‑UPDATE {url} -> {code}")
+            revalidate = {k: v for k, v in headers.items()
+                          if k.lower() not in ("if-none-match", "if-modified-since")}
+            revalidate.update(conditional_headers(meta))
+            started = time.monotonic()
+            upstream, parser, head, pending = forward_http(method, url, version, revalidate, b"")
+            entry["upstream_ms"] = _ms_since(started)
+            if head.status == 304:  # Not Modified
+                # у 304 нет тела — соединение с origin сразу возвращаем в пул
+                try:
+                    _message_finished(parser)
+                except HTTPParseError:
+                    pass
+                release_upstream(upstream, parser, head)
+                # 304 продлевает свежесть копии и может обновить её заголовки
+                meta.update({name: head.headers[name] for name in META_FIELDS if name in head.headers})
+                meta["stored_at"] = time.time()
+                CACHE.update_meta(url, meta)
+                sent = CACHE.send(client, url)
+                if sent:
+                    entry.update(status=200, cache="REVALIDATED", bytes=sent)
                     return
+                # файл кэша успели удалить — отдаём 304 как есть
+                response = for_client(head, pending)
+                client.sendall(response)
+                entry.update(status=304, cache="MISS", bytes=len(response))
+                return
+            # Обновляем кеш
+            storable = head.status == 200 and is_storable(request.headers, head.headers)
+            if not storable:
+                CACHE.remove(url)
+            entry.update(status=head.status, cache="UPDATE")
+            entry["bytes"] = relay_and_cache(upstream, parser, head, pending, client, url, storable,
+                                             request.headers)
+            return
 
-        resp = forward_http(method, url, version, headers, body)
-        code = int(resp.split(b" ")[1])
-        client.sendall(resp)
-
-        if method == "GET" and code == 200:
-            head = resp.split(b"\r\n\r\n", 1)[0]
-            save_response_to_cache(url, resp, parse_headers(head))
-
-        logging.info(f"{method} {url} -> {code}")
-
-
-    except Exception as e:
-
-        import traceback
-
-        print("[DEBUG] Exception in handle_client():")
-
-        traceback.print_exc()
-
-        logging.exception("handler-error")
+        # Одновременные промахи по одному URL идут в origin одним запросом (см. can_coalesce)
+        flight = None
+        if can_coalesce(method, request.headers):
+            flight, leader = FLIGHTS.join(url)
+            if not leader:
+                if follow_flight(flight, client, request.headers):
+                    entry.update(status=flight.status, cache="COALESCED", bytes=flight.size)
+                    return
+                flight = None
 
+        failed = True
+        try:
+            started = time.monotonic()
+            upstream, parser, head, pending = forward_http(method, url, version, headers, body)
+            entry.update(upstream_ms=_ms_since(started), status=head.status,
+                         cache="MISS" if method == "GET" else "BYPASS")
+            entry["bytes"] = relay_and_cache(
+                upstream, parser, head, pending, client, url,
+                method == "GET" and head.status == 200 and is_storable(request.headers, head.headers),
+                request.headers, flight)
+            failed = False
+        finally:
+            if flight is not None:
+                FLIGHTS.finish(url, flight, failed)
+
+    except UpstreamError as e:
+        entry["error"] = str(e)
+        if e.response_started:
+            return
+        entry["status"] = 502
+        try:
+            client.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except Exception:
+            pass
+        return
+    except HTTPParseError as e:
+        entry.update(status=e.status, error=str(e))
+        try:
+            client.sendall(f"HTTP/1.1 {e.status} Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        except Exception:
+            pass
+        return
+    except Exception:
+        # трассировка уходит в журнал вместе с запросом, а не в stdout потока-обработчика
+        entry.update(status=500, error=traceback.format_exc())
         try:
-
             client.sendall(b"HTTP/1.1 500 Internal Server Error\r\n\r\n")
-
         except Exception:
-
             pass
-
         return
     finally:
         client.close()
+        METRICS.connection_closed()
+        if entry["method"] is not None or entry["status"] is not None:
+            METRICS.observe(entry)
+            ACCESS_LOG.finish(entry)
+
+def build_arg_parser(description: str = "Кэширующий HTTP-прокси") -> argparse.ArgumentParser:
+    # Общие параметры для обоих движков прокси (потоки и asyncio)
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("port", type=int)
+    parser.add_argument("--cache-mb", type=float, default=CACHE_MAX_BYTES / (1024 * 1024),
+                        help="бюджет дискового кэша, МБ")
+    parser.add_argument("--memory-cache-mb", type=float, default=MEMORY_MAX_BYTES / (1024 * 1024),
+                        help="бюджет кэша горячих объектов в памяти, МБ (0 — выключить)")
+    parser.add_argument("--cache-policy", choices=EVICTION_POLICIES, default="lru",
+                        help="как вытеснять объекты при переполнении")
+    parser.add_argument("--tunnel-idle-timeout", type=float, default=TUNNEL_IDLE_TIMEOUT,
+                        help="через сколько секунд простоя закрывать туннель CONNECT")
+    return parser
+
+
+def configure(args):
+    global tunnel_idle_timeout
+    tunnel_idle_timeout = args.tunnel_idle_timeout
+    CACHE.max_bytes = int(args.cache_mb * 1024 * 1024)
+    CACHE.memory_max_bytes = int(args.memory_cache_mb * 1024 * 1024)
+    if not CACHE.memory_max_bytes:
+        CACHE.memory_max_object = 0
+    CACHE.policy = args.cache_policy
+    CACHE.load()
+    CACHE.start()
+    print(f"[+] Cache: {CACHE.stats()}")
+    BLACKLIST.start()
+    ACCESS_LOG.start()
+    # при SIGTERM тоже выходим через finally, чтобы сохранить индекс кэша
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-def parse_headers(raw: bytes) -> dict:
-    headers = {}
-    for line in raw.decode(errors="replace").split("\r\n")[1:]:
-        if ":" in line:
-            k, v = line.split(":", 1)
-            headers[k.lower()] = v.strip()
-    return headers
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python proxy_server.py <port>")
-        return
-    port = int(sys.argv[1])
+    args = build_arg_parser().parse_args()
+    configure(args)
+    port = args.port
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(("", port))
@@ -223,6 +777,8 @@ def main():
         print("\n[!] Shutting down…")
     finally:
         server.close()
+        CACHE.save()
+        ACCESS_LOG.close()
 
 if __name__ == "__main__":
     main()
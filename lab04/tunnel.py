@@ -0,0 +1,148 @@
+import socket
+import threading
+import time
+
+from http_parser import HTTPParseError
+
+TUNNEL_BUFFER_SIZE = 256 * 1024   # буфер на одно направление туннеля
+TUNNEL_IDLE_TIMEOUT = 300.0       # туннель, по которому столько секунд ничего не шло, закрывается
+TUNNEL_CONNECT_TIMEOUT = 10.0
+TUNNEL_POLL_INTERVAL = 5.0        # как часто направление, ждущее данных, проверяет простой туннеля
+MAX_FREE_BUFFERS = 64             # столько свободных буферов держим для следующих туннелей
+DEFAULT_CONNECT_PORT = 443
+
+CONNECT_ESTABLISHED = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+
+
+def parse_connect_target(target: str):
+    # CONNECT host:port, IPv6 — в квадратных скобках ([::1]:443)
+    if target.startswith("["):
+        host, _, rest = target[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else rest
+    else:
+        host, sep, port = target.rpartition(":")
+        if not sep:
+            host, port = target, ""
+    if not host or ":" in host and not target.startswith("["):
+        raise HTTPParseError(f"bad CONNECT target {target!r}")
+    try:
+        port = int(port) if port else DEFAULT_CONNECT_PORT
+    except ValueError:
+        raise HTTPParseError(f"bad CONNECT port {target!r}")
+    if not 0 < port < 65536:
+        raise HTTPParseError(f"bad CONNECT port {target!r}")
+    return host, port
+
+
+class BufferPool:
+    # Буферы туннелей выделяются один раз и переиспользуются следующими туннелями,
+    # чтобы не выделять и не обнулять по 256 КБ на каждое соединение
+    def __init__(self, size: int = TUNNEL_BUFFER_SIZE, max_free: int = MAX_FREE_BUFFERS):
+        self.size = size
+        self.max_free = max_free
+        self.lock = threading.Lock()
+        self.free = []
+
+    def acquire(self) -> memoryview:
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return memoryview(bytearray(self.size))
+
+    def release(self, buf: memoryview):
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(buf)
+
+
+BUFFERS = BufferPool()
+
+
+class Tunnel:
+    # Двунаправленная пересылка байт между клиентом и origin после CONNECT.
+    # Содержимое (обычно TLS) не разбирается. Каждое направление — свой поток
+    # со своим буфером: recv_into в заранее выделенный memoryview и send его срезов без копий.
+    # EOF с одной стороны передаётся другой через shutdown(SHUT_WR) (half-close),
+    # туннель закрывается, когда закрыты оба направления или он простаивает idle_timeout.
+    def __init__(self, client: socket.socket, upstream: socket.socket,
+                 idle_timeout: float = TUNNEL_IDLE_TIMEOUT, buffers: BufferPool = BUFFERS):
+        self.client = client
+        self.upstream = upstream
+        self.idle_timeout = idle_timeout
+        self.buffers = buffers
+        self.bytes_up = 0       # клиент -> origin
+        self.bytes_down = 0     # origin -> клиент
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.idle_closed = False
+
+    def run(self, initial: bytes = b""):
+        # initial — байты, которые клиент прислал сразу за заголовками CONNECT
+        poll = min(self.idle_timeout, TUNNEL_POLL_INTERVAL)
+        self.client.settimeout(poll)
+        self.upstream.settimeout(poll)
+        if initial:
+            self.upstream.sendall(initial)
+            self.bytes_up += len(initial)
+        down = threading.Thread(target=self._pump, args=(self.upstream, self.client, False),
+                                name="tunnel-down", daemon=True)
+        down.start()
+        self._pump(self.client, self.upstream, True)
+        down.join()
+
+    @property
+    def duration(self) -> float:
+        return time.monotonic() - self.started
+
+    def _pump(self, src: socket.socket, dst: socket.socket, upstream_bound: bool):
+        buf = self.buffers.acquire()
+        try:
+            while True:
+                try:
+                    n = src.recv_into(buf)
+                except socket.timeout:
+                    if self._idle():
+                        return
+                    continue
+                if not n:
+                    break
+                self.last_activity = time.monotonic()
+                view = buf[:n]
+                while view:
+                    try:
+                        sent = dst.send(view)
+                    except socket.timeout:
+                        # получатель медленный, но пока туннель не простаивает, ждём дальше
+                        if self._idle():
+                            return
+                        continue
+                    self.last_activity = time.monotonic()
+                    view = view[sent:]
+                if upstream_bound:
+                    self.bytes_up += n
+                else:
+                    self.bytes_down += n
+            # src закончил передачу: сообщаем об этом dst, обратное направление ещё работает
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+        except OSError:
+            self._abort()
+        finally:
+            self.buffers.release(buf)
+
+    def _idle(self) -> bool:
+        if time.monotonic() - self.last_activity < self.idle_timeout:
+            return False
+        # простой в обе стороны: рвём туннель целиком, второе направление проснётся с ошибкой
+        self.idle_closed = True
+        self._abort()
+        return True
+
+    def _abort(self):
+        for sock in (self.client, self.upstream):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass